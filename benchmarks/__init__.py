@@ -0,0 +1,12 @@
+# -*- coding: utf-8 -*-
+"""Benchmarks for the ingestion pipeline.
+
+Each module can be run on its own, e.g. ``python -m benchmarks.serialization``:
+
+    pipeline        timings of each ingestion stage on a synthetic repository,
+                    as JSON that can be compared between versions
+    synthetic       generator of synthetic, kernel-like, git repositories
+    serialization   message serialization
+    partitioning    consumer member locality of the partition key strategies
+    prepare         activity preparation, in process and with workers
+"""
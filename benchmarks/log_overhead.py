@@ -0,0 +1,95 @@
+# -*- coding: utf-8 -*-
+"""Overhead of logging on the ingestion loop, with each logging mode.
+
+Serializes prepared activities as send_messages does and logs one message for each
+of a share of them (--log-ratio), as a run with many failed deliveries or bad
+commits would. Each mode is timed against the same loop without logging; the
+time the background listener needs to write what is still queued is reported
+apart as drain.
+
+    python -m benchmarks.log_overhead --commits 20000 --log-ratio 1 2> /dev/null
+"""
+import json
+import time
+import shutil
+import argparse
+import tempfile
+
+import crowdgit.logger
+from crowdgit.activity import prepare_crowd_activities
+from crowdgit.serialization import Envelope
+from benchmarks.prepare import make_commits
+
+# name, LOG_MODE, LOG_SAMPLING, LOG_MAX_BYTES; sync-10kb is the former setup
+MODES = (
+    ("sync-10kb", "sync", "", 10_000),
+    ("sync", "sync", "", crowdgit.logger.LOG_MAX_BYTES),
+    ("queue", "queue", "", crowdgit.logger.LOG_MAX_BYTES),
+    ("queue-sampled-100", "queue", "benchmark-queue-sampled-100=100", crowdgit.logger.LOG_MAX_BYTES),
+)
+
+
+def ingest(activities, logger, log_every: int):
+    envelope = Envelope("tenant", "segment", "integration")
+    latencies = []
+    for i, activity in enumerate(activities):
+        envelope.serialize(activity)
+        if logger is not None and i % log_every == 0:
+            start = time.perf_counter()
+            logger.error("Failed to deliver message %s: %s", activity["sourceId"], "timed out")
+            latencies.append(time.perf_counter() - start)
+    return latencies
+
+
+def run(name, activities, log_every, mode, sampling, max_bytes):
+    crowdgit.logger.LOG_MODE = mode
+    crowdgit.logger.LOG_SAMPLING = sampling
+    crowdgit.logger.LOG_MAX_BYTES = max_bytes
+    logger = crowdgit.logger.get_logger(f"benchmark-{name}")
+
+    start = time.perf_counter()
+    latencies = ingest(activities, logger, log_every)
+    elapsed = time.perf_counter() - start
+    start = time.perf_counter()
+    crowdgit.logger.stop_listener()
+    drain = time.perf_counter() - start
+
+    latencies.sort()
+    return {
+        "mode": name,
+        "seconds": round(elapsed, 3),
+        "drain_seconds": round(drain, 3),
+        "log_calls": len(latencies),
+        "p50_us": round(latencies[len(latencies) // 2] * 1e6, 1),
+        "p99_us": round(latencies[int(len(latencies) * 0.99)] * 1e6, 1),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark the logging overhead.")
+    parser.add_argument("--commits", type=int, default=10_000)
+    parser.add_argument("--log-ratio", type=float, default=1.0, help="Share of activities logged.")
+    args = parser.parse_args()
+
+    log_every = max(1, round(1 / args.log_ratio))
+    activities = prepare_crowd_activities("https://github.com/user/repo", make_commits(args.commits))
+
+    # Logs and rotations go to a scratch directory
+    log_dir = tempfile.mkdtemp(prefix="crowdgit-log-benchmark-")
+    crowdgit.logger.LOCAL_DIR = log_dir
+    try:
+        start = time.perf_counter()
+        ingest(activities, None, log_every)
+        baseline = time.perf_counter() - start
+
+        results = [run(name, activities, log_every, *mode) for name, *mode in MODES]
+    finally:
+        shutil.rmtree(log_dir, ignore_errors=True)
+
+    for result in results:
+        result["overhead_seconds"] = round(result["seconds"] - baseline, 3)
+    print(json.dumps({"baseline_seconds": round(baseline, 3), "modes": results}, indent=2))
+
+
+if __name__ == "__main__":
+    main()
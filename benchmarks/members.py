@@ -0,0 +1,97 @@
+# -*- coding: utf-8 -*-
+"""Members of the prepared activities: built for every activity, as they used to
+be, and interned once per distinct (name, email) by IdentityTable.
+
+Reports the time to build the members of every activity, and the memory they
+hold once built, measured with tracemalloc.
+
+    python -m benchmarks.members --commits 100000
+"""
+import json
+import time
+import argparse
+import tracemalloc
+
+from benchmarks.prepare import make_commits
+from crowdgit.activity import IdentityTable, clean_up_username, extract_activities
+
+# Without the memoization, as it used to run twice per activity
+_clean_up_username = clean_up_username.__wrapped__
+
+
+def legacy_member(name: str, email: str, platform: str = "git") -> dict:
+    """The member prepare_crowd_activities used to build for each activity of a trailer."""
+    member = {"username": email, "displayName": name, "emails": [email]}
+    if not member["username"]:
+        member["username"] = member["emails"][0]
+    if not member["displayName"]:
+        member["displayName"] = member["emails"][0].split("@")[0]
+    member["username"] = _clean_up_username(member["username"])
+    member["displayName"] = _clean_up_username(member["displayName"])
+    member["identities"] = [
+        {
+            "platform": platform,
+            "value": member["emails"][0],
+            "type": "username",
+            "verified": True,
+        }
+    ] + [
+        {"platform": platform, "value": email, "type": "email", "verified": False}
+        for email in member["emails"]
+    ]
+    del member["username"]
+    del member["emails"]
+    return member
+
+
+def people_of(commits):
+    """The (name, email) of every activity of `commits`, in order."""
+    people = []
+    for commit in commits:
+        people.append((commit["author_name"], commit["author_email"]))
+        people.append((commit["committer_name"], commit["committer_email"]))
+        for activity in extract_activities(commit["message"]):
+            person = next(iter(activity.values()))
+            people.append((person["name"], person["email"]))
+    return people
+
+
+def run(name, build, people):
+    tracemalloc.start()
+    start = time.perf_counter()
+    members = build(people)
+    elapsed = time.perf_counter() - start
+    retained, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return {
+        "name": name,
+        "activities": len(members),
+        "members": len({id(member) for member in members}),
+        "seconds": round(elapsed, 4),
+        "retained_mb": round(retained / 1e6, 2),
+        "peak_mb": round(peak / 1e6, 2),
+    }
+
+
+def interned(people):
+    table = IdentityTable()
+    return [table.member(name, email) for name, email in people]
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark the members of the activities.")
+    parser.add_argument("--commits", type=int, default=100_000)
+    parser.add_argument("--members", type=int, default=2000)
+    args = parser.parse_args()
+
+    people = people_of(make_commits(args.commits, members=args.members))
+    clean_up_username.cache_clear()
+    results = [
+        run("per-activity", lambda p: [legacy_member(name, email) for name, email in p], people),
+        run("interned", interned, people),
+    ]
+    print(json.dumps(results, indent=2))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,97 @@
+# -*- coding: utf-8 -*-
+"""Member locality of the messages each consumer sees, per partition key strategy.
+
+Simulates the downstream upsert workers: messages are hashed to partitions by
+key, as Kafka does, and each partition is consumed in polls of --batch
+messages. A worker upserts each distinct member of a poll once, and keeps the
+last --cache members it upserted. Reported per strategy:
+
+    lookups_per_activity  member upserts per activity (lower is better)
+    cache_hit_rate        share of polled members found in the worker's cache
+
+    python -m benchmarks.partitioning --activities 100000 --members 2000
+"""
+import json
+import random
+import zlib
+import argparse
+from collections import OrderedDict
+
+from crowdgit.partitioning import RANDOM, MEMBER, REPO, partition_key, group_by_key
+
+
+def make_records(n: int, members: int, seed: int = 0):
+    """Activities in commit order, their authors following a Zipf-like law as in real
+    repositories: a few members author most commits."""
+    rnd = random.Random(seed)
+    weights = [1 / (rank + 1) for rank in range(members)]
+    authors = rnd.choices(range(members), weights=weights, k=n)
+    return [
+        {
+            "sourceId": "%040x" % i,
+            "member": {
+                "displayName": f"Member {author}",
+                "identities": [{"value": f"member{author}@example.com", "type": "username"}],
+            },
+        }
+        for i, author in enumerate(authors)
+    ]
+
+
+def consume(keyed, partitions: int, batch: int, cache_size: int):
+    queues = [[] for _ in range(partitions)]
+    for key, _, record in keyed:
+        queues[zlib.crc32(key.encode("utf-8")) % partitions].append(record)
+
+    lookups = hits = polled_members = 0
+    for queue in queues:
+        cache = OrderedDict()
+        for start in range(0, len(queue), batch):
+            members = {r["member"]["identities"][0]["value"] for r in queue[start : start + batch]}
+            polled_members += len(members)
+            for member in members:
+                if member in cache:
+                    hits += 1
+                    cache.move_to_end(member)
+                    continue
+                lookups += 1
+                cache[member] = True
+                if len(cache) > cache_size:
+                    cache.popitem(last=False)
+    return lookups, hits, polled_members
+
+
+def run(name, records, strategy, grouped, args):
+    keyed = [(partition_key(r, strategy, "repo"), i, r) for i, r in enumerate(records)]
+    if grouped:
+        keyed = group_by_key(keyed)
+    lookups, hits, polled = consume(keyed, args.partitions, args.batch, args.cache)
+    return {
+        "name": name,
+        "activities": len(records),
+        "lookups_per_activity": round(lookups / len(records), 4),
+        "cache_hit_rate": round(hits / polled, 4),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark consumer member locality.")
+    parser.add_argument("--activities", type=int, default=100_000)
+    parser.add_argument("--members", type=int, default=2000)
+    parser.add_argument("--partitions", type=int, default=12)
+    parser.add_argument("--batch", type=int, default=500, help="Messages per consumer poll.")
+    parser.add_argument("--cache", type=int, default=100, help="Members cached per worker.")
+    args = parser.parse_args()
+
+    records = make_records(args.activities, args.members)
+    results = [
+        run("random", records, RANDOM, False, args),
+        run("repo", records, REPO, False, args),
+        run("member", records, MEMBER, False, args),
+        run("member-grouped", records, MEMBER, True, args),
+    ]
+    print(json.dumps(results, indent=2))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,183 @@
+# -*- coding: utf-8 -*-
+"""Timings of each stage of the ingestion of a synthetic repository.
+
+Generates a repository with benchmarks.synthetic (or uses --repo) and times
+get_commits, get_insertions_deletions, extract_activities,
+prepare_crowd_activities and Queue.send_messages, the latter against an
+in-memory producer. The results are printed, and written with --output, as
+JSON; pass the results of another version with --baseline to compare.
+
+    python -m benchmarks.pipeline --commits 20000 --output results.json
+    git checkout other-version
+    python -m benchmarks.pipeline --commits 20000 --baseline results.json
+"""
+import os
+import sys
+import json
+import time
+import shutil
+import argparse
+import platform
+import tempfile
+import subprocess
+from dataclasses import asdict
+
+from benchmarks.synthetic import RepoSpec, generate_repo
+
+REMOTE = "https://git.example.com/synthetic/repo"
+
+
+class MockProducer:
+    """Stands in for confluent_kafka.Producer: every message is delivered on the
+    next poll."""
+
+    def __init__(self, config):
+        self.config = config
+        self.pending = []
+        self.messages = 0
+        self.bytes = 0
+
+    def produce(self, topic, key=None, value=None, on_delivery=None):
+        self.pending.append(on_delivery)
+        self.messages += 1
+        self.bytes += len(key or "") + len(value or b"")
+
+    def poll(self, timeout=None):
+        pending, self.pending = self.pending, []
+        for on_delivery in pending:
+            if on_delivery is not None:
+                on_delivery(None, None)
+        return len(pending)
+
+    def flush(self, timeout=None):
+        self.poll()
+        return 0
+
+
+def make_queue():
+    os.environ.setdefault("TENANT_ID", "benchmark-tenant")
+    os.environ.setdefault("KAFKA_TOPIC", "benchmark-topic")
+    os.environ.setdefault("KAFKA_BROKERS", "localhost:9092")
+    import crowdgit.producer
+    from crowdgit.ingest import Queue
+
+    crowdgit.producer.Producer = MockProducer
+    crowdgit.producer.KAFKA_POLL_INTERVAL_SECONDS = 0
+    return Queue()
+
+
+def timed(stages, name, func, count=len, **extra):
+    start = time.perf_counter()
+    result = func()
+    elapsed = time.perf_counter() - start
+    items = count(result)
+    stages.append(
+        {
+            "stage": name,
+            "seconds": round(elapsed, 4),
+            "items": items,
+            "items_per_second": round(items / elapsed) if elapsed else None,
+            **extra,
+        }
+    )
+    return result
+
+
+def version() -> str:
+    here = os.path.dirname(os.path.abspath(__file__))
+    try:
+        return subprocess.check_output(
+            ["git", "-C", here, "describe", "--always", "--dirty"], text=True
+        ).strip()
+    except (subprocess.CalledProcessError, OSError):
+        return "unknown"
+
+
+def run(repo_path: str):
+    from crowdgit.repo import get_commits, get_insertions_deletions
+    from crowdgit.activity import extract_activities, prepare_crowd_activities
+
+    stages = []
+    commits = timed(stages, "get_commits", lambda: get_commits(repo_path, "*"))
+    changes = timed(
+        stages, "get_insertions_deletions", lambda: get_insertions_deletions(repo_path, "*")
+    )
+    for commit in commits:
+        commit.update(changes.get(commit["hash"], {}))
+
+    timed(
+        stages,
+        "extract_activities",
+        lambda: [extract_activities(commit["message"]) for commit in commits],
+        count=lambda result: sum(map(len, result)),
+    )
+    activities = timed(
+        stages, "prepare_crowd_activities", lambda: prepare_crowd_activities(REMOTE, commits)
+    )
+
+    queue = make_queue()
+    timed(
+        stages,
+        "send_messages",
+        lambda: queue.send_messages("segment", "integration", activities),
+        count=lambda stats: stats["delivered"],
+    )
+    stages[-1]["bytes"] = queue.kafka_producer.bytes
+    return stages
+
+
+def compare(stages, baseline):
+    before = {stage["stage"]: stage for stage in baseline["stages"]}
+    print(f"{'stage':28} {'baseline s':>11} {'current s':>11} {'speedup':>8}", file=sys.stderr)
+    for stage in stages:
+        old = before.get(stage["stage"])
+        if old is None:
+            continue
+        speedup = old["seconds"] / stage["seconds"] if stage["seconds"] else float("inf")
+        print(
+            f"{stage['stage']:28} {old['seconds']:11.3f} {stage['seconds']:11.3f} {speedup:7.2f}x",
+            file=sys.stderr,
+        )
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark the ingestion stages.")
+    parser.add_argument("--repo", help="Existing repository to benchmark, instead of generating one.")
+    parser.add_argument("--output", help="Write the results to this JSON file.")
+    parser.add_argument("--baseline", help="Results of another version to compare with.")
+    for name, default in asdict(RepoSpec()).items():
+        parser.add_argument(f"--{name.replace('_', '-')}", type=type(default), default=default)
+    args = parser.parse_args()
+
+    spec = RepoSpec(**{name: getattr(args, name) for name in asdict(RepoSpec())})
+    temp_dir = None
+    repo_path = args.repo
+    if repo_path is None:
+        temp_dir = tempfile.mkdtemp(prefix="crowdgit-benchmark-")
+        repo_path = generate_repo(os.path.join(temp_dir, "repo"), spec)
+
+    try:
+        stages = run(repo_path)
+    finally:
+        if temp_dir is not None:
+            shutil.rmtree(temp_dir, ignore_errors=True)
+
+    results = {
+        "version": version(),
+        "python": platform.python_version(),
+        "git": subprocess.check_output(["git", "--version"], text=True).strip(),
+        "repo": args.repo,
+        "spec": None if args.repo else asdict(spec),
+        "stages": stages,
+    }
+    print(json.dumps(results, indent=2))
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as fout:
+            json.dump(results, fout, indent=2)
+    if args.baseline:
+        with open(args.baseline, "r", encoding="utf-8") as fin:
+            compare(stages, json.load(fin))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,81 @@
+# -*- coding: utf-8 -*-
+"""Activity preparation, in process and with a pool of workers.
+
+    python -m benchmarks.prepare --commits 200000 --workers 4
+"""
+import json
+import time
+import random
+import argparse
+
+from crowdgit.activity import prepare_crowd_activities, prepare_crowd_activities_parallel
+
+
+def make_commits(n: int, members: int = 2000, seed: int = 0):
+    rnd = random.Random(seed)
+    people = [(f"Member {i}", f"member{i}@example.com") for i in range(members)]
+    commits = []
+    for i in range(n):
+        author, committer = rnd.choice(people), rnd.choice(people)
+        trailers = [
+            f"{rnd.choice(['Signed-off-by', 'Reviewed-by', 'Acked-by', 'Tested-by'])}: "
+            f"{name} <{email}>"
+            for name, email in rnd.sample(people, rnd.randint(1, 6))
+        ]
+        commits.append(
+            {
+                "hash": "%040x" % rnd.getrandbits(160),
+                "author_datetime": "2023-03-31T16:10:04-07:00",
+                "author_name": author[0],
+                "author_email": author[1],
+                "committer_datetime": "2023-04-02T09:00:00+02:00",
+                "committer_name": committer[0],
+                "committer_email": committer[1],
+                "is_main_branch": True,
+                "is_merge_commit": False,
+                "insertions": rnd.randint(0, 200),
+                "deletions": rnd.randint(0, 200),
+                "message": ["subsystem: fix something", ""]
+                + ["Some explanation of the change."] * rnd.randint(1, 15)
+                + [""]
+                + trailers,
+            }
+        )
+    return commits
+
+
+def run(name, prepare, commits):
+    start = time.perf_counter()
+    activities = prepare(commits)
+    elapsed = time.perf_counter() - start
+    return {
+        "name": name,
+        "commits": len(commits),
+        "activities": len(activities),
+        "seconds": round(elapsed, 3),
+        "commits_per_second": round(len(commits) / elapsed),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark activity preparation.")
+    parser.add_argument("--commits", type=int, default=100_000)
+    parser.add_argument("--workers", type=int, default=4)
+    parser.add_argument("--chunk-size", type=int, default=2000)
+    args = parser.parse_args()
+
+    remote = "https://github.com/user/repo"
+    commits = make_commits(args.commits)
+    results = [
+        run("serial", lambda c: prepare_crowd_activities(remote, c, workers=1), commits),
+        run(
+            f"parallel-{args.workers}",
+            lambda c: prepare_crowd_activities_parallel(remote, c, args.workers, args.chunk_size),
+            commits,
+        ),
+    ]
+    print(json.dumps(results, indent=2))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,146 @@
+# -*- coding: utf-8 -*-
+"""Micro-benchmark of message serialization in Queue.send_messages.
+
+Compares the previous per-record ``json.dumps`` of the whole envelope (plus the
+character-by-character truncation of oversized bodies) with the pre-rendered
+Envelope, using both the stdlib and the orjson encoders.
+
+    python -m benchmarks.serialization --records 20000
+"""
+import json
+import time
+import random
+import argparse
+
+import crowdgit.serialization as S
+
+SQS_OVERHEAD = 6000
+
+
+def make_body(rnd: random.Random, size: int) -> str:
+    if size > S.SQS_MAX_MESSAGE_SIZE_IN_BYTES:
+        # Oversized bodies are mostly plain text (log dumps, patches)
+        return "x" * size
+    return "".join(rnd.choice("abcdefghij klmnñ\n\"") for _ in range(size))
+
+
+def make_records(n: int, oversized_every: int = 1000, seed: int = 0):
+    rnd = random.Random(seed)
+    records = []
+    for i in range(n):
+        size = 264_000 if oversized_every and i % oversized_every == 0 else rnd.randint(200, 4000)
+        records.append(
+            {
+                "type": "signed-off-commit",
+                "timestamp": "2023-03-31T16:10:04-07:00",
+                "sourceId": "%040x" % rnd.getrandbits(160),
+                "sourceParentId": "%040x" % rnd.getrandbits(160),
+                "platform": "git",
+                "channel": "https://git.kernel.org/pub/scm/linux/kernel/git/torvalds/linux",
+                "body": make_body(rnd, size),
+                "isContribution": True,
+                "attributes": {
+                    "insertions": 10,
+                    "timezone": "UTC-07:00",
+                    "deletions": 2,
+                    "lines": 8,
+                    "isMerge": False,
+                    "isMainBranch": True,
+                },
+                "url": "https://git.kernel.org/pub/scm/linux/kernel/git/torvalds/linux",
+                "member": {
+                    "displayName": "Arnd Bergmann",
+                    "identities": [
+                        {"platform": "git", "value": "arnd@arndb.de", "type": "username"},
+                        {"platform": "git", "value": "arnd@arndb.de", "type": "email"},
+                    ],
+                },
+            }
+        )
+    return records
+
+
+def legacy_serialize(record, tenant_id, segment_id, integration_id):
+    """The serialization send_messages used to do for each record."""
+
+    def envelope():
+        return json.dumps(
+            {
+                "type": "create_and_process_activity_result",
+                "tenantId": tenant_id,
+                "segmentId": segment_id,
+                "integrationId": integration_id,
+                "activityData": record,
+            },
+            default=str,
+        )
+
+    def baseline_message_size():
+        body = json.dumps(
+            {
+                "type": "create_and_process_activity_result",
+                "tenantId": tenant_id,
+                "segmentId": tenant_id,
+                "integrationId": tenant_id,
+                "activityData": "",
+            },
+            default=str,
+        )
+        return len(body.encode("utf-8")) + SQS_OVERHEAD
+
+    def truncate_to_bytes(s, max_bytes):
+        truncated = s
+        while len(truncated.encode("utf-8")) >= max_bytes:
+            truncated = truncated[:-1]
+        return truncated
+
+    body = envelope()
+    if len(body.encode("utf-8")) > S.SQS_MAX_MESSAGE_SIZE_IN_BYTES:
+        record["body"] = truncate_to_bytes(
+            record["body"], S.SQS_MAX_MESSAGE_SIZE_IN_BYTES - baseline_message_size()
+        )
+        body = envelope()
+    return body.encode("utf-8")
+
+
+def run(name, serialize, records):
+    records = [dict(r) for r in records]
+    start = time.perf_counter()
+    produced = 0
+    for record in records:
+        produced += len(serialize(record))
+    elapsed = time.perf_counter() - start
+    return {
+        "name": name,
+        "records": len(records),
+        "seconds": round(elapsed, 4),
+        "records_per_second": round(len(records) / elapsed),
+        "mb_per_second": round(produced / elapsed / 1e6, 2),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark message serialization.")
+    parser.add_argument("--records", type=int, default=20000)
+    parser.add_argument(
+        "--oversized-every", type=int, default=1000, help="One oversized body every N records."
+    )
+    args = parser.parse_args()
+
+    records = make_records(args.records, args.oversized_every)
+    ids = ("tenant-id", "segment-id", "integration-id")
+    max_bytes = S.SQS_MAX_MESSAGE_SIZE_IN_BYTES - SQS_OVERHEAD
+    results = [run("legacy", lambda r: legacy_serialize(r, *ids), records)]
+
+    for encoder in ("json", "orjson"):
+        if encoder == "orjson" and S.orjson is None:
+            continue
+        S.JSON_ENCODER = encoder
+        envelope = S.Envelope(*ids, max_bytes=max_bytes)
+        results.append(run(f"envelope-{encoder}", envelope.serialize, records))
+
+    print(json.dumps(results, indent=2))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,174 @@
+# -*- coding: utf-8 -*-
+"""Synthetic git repositories for the benchmarks, modelled on kernel-like histories.
+
+The history is written with a single git fast-import, so generating a hundred
+thousand commits takes seconds. Everything is derived from the seed: two runs
+with the same parameters build the same repository, down to the hashes.
+
+    python -m benchmarks.synthetic /tmp/synthetic-repo --commits 20000
+"""
+import os
+import random
+import itertools
+import argparse
+import subprocess
+from dataclasses import dataclass, asdict
+
+TRAILER_NAMES = (
+    ("Signed-off-by", 10),
+    ("Reviewed-by", 4),
+    ("Acked-by", 3),
+    ("Tested-by", 2),
+    ("Reported-by", 2),
+    ("Suggested-by", 1),
+    ("Co-developed-by", 1),
+    ("Cc", 3),
+    ("Link", 3),
+    ("Fixes", 1),
+)
+SUBSYSTEMS = ("mm", "net", "fs", "sched", "drm", "usb", "arm64", "x86", "docs", "block")
+WORDS = (
+    "the driver locking memory page fault path when we handle a race between two "
+    "threads freeing this buffer leads to use after free so take the lock before"
+).split()
+START_TIMESTAMP = 1_600_000_000
+
+
+@dataclass
+class RepoSpec:
+    """Shape of a synthetic history. Defaults are roughly those of the kernel."""
+
+    commits: int = 10_000
+    # Mean number of trailers per commit
+    trailers: float = 3.5
+    # Share of commits that are merges of a side branch
+    merge_ratio: float = 0.05
+    # Files touched per commit, and lines changed per file
+    files_per_commit: int = 3
+    lines_per_file: int = 12
+    # Files in the tree
+    files: int = 2000
+    # Mean number of lines of the message body
+    message_lines: int = 12
+    members: int = 5000
+    seed: int = 0
+
+
+_cum_weights = {}
+
+
+def _person(rnd: random.Random, spec: RepoSpec):
+    # Zipf-like: a few members author, commit and review most of the commits
+    if spec.members not in _cum_weights:
+        _cum_weights[spec.members] = list(
+            itertools.accumulate(1 / (rank + 1) for rank in range(spec.members))
+        )
+    i = rnd.choices(range(spec.members), cum_weights=_cum_weights[spec.members])[0]
+    return f"Member {i}", f"member{i}@example.com"
+
+
+def _message(rnd: random.Random, spec: RepoSpec) -> str:
+    subject = f"{rnd.choice(SUBSYSTEMS)}: " + " ".join(rnd.choices(WORDS, k=rnd.randint(3, 9)))
+    body = [
+        " ".join(rnd.choices(WORDS, k=rnd.randint(6, 12)))
+        for _ in range(int(rnd.expovariate(1 / spec.message_lines)) if spec.message_lines else 0)
+    ]
+    names, weights = zip(*TRAILER_NAMES)
+    trailers = []
+    for name in rnd.choices(names, weights, k=int(rnd.expovariate(1 / spec.trailers)) + 1):
+        if name == "Link":
+            trailers.append(f"Link: https://lore.kernel.org/r/{rnd.getrandbits(64):016x}")
+        elif name == "Fixes":
+            trailers.append(f'Fixes: {rnd.getrandbits(48):012x} ("{rnd.choice(WORDS)}")')
+        else:
+            trailers.append("%s: %s <%s>" % ((name,) + _person(rnd, spec)))
+    return "\n".join([subject, ""] + body + ([""] if body else []) + trailers) + "\n"
+
+
+def _data(content: str) -> bytes:
+    raw = content.encode("utf-8")
+    return b"data %d\n%s\n" % (len(raw), raw)
+
+
+def _commit(rnd, spec, branch, mark, parents, timestamp, contents) -> bytes:
+    author = "%s <%s>" % _person(rnd, spec)
+    committer = "%s <%s>" % _person(rnd, spec)
+    out = [
+        f"commit refs/heads/{branch}\nmark :{mark}\n".encode(),
+        f"author {author} {timestamp} +0000\n".encode(),
+        f"committer {committer} {timestamp + rnd.randint(0, 86400)} +0000\n".encode(),
+        _data(_message(rnd, spec)),
+    ]
+    if parents:
+        out.append(f"from :{parents[0]}\n".encode())
+        out.extend(f"merge :{parent}\n".encode() for parent in parents[1:])
+    for _ in range(spec.files_per_commit):
+        file = rnd.randrange(spec.files)
+        path = f"src/dir{file % 50}/file{file}.c"
+        lines = contents.setdefault(path, [])
+        # Churn: replace some lines, append others
+        for _ in range(spec.lines_per_file):
+            line = " ".join(rnd.choices(WORDS, k=6))
+            if lines and rnd.random() < 0.4:
+                lines[rnd.randrange(len(lines))] = line
+            else:
+                lines.append(line)
+        out.append(f"M 100644 inline {path}\n".encode() + _data("\n".join(lines)))
+    return b"".join(out) + b"\n"
+
+
+def generate_repo(path: str, spec: RepoSpec) -> str:
+    """Create the repository of `spec` in `path`, with the history on branch main.
+    Returns the path."""
+    rnd = random.Random(spec.seed)
+    os.makedirs(path, exist_ok=True)
+    subprocess.run(["git", "init", "-q", "-b", "main", path], check=True)
+
+    process = subprocess.Popen(
+        ["git", "-C", path, "fast-import", "--quiet", "--done"], stdin=subprocess.PIPE
+    )
+    contents = {}
+    mark = 0
+    main_tip = None
+    timestamp = START_TIMESTAMP
+    for _ in range(spec.commits):
+        timestamp += rnd.randint(60, 3600)
+        if main_tip is not None and rnd.random() < spec.merge_ratio:
+            # A side branch commit, and its merge into main
+            mark += 1
+            process.stdin.write(
+                _commit(rnd, spec, "side", mark, [main_tip], timestamp, contents)
+            )
+            side_tip = mark
+            mark += 1
+            process.stdin.write(
+                _commit(rnd, spec, "main", mark, [main_tip, side_tip], timestamp + 1, contents)
+            )
+        else:
+            mark += 1
+            parents = [main_tip] if main_tip is not None else []
+            process.stdin.write(_commit(rnd, spec, "main", mark, parents, timestamp, contents))
+        main_tip = mark
+    process.stdin.write(b"done\n")
+    process.stdin.close()
+    if process.wait():
+        raise RuntimeError(f"git fast-import failed with {process.returncode}")
+
+    subprocess.run(["git", "-C", path, "checkout", "-q", "main"], check=True)
+    return path
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Generate a synthetic git repository.")
+    parser.add_argument("path", help="Directory of the new repository.")
+    for name, default in asdict(RepoSpec()).items():
+        parser.add_argument(f"--{name.replace('_', '-')}", type=type(default), default=default)
+    args = parser.parse_args()
+
+    spec = RepoSpec(**{name: getattr(args, name) for name in asdict(RepoSpec())})
+    generate_repo(args.path, spec)
+    print(f"{spec.commits} commits generated in {args.path}")
+
+
+if __name__ == "__main__":
+    main()
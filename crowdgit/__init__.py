@@ -1,22 +1,29 @@
 # -*- coding: utf-8 -*-
 
 import os
-import dotenv
 
 
-def load_env():
-    """Tries to load the .env in the current directory. If not present
-    it will try the user's home directory (so it will work when
+def load_env(env_path: str = '.env'):
+    """Tries to load `env_path`, by default the .env in the current directory. If not
+    present it will try the user's home directory (so it will work when
     running as a cron job from a virtual env).
+
+    Called by the entry points (crowdgit.cli, the server), not on import.
     """
-    env_path = '.env'
     if not os.path.exists(env_path):
         env_path = os.path.expanduser("~/.env")
 
     if os.path.exists(env_path):
+        import dotenv
+
         dotenv.load_dotenv(env_path)
 
-load_env()
 
 DEFAULT_LOCAL_DIR = 'local'
-LOCAL_DIR = os.environ.get('CROWD_LOCAL_DIR', DEFAULT_LOCAL_DIR)
+
+
+def __getattr__(name):
+    # Read on first use, once the entry point has loaded .env
+    if name == 'LOCAL_DIR':
+        return os.environ.get('CROWD_LOCAL_DIR', DEFAULT_LOCAL_DIR)
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
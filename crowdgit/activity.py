@@ -1,32 +1,52 @@
 # -*- coding: utf-8 -*-
 
+from crowdgit import load_env
+
+if __name__ == "__main__":
+    # Run as python -m: .env has to be loaded before the modules below read their settings
+    load_env()
+
 import re
 import hashlib
 import time
 from typing import List, Dict
 from datetime import datetime
 import os
-import json
-
-import requests
-import tqdm
-from fuzzywuzzy import process
-
-import dotenv
-
-dotenv.load_dotenv(".env")
+import marshal
+import multiprocessing
+from functools import lru_cache
 
 from crowdgit.repo import get_repo_name, get_new_commits, get_commits_since_until
 from crowdgit.activitymap import ActivityMap
+from crowdgit.fuzzy import match_activity_key
+from crowdgit import metrics
 
 from crowdgit.logger import get_logger
 
 logger = get_logger(__name__)
 
+# "copy" puts the commit message in the body of every activity of the commit. With
+# "ref" only the authored-commit activity has it; the others have an empty body and
+# attributes.bodyRef, the sourceId of the authored-commit activity with the body.
+ACTIVITY_BODY_MODE = os.environ.get("ACTIVITY_BODY_MODE", "copy")
+
+# Resolve misspelled trailer names (Signed-of-by, Reviewd-by) to the closest known one,
+# see crowdgit.fuzzy. Only names one edit from a key, of 8 characters or more and not
+# in crowdgit.fuzzy.DENYLIST are matched
+FUZZY_TRAILER_MATCHING = os.environ.get("FUZZY_TRAILER_MATCHING", "true").lower() in (
+    "1",
+    "true",
+    "yes",
+)
+
+# With more than one worker, the activities of more than PREPARE_CHUNK_SIZE commits
+# are prepared by a pool of processes, a chunk of commits at a time.
+PREPARE_WORKERS = int(os.environ.get("PREPARE_WORKERS", 1))
+PREPARE_CHUNK_SIZE = int(os.environ.get("PREPARE_CHUNK_SIZE", 2000))
+
 
 def match_activity_name(activity_name: str) -> str:
-    best_match = process.extractOne(activity_name, ActivityMap.keys(), score_cutoff=80)
-    return best_match[0] if best_match else None
+    return match_activity_key(activity_name)
 
 
 def extract_activities_fuzzy(
@@ -47,13 +67,16 @@ def extract_activities_fuzzy(
 
 
 # :prompt:extract-activities
-def extract_activities(commit_message: List[str]) -> List[Dict[str, Dict[str, str]]]:
+def extract_activities(
+    commit_message: List[str], fuzzy: bool = False
+) -> List[Dict[str, Dict[str, str]]]:
     """
     Extract activities from the commit message and return a list of activities.
     Each activity in the list includes the activity and the person who made it,
     which in turn includes the name and the email.
 
     :param commit_message: A list of strings, where each string is a line of the commit message.
+    :param fuzzy: If True, activity names not in ActivityMap are matched to the closest one.
     :return: A list of dictionaries containing activities and the person who made them.
 
     >>> extract_activities([
@@ -62,6 +85,8 @@ def extract_activities(commit_message: List[str]) -> List[Dict[str, Dict[str, st
     ... ]) == [{'Signed-off-by': {'email': 'arnd@arndb.de', 'name': 'Arnd Bergmann'}},
     ...        {'Reported-by': {'email': 'linux@roeck-us.net', 'name': 'Guenter Roeck'}}]
     True
+    >>> extract_activities(["Signed-of-by: Arnd Bergmann <arnd@arndb.de>"], fuzzy=True)
+    [{'Signed-off-by': {'name': 'Arnd Bergmann', 'email': 'arnd@arndb.de'}}]
     """
     activities = []
     activity_pattern = re.compile(r"([^:]*):\s*(.*?)\s+<{1,2}([^>]+)>+$")
@@ -71,6 +96,8 @@ def extract_activities(commit_message: List[str]) -> List[Dict[str, Dict[str, st
         if match:
             activity_name, name, email = match.groups()
             activity_name = activity_name.strip().lower()
+            if activity_name not in ActivityMap and fuzzy:
+                activity_name = match_activity_name(activity_name)
             if activity_name in ActivityMap:
                 name = name.strip()
                 email = email.strip()
@@ -79,6 +106,7 @@ def extract_activities(commit_message: List[str]) -> List[Dict[str, Dict[str, st
     return activities
 
 
+@lru_cache(maxsize=65536)
 def clean_up_username(name: str):
     name = re.sub(r"(?i)Reviewed[- ]by:", "", name)
     name = re.sub(r"(?i)from:", "", name)
@@ -86,6 +114,107 @@ def clean_up_username(name: str):
     return name.strip()
 
 
+class IdentityTable:
+    """
+    The members of the activities of a run, built once per distinct (name, email).
+
+    The same few thousand people author, commit and review most of the activities
+    of a repository. All the activities of a member share its dict, so it must not
+    be modified.
+
+    >>> table = IdentityTable()
+    >>> member = table.member("Reviewed-by: Arnd Bergmann", "arnd@arndb.de")
+    >>> member["displayName"], [i["type"] for i in member["identities"]]
+    ('Arnd Bergmann', ['username', 'email'])
+    >>> member is table.member("Reviewed-by: Arnd Bergmann", "arnd@arndb.de")
+    True
+    >>> table.member("", "linux@roeck-us.net")["displayName"]
+    'linux'
+    """
+
+    def __init__(self, platform: str = "git"):
+        self.platform = platform
+        self.members: Dict[tuple, Dict] = {}
+
+    def __len__(self) -> int:
+        return len(self.members)
+
+    def member(self, name: str, email: str) -> Dict:
+        key = (name, email)
+        member = self.members.get(key)
+        if member is None:
+            # A missing name is replaced by the user part of the email
+            display_name = clean_up_username(name or email.split("@")[0])
+            member = {
+                "displayName": display_name,
+                "identities": [
+                    {
+                        "platform": self.platform,
+                        "value": email,
+                        "type": "username",
+                        "verified": True,
+                    },
+                    {
+                        "platform": self.platform,
+                        "value": email,
+                        "type": "email",
+                        "verified": False,
+                    },
+                ],
+            }
+            self.members[key] = member
+        return member
+
+
+def _prepare_chunk(payload: bytes) -> bytes:
+    """Worker side of prepare_crowd_activities_parallel. Chunks travel marshalled:
+    commits and activities are plain dicts, lists and strings, and marshal encodes
+    and decodes them much faster than pickle, keeping shared objects shared."""
+    remote, commits = marshal.loads(payload)
+    return marshal.dumps(prepare_crowd_activities(remote, commits, workers=1))
+
+
+def prepare_crowd_activities_parallel(
+    remote: str,
+    commits: List[Dict],
+    workers: int,
+    chunk_size: int = PREPARE_CHUNK_SIZE,
+    verbose: bool = False,
+) -> List[Dict]:
+    """
+    prepare_crowd_activities for `commits` split in chunks of `chunk_size` among a pool
+    of `workers` processes. The activities are returned in the order of the commits.
+    """
+    chunks = (
+        marshal.dumps((remote, commits[start : start + chunk_size]))
+        for start in range(0, len(commits), chunk_size)
+    )
+    total = (len(commits) + chunk_size - 1) // chunk_size
+    activities = []
+    start_time = time.time()
+    # Spawned workers, not forked: the process may run librdkafka's threads
+    with multiprocessing.get_context("spawn").Pool(workers) as pool:
+        results = pool.imap(_prepare_chunk, chunks)
+        if verbose:
+            import tqdm
+
+            results = tqdm.tqdm(results, total=total, desc="Processing commit chunks")
+        for result in results:
+            activities.extend(marshal.loads(result))
+
+    repo_name = get_repo_name(remote)
+    metrics.observe("prepare", time.time() - start_time, repo_name)
+    metrics.inc("activities", len(activities), repo_name)
+    logger.info(
+        "%d activities prepared from %d commits by %d workers in %.1f s",
+        len(activities),
+        len(commits),
+        workers,
+        time.time() - start_time,
+    )
+    return activities
+
+
 # pylint: disable=too-many-branches
 def prepare_crowd_activities(
     remote: str,
@@ -93,9 +222,18 @@ def prepare_crowd_activities(
     verbose: bool = False,
     since: str | None = None,
     until: str | None = None,
+    workers: int | None = None,
 ) -> List[Dict]:
+    if workers is None:
+        workers = PREPARE_WORKERS
+
+    identities = IdentityTable()
+
+    body_by_ref = ACTIVITY_BODY_MODE == "ref"
+
     def create_activity(
         commit: Dict,
+        body: str,
         activity_type: str,
         member: Dict,
         source_id: str,
@@ -108,23 +246,14 @@ def prepare_crowd_activities(
             timestamp = commit["committer_datetime"]
         dt = datetime.fromisoformat(timestamp)
 
-        # Check if username or displayName is None, an empty string, or not an actual name
-        if not member["username"]:
-            member["username"] = member["emails"][0]
-        if not member["displayName"]:
-            member["displayName"] = member["emails"][0].split("@")[0]
-
-        member["username"] = clean_up_username(member["username"])
-        member["displayName"] = clean_up_username(member["displayName"])
-
-        return {
+        activity = {
             "type": activity_type,
             "timestamp": timestamp,
             "sourceId": source_id,
             "sourceParentId": source_parent_id,
             "platform": "git",
             "channel": remote,
-            "body": "\n".join(commit["message"]),
+            "body": body,
             "isContribution": True,
             "attributes": {
                 "insertions": commit.get("insertions", 0),
@@ -137,6 +266,10 @@ def prepare_crowd_activities(
             "url": remote,
             "member": member,
         }
+        if body_by_ref and source_parent_id:
+            activity["body"] = ""
+            activity["attributes"]["bodyRef"] = source_parent_id
+        return activity
 
     activities = []
 
@@ -145,33 +278,34 @@ def prepare_crowd_activities(
     elif commits is None and (since is not None or until is not None):
         commits = get_commits_since_until(remote, since, until, verbose=verbose)
 
+    if workers > 1 and len(commits) > PREPARE_CHUNK_SIZE:
+        return prepare_crowd_activities_parallel(remote, commits, workers, verbose=verbose)
+
+    start_time = time.time()
     if verbose:
+        import tqdm
+
         commits_iter = tqdm.tqdm(commits, desc="Processing commits")
     else:
         commits_iter = commits
 
     for commit in commits_iter:
         activities_to_add = []
-        author = {
-            "username": commit["author_name"],
-            "displayName": commit["author_name"],
-            "emails": [commit["author_email"]],
-        }
-        committer = {
-            "username": commit["committer_name"],
-            "displayName": commit["committer_name"],
-            "emails": [commit["committer_email"]],
-        }
+        # Built once, and shared by all the activities of the commit
+        body = "\n".join(commit["message"])
+        author = identities.member(commit["author_name"], commit["author_email"])
+        committer = identities.member(commit["committer_name"], commit["committer_email"])
 
         # Add authored-commit activity
         activities_to_add.append(
-            create_activity(commit, "authored-commit", author, commit["hash"])
+            create_activity(commit, body, "authored-commit", author, commit["hash"])
         )
 
         # Add committed-commit activity if the committer is different from the author
         activities_to_add.append(
             create_activity(
                 commit,
+                body,
                 "committed-commit",
                 committer,
                 hashlib.sha1(
@@ -183,61 +317,52 @@ def prepare_crowd_activities(
             )
         )
 
-        # Extract and add other activities
-        extracted_activities = extract_activities(commit["message"])
+        # Extract and add other activities, from the trailers parsed by git if we have them
+        extracted_activities = extract_activities(
+            commit.get("trailers", commit["message"]), fuzzy=FUZZY_TRAILER_MATCHING
+        )
         for extracted_activity in extracted_activities:
             activity_type, member_data = list(extracted_activity.items())[0]
             activity_type = activity_type.lower().replace("-by", "") + "-commit"
 
-            member = {
-                "username": member_data["email"],
-                "displayName": member_data["name"],
-                "emails": [member_data["email"]],
-            }
+            member = identities.member(member_data["name"], member_data["email"])
 
             source_id = hashlib.sha1(
                 (commit["hash"] + activity_type + member_data["email"]).encode("utf-8")
             ).hexdigest()
             activities_to_add.append(
-                create_activity(commit, activity_type, member, source_id, commit["hash"])
+                create_activity(commit, body, activity_type, member, source_id, commit["hash"])
             )
 
         activities += activities_to_add
 
-    # For the new processing of activities
-    for activity in activities:
-        activity["member"]["identities"] = [
-            {
-                "platform": activity["platform"],
-                "value": activity["member"]["emails"][0],
-                "type": "username",
-                "verified": True,
-            }
-        ] + [
-            {
-                "platform": activity["platform"],
-                "value": email,
-                "type": "email",
-                "verified": False,
-            }
-            for email in activity["member"]["emails"]
-        ]
-
-        del activity["member"]["username"]
-        del activity["member"]["emails"]
+    repo_name = get_repo_name(remote)
+    metrics.observe("prepare", time.time() - start_time, repo_name)
+    metrics.inc("activities", len(activities), repo_name)
+    logger.info("%d activities of %d distinct members", len(activities), len(identities))
 
     return activities
 
 
 def main():
     import argparse
+    import itertools
+    from crowdgit.streaming import read_records, write_records, write_mapping
 
     parser = argparse.ArgumentParser(description="Extract activities from commit messages.")
     parser.add_argument(
-        "input_file", help="Input JSON file containing the list of commit dictionaries."
+        "input_file",
+        help=(
+            "Input file with the commit dictionaries, a JSON array or JSONL. "
+            '"-" reads the standard input.'
+        ),
     )
     parser.add_argument(
-        "output_file", help="Output JSON file containing the extracted activities."
+        "output_file",
+        help=(
+            "Output file for the extracted activities: JSONL if it ends in .jsonl, "
+            'JSON otherwise. "-" writes JSONL to the standard output.'
+        ),
     )
     parser.add_argument(
         "--crowd-activities",
@@ -252,10 +377,14 @@ def main():
     parser.add_argument("--verbose", action="store_true", help="Verbose output.")
     args = parser.parse_args()
 
-    with open(args.input_file, "r", encoding="utf-8") as input_file:
-        commits = json.load(input_file)
+    # Commits are read, and activities written, a batch at a time
+    commits = read_records(args.input_file)
+    if args.verbose:
+        import tqdm
+
+        commits = tqdm.tqdm(commits, desc="Processing commits")
+    batch_size = PREPARE_CHUNK_SIZE * max(PREPARE_WORKERS, 1)
 
-    output_data = None
     start_time = time.time()
 
     if args.crowd_activities:
@@ -263,27 +392,25 @@ def main():
             print("Error: The --remote argument is required when using --crowd-activities.")
             return
 
-        output_data = prepare_crowd_activities(args.remote, commits, verbose=args.verbose)
+        def crowd_activities():
+            while batch := list(itertools.islice(commits, batch_size)):
+                yield from prepare_crowd_activities(args.remote, batch)
+
+        count = write_records(crowd_activities(), args.output_file)
     else:
-        activities_by_commit = {}
-        for commit in tqdm.tqdm(commits, desc="Processing commits"):
-            commit_hash = commit["hash"]
-            commit_message = commit["message"]
-            activities = extract_activities(commit_message)
-            activities_by_commit[commit_hash] = activities
-        output_data = activities_by_commit
+        activities_by_commit = (
+            (commit["hash"], extract_activities(commit["message"])) for commit in commits
+        )
+        count = write_mapping(activities_by_commit, args.output_file, "hash", "activities")
 
     end_time = time.time()
     logger.info(
         "%d activities extracted in %d s (%.1f min)",
-        len(output_data),
+        count,
         int(end_time - start_time),
         (end_time - start_time) / 60,
     )
 
-    with open(args.output_file, "w", encoding="utf-8") as output_file:
-        json.dump(output_data, output_file, indent=2, ensure_ascii=False)
-
 
 if __name__ == "__main__":
     main()
@@ -0,0 +1,133 @@
+# -*- coding: utf-8 -*-
+"""Checkpoints of the onboardings in progress.
+
+Onboarding a repository for a segment, sending the activities of its whole
+history, goes through the commits newest first, in windows of
+ONBOARDING_WINDOW_COMMITS (default 5000). It is progressive: an onboarding
+first sends the commits of the last ONBOARDING_RECENT_DAYS (default 90, 0 to
+send the whole history in one go), or at least one window, and then stops; the
+older history is backfilled later, when there is nothing more urgent to do.
+Its checkpoint,
+
+    CHECKPOINT_DIR/<repo name>/<segment id>.json
+
+records
+
+    cloning   whether the repository was being cloned, in which case a clone
+              left by a process that died may be incomplete
+    tip       the commit whose history is onboarded
+    total     the number of commits in that history
+    recent    the number of them sent before the backfill
+    done      the number of commits whose activities are in the outbox
+
+and is saved once the activities of each window are in the outbox, so that an
+onboarding that is interrupted resumes with the window after the last one
+saved, instead of starting over. It is removed when the onboarding completes.
+"""
+import os
+import json
+import shutil
+from typing import Dict, Optional
+
+from crowdgit import LOCAL_DIR
+from crowdgit.outbox import _write_atomically
+
+DEFAULT_CHECKPOINT_DIR = os.path.join(LOCAL_DIR, "checkpoints")
+CHECKPOINT_DIR = os.environ.get("CHECKPOINT_DIR", DEFAULT_CHECKPOINT_DIR)
+ONBOARDING_WINDOW_COMMITS = int(os.environ.get("ONBOARDING_WINDOW_COMMITS", 5000))
+ONBOARDING_RECENT_DAYS = float(os.environ.get("ONBOARDING_RECENT_DAYS", 90))
+
+# Phases of an onboarding
+RECENT = "recent"
+BACKFILL = "backfill"
+
+
+class OnboardingCheckpoint:
+    """
+    Checkpoint of the onboarding of a repository for a segment.
+
+    >>> import tempfile
+    >>> with tempfile.TemporaryDirectory() as checkpoint_dir:
+    ...     checkpoint = OnboardingCheckpoint("repo", "segment", checkpoint_dir=checkpoint_dir)
+    ...     checkpoint.save(tip="abc", total=8000, recent=2000, done=1000)
+    ...     OnboardingCheckpoint.phase("repo", checkpoint_dir)
+    ...     checkpoint.save(done=5000)
+    ...     OnboardingCheckpoint("repo", "segment", checkpoint_dir=checkpoint_dir).load()
+    ...     checkpoint.progress(), OnboardingCheckpoint.phase("repo", checkpoint_dir)
+    ...     checkpoint.clear()
+    ...     checkpoint.load(), OnboardingCheckpoint.in_progress("repo", checkpoint_dir)
+    'recent'
+    {'tip': 'abc', 'total': 8000, 'recent': 2000, 'done': 5000}
+    (62.5, 'backfill')
+    (None, False)
+    """
+
+    def __init__(self, repo_name: str, segment_id: str, checkpoint_dir: Optional[str] = None):
+        self.repo_path = os.path.join(checkpoint_dir or CHECKPOINT_DIR, repo_name)
+        self.path = os.path.join(self.repo_path, f"{segment_id}.json")
+        self.state: Optional[Dict] = None
+
+    def load(self) -> Optional[Dict]:
+        """The saved state, None if no onboarding is in progress."""
+        try:
+            with open(self.path, "r", encoding="utf-8") as fin:
+                self.state = json.load(fin)
+        except (OSError, ValueError):
+            self.state = None
+        return self.state
+
+    def save(self, **state):
+        """Update the saved state with `state`."""
+        self.state = {**(self.state or {}), **state}
+        os.makedirs(self.repo_path, exist_ok=True)
+        _write_atomically(self.path, json.dumps(self.state))
+
+    def progress(self) -> float:
+        """Percentage of the commits onboarded."""
+        if not self.state or not self.state.get("total"):
+            return 0.0
+        return 100 * self.state.get("done", 0) / self.state["total"]
+
+    def backfilling(self) -> bool:
+        """Whether the recent commits are done, and the older ones are left."""
+        if not self.state or self.state.get("tip") is None:
+            return False
+        recent = self.state.get("recent", self.state["total"])
+        return recent <= self.state["done"] < self.state["total"]
+
+    def clear(self):
+        self.state = None
+        if os.path.exists(self.path):
+            os.remove(self.path)
+        if os.path.isdir(self.repo_path) and not os.listdir(self.repo_path):
+            os.rmdir(self.repo_path)
+
+    @staticmethod
+    def in_progress(repo_name: str, checkpoint_dir: Optional[str] = None) -> bool:
+        """Whether the repository has an onboarding in progress, for any segment."""
+        repo_path = os.path.join(checkpoint_dir or CHECKPOINT_DIR, repo_name)
+        return os.path.isdir(repo_path) and bool(os.listdir(repo_path))
+
+    @staticmethod
+    def phase(repo_name: str, checkpoint_dir: Optional[str] = None) -> Optional[str]:
+        """RECENT if an onboarding of the repository, for any segment, still has recent
+        commits to send, else BACKFILL if one has older commits to send, else None."""
+        repo_path = os.path.join(checkpoint_dir or CHECKPOINT_DIR, repo_name)
+        if not os.path.isdir(repo_path):
+            return None
+        phase = None
+        for name in os.listdir(repo_path):
+            if not name.endswith(".json"):
+                continue
+            checkpoint = OnboardingCheckpoint(repo_name, name[: -len(".json")], checkpoint_dir)
+            if checkpoint.load() is None:
+                continue
+            if not checkpoint.backfilling():
+                return RECENT
+            phase = BACKFILL
+        return phase
+
+    @staticmethod
+    def delete(repo_name: str, checkpoint_dir: Optional[str] = None):
+        """Delete the checkpoints of the repository, for every segment."""
+        shutil.rmtree(os.path.join(checkpoint_dir or CHECKPOINT_DIR, repo_name), ignore_errors=True)
@@ -0,0 +1,29 @@
+# -*- coding: utf-8 -*-
+"""Entry points of the command lines.
+
+The settings of the modules are read from the environment when they are
+imported, so .env is loaded first, and the module of the command imported
+after.
+"""
+from crowdgit import load_env
+
+
+def ingest():
+    load_env()
+    from crowdgit.ingest import main
+
+    main()
+
+
+def bad_commits():
+    load_env()
+    from crowdgit.get_bad_commits import main
+
+    main()
+
+
+def maintainers():
+    load_env()
+    from crowdgit.maintainers import main
+
+    main()
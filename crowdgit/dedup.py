@@ -0,0 +1,203 @@
+# -*- coding: utf-8 -*-
+"""Persistent record of the activities already delivered for each repository.
+
+Re-onboardings and --since/--until runs extract activities that were, for the
+most part, delivered already. Queue.send_messages checks every activity against
+the repository's SentFilter and skips the ones delivered before for the same
+segment.
+
+The exact set of delivered (segment id, sourceId) pairs is kept in SQLite,
+SENT_DIR/<repo name>.db. In front of it a Bloom filter, persisted next to it in
+SENT_DIR/<repo name>.bloom, answers most lookups for activities never sent in
+memory; only possible hits go to SQLite.
+"""
+import os
+import math
+import struct
+import sqlite3
+import hashlib
+import threading
+
+from crowdgit import LOCAL_DIR
+
+from crowdgit.logger import get_logger
+
+logger = get_logger(__name__)
+
+DEFAULT_SENT_DIR = os.path.join(LOCAL_DIR, "sent")
+SENT_DIR = os.environ.get("SENT_DIR", DEFAULT_SENT_DIR)
+
+BLOOM_INITIAL_CAPACITY = 100_000
+BLOOM_ERROR_RATE = 0.001
+BLOOM_HEADER = struct.Struct("<4sQQQ")
+BLOOM_MAGIC = b"CGBF"
+
+
+class BloomFilter:
+    """
+    Bloom filter over bytes keys, sized for `capacity` keys at `error_rate`.
+
+    >>> bloom = BloomFilter(1000)
+    >>> bloom.add(b"a")
+    >>> b"a" in bloom, b"b" in bloom
+    (True, False)
+    >>> b"a" in BloomFilter.from_bytes(bloom.to_bytes())
+    True
+    """
+
+    def __init__(self, capacity: int, error_rate: float = BLOOM_ERROR_RATE):
+        self.capacity = capacity
+        self.num_bits = max(8, int(-capacity * math.log(error_rate) / math.log(2) ** 2))
+        self.num_hashes = max(1, round(self.num_bits / capacity * math.log(2)))
+        self.bits = bytearray((self.num_bits + 7) // 8)
+        self.count = 0
+
+    def _positions(self, key: bytes):
+        digest = hashlib.blake2b(key, digest_size=16).digest()
+        h1, h2 = struct.unpack("<QQ", digest)
+        return ((h1 + i * h2) % self.num_bits for i in range(self.num_hashes))
+
+    def add(self, key: bytes):
+        for position in self._positions(key):
+            self.bits[position >> 3] |= 1 << (position & 7)
+        self.count += 1
+
+    def __contains__(self, key: bytes) -> bool:
+        return all(self.bits[p >> 3] & (1 << (p & 7)) for p in self._positions(key))
+
+    def to_bytes(self) -> bytes:
+        header = BLOOM_HEADER.pack(BLOOM_MAGIC, self.capacity, self.num_hashes, self.count)
+        return header + bytes(self.bits)
+
+    @classmethod
+    def from_bytes(cls, data: bytes) -> "BloomFilter":
+        magic, capacity, num_hashes, count = BLOOM_HEADER.unpack_from(data)
+        if magic != BLOOM_MAGIC:
+            raise ValueError("Not a Bloom filter")
+        bloom = cls(capacity)
+        bloom.num_hashes = num_hashes
+        bloom.count = count
+        bloom.bits = bytearray(data[BLOOM_HEADER.size :])
+        if len(bloom.bits) != (bloom.num_bits + 7) // 8:
+            raise ValueError("Truncated Bloom filter")
+        return bloom
+
+
+def _key(segment_id: str, source_id: str) -> bytes:
+    return f"{segment_id}\0{source_id}".encode("utf-8")
+
+
+class SentFilter:
+    """
+    Activities already delivered for one repository.
+
+    >>> import tempfile
+    >>> with tempfile.TemporaryDirectory() as sent_dir:
+    ...     sent = SentFilter("repo", sent_dir=sent_dir)
+    ...     sent.add("segment", "abc")
+    ...     sent.commit()
+    ...     sent.close()
+    ...     sent = SentFilter("repo", sent_dir=sent_dir)
+    ...     sent.contains("segment", "abc"), sent.contains("other", "abc")
+    (True, False)
+    """
+
+    def __init__(self, repo_name: str, sent_dir: str = SENT_DIR):
+        os.makedirs(sent_dir, exist_ok=True)
+        self.db_path = os.path.join(sent_dir, f"{repo_name}.db")
+        self.bloom_path = os.path.join(sent_dir, f"{repo_name}.bloom")
+        self.lock = threading.Lock()
+        self.pending = set()
+        self.checked = 0
+        self.suppressed = 0
+
+        self.db = sqlite3.connect(self.db_path, check_same_thread=False)
+        self.db.execute(
+            "CREATE TABLE IF NOT EXISTS sent ("
+            " segment_id TEXT NOT NULL, source_id TEXT NOT NULL,"
+            " PRIMARY KEY (segment_id, source_id)) WITHOUT ROWID"
+        )
+        self.db.commit()
+        self.count = self.db.execute("SELECT COUNT(*) FROM sent").fetchone()[0]
+        self.bloom = self._load_bloom()
+
+    def _load_bloom(self) -> BloomFilter:
+        if os.path.exists(self.bloom_path):
+            try:
+                with open(self.bloom_path, "rb") as fin:
+                    bloom = BloomFilter.from_bytes(fin.read())
+                if bloom.count == self.count and bloom.capacity >= self.count:
+                    return bloom
+            except (ValueError, struct.error):
+                pass
+            logger.info("Bloom filter %s is stale, rebuilding it", self.bloom_path)
+        return self._rebuild_bloom(max(BLOOM_INITIAL_CAPACITY, 2 * self.count))
+
+    def _rebuild_bloom(self, capacity: int) -> BloomFilter:
+        bloom = BloomFilter(capacity)
+        for segment_id, source_id in self.db.execute("SELECT segment_id, source_id FROM sent"):
+            bloom.add(_key(segment_id, source_id))
+        return bloom
+
+    def contains(self, segment_id: str, source_id: str) -> bool:
+        """True if the activity `source_id` was delivered to `segment_id` before."""
+        key = _key(segment_id, source_id)
+        with self.lock:
+            self.checked += 1
+            found = key in self.pending or (
+                key in self.bloom
+                and self.db.execute(
+                    "SELECT 1 FROM sent WHERE segment_id = ? AND source_id = ?",
+                    (segment_id, source_id),
+                ).fetchone()
+                is not None
+            )
+            if found:
+                self.suppressed += 1
+            return found
+
+    def add(self, segment_id: str, source_id: str):
+        """Record the activity `source_id` as delivered to `segment_id`. It is stored
+        on disk on the next commit."""
+        key = _key(segment_id, source_id)
+        with self.lock:
+            self.pending.add(key)
+
+    def commit(self):
+        """Store the delivered activities added since the last commit."""
+        with self.lock:
+            if not self.pending:
+                return
+            rows = [key.decode("utf-8").split("\0", 1) for key in self.pending]
+            before = self.db.total_changes
+            self.db.executemany(
+                "INSERT OR IGNORE INTO sent (segment_id, source_id) VALUES (?, ?)", rows
+            )
+            self.db.commit()
+            added = self.db.total_changes - before
+            self.count += added
+
+            if self.count > self.bloom.capacity:
+                self.bloom = self._rebuild_bloom(2 * self.count)
+            else:
+                for segment_id, source_id in rows:
+                    self.bloom.add(_key(segment_id, source_id))
+                # The filter's count tells whether it is in sync with the database
+                self.bloom.count = self.count
+            self.pending.clear()
+
+            tmp_path = self.bloom_path + ".tmp"
+            with open(tmp_path, "wb") as fout:
+                fout.write(self.bloom.to_bytes())
+            os.replace(tmp_path, self.bloom_path)
+
+    def close(self):
+        self.commit()
+        if self.checked:
+            logger.info(
+                "%d of %d activities suppressed as already sent (%s)",
+                self.suppressed,
+                self.checked,
+                self.db_path,
+            )
+        self.db.close()
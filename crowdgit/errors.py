@@ -9,3 +9,13 @@ class GitRunError(CrowdGitError):
 
     def __init__(self, remote, local_repo, e):
         super().__init__(f'Error running git with {remote} and {local_repo}: {e}')
+
+
+class ConfigurationError(CrowdGitError):
+    pass
+
+
+class LeaseLostError(CrowdGitError):
+
+    def __init__(self, name):
+        super().__init__(f'Lost the lease on {name}, another process may be ingesting it')
@@ -0,0 +1,144 @@
+# -*- coding: utf-8 -*-
+"""Fuzzy matching of trailer names (Signed-of-by, Reviewd-by) to ActivityMap keys.
+
+The keys are indexed in a BK-tree on their Levenshtein distance, so a lookup
+only computes the distance to a handful of keys instead of all of them, and
+names already resolved are memoized.
+
+Only typos are matched: a name at most MAX_DISTANCE edits from a key, of at
+least MIN_MATCH_LENGTH characters, and that is not a real trailer of its own
+(DENYLIST, e.g. Asked-by is not a misspelled Acked-by).
+"""
+import re
+from functools import lru_cache
+from typing import Dict, Iterable, List, Tuple
+
+from Levenshtein import distance
+
+from crowdgit.activitymap import ActivityMap
+
+# Most edits between a name and the key it matches, and shortest name matched
+MAX_DISTANCE = 1
+MIN_MATCH_LENGTH = 8
+# Real trailers one edit from a key that are not typos of it: "<verb>-by" with an
+# English verb one letter away from the key's (Asked-by, Acked-by), normalized, and
+# the key each would be taken for. test_extract_activities checks that each is one
+# edit from its key and not a key itself.
+DENYLIST: Dict[str, str] = {
+    "asked-by": "acked-by",
+    "backed-by": "acked-by",
+    "hacked-by": "acked-by",
+    "packed-by": "acked-by",
+    "linked-by": "liked-by",
+    "voted-by": "noted-by",
+    "texted-by": "tested-by",
+    "rested-by": "tested-by",
+    "tasted-by": "tested-by",
+}
+
+
+def normalize(name: str) -> str:
+    """
+    Lower case, with runs of spaces, underscores and dashes turned into one dash.
+
+    >>> normalize(" Acked and--Reviewed_by ")
+    'acked-and-reviewed-by'
+    """
+    return re.sub(r"[\s_-]+", "-", name.strip().lower()).strip("-")
+
+
+class BKTree:
+    """
+    Burkhard-Keller tree of strings under the Levenshtein distance.
+
+    >>> tree = BKTree(["reviewed-by", "reported-by", "tested-by"])
+    >>> tree.search("reviewd-by", 1)
+    [(1, 'reviewed-by')]
+    """
+
+    def __init__(self, words: Iterable[str]):
+        self.root = None
+        for word in words:
+            self.add(word)
+
+    def add(self, word: str):
+        if self.root is None:
+            self.root = (word, {})
+            return
+        node = self.root
+        while True:
+            node_word, children = node
+            d = distance(word, node_word)
+            if d == 0:
+                return
+            if d not in children:
+                children[d] = (word, {})
+                return
+            node = children[d]
+
+    def search(self, word: str, max_distance: int) -> List[Tuple[int, str]]:
+        """Words within `max_distance` of `word`, as (distance, word), closest first."""
+        found = []
+        nodes = [self.root] if self.root is not None else []
+        while nodes:
+            node_word, children = nodes.pop()
+            d = distance(word, node_word)
+            if d <= max_distance:
+                found.append((d, node_word))
+            # Triangle inequality: only children at distance d +- max_distance can match
+            for child_distance, child in children.items():
+                if d - max_distance <= child_distance <= d + max_distance:
+                    nodes.append(child)
+        return sorted(found)
+
+
+class KeyMatcher:
+    """
+    Resolves possibly misspelled names to the closest key of `keys`.
+
+    >>> matcher = KeyMatcher(["signed-off-by", "reviewed-by", "reported-by", "acked-by", "ack"])
+    >>> matcher.match("Signed-of-by"), matcher.match("Reviewd by"), matcher.match("act")
+    ('signed-off-by', 'reviewed-by', None)
+    >>> matcher.match("Ported-by"), matcher.match("Asked-by")
+    (None, None)
+    """
+
+    def __init__(
+        self,
+        keys: Iterable[str],
+        max_distance: int = MAX_DISTANCE,
+        min_length: int = MIN_MATCH_LENGTH,
+        denylist: Iterable[str] = DENYLIST,
+    ):
+        self.max_distance = max_distance
+        self.min_length = min_length
+        self.denylist = frozenset(normalize(name) for name in denylist)
+        self.keys: Dict[str, str] = {}
+        for key in keys:
+            self.keys.setdefault(normalize(key), key)
+        self.tree = BKTree(self.keys)
+        self.match = lru_cache(maxsize=16384)(self._match)
+
+    def _match(self, name: str) -> str | None:
+        name = normalize(name)
+        if name in self.keys:
+            return self.keys[name]
+        if len(name) < self.min_length or name in self.denylist:
+            return None
+        found = self.tree.search(name, self.max_distance)
+        return self.keys[found[0][1]] if found else None
+
+
+_activity_matcher = None
+
+
+def match_activity_key(name: str) -> str | None:
+    """The ActivityMap key closest to the trailer name `name`, or None.
+
+    >>> match_activity_key("Acked-and-reviewed by")
+    'acked-and-reviewed-by'
+    """
+    global _activity_matcher
+    if _activity_matcher is None:
+        _activity_matcher = KeyMatcher(ActivityMap)
+    return _activity_matcher.match(name)
@@ -1,3 +1,9 @@
+from crowdgit import load_env
+
+if __name__ == "__main__":
+    # Run as python -m: .env has to be loaded before the modules below read their settings
+    load_env()
+
 from git import Repo, Git
 from pprint import pprint as pp
 import os
@@ -40,7 +46,9 @@ def send_api_call(endpoint, body=None, method="POST"):
         return False
 
 
-def get_commit_info(repo, segment_id, integration_id, remote, commit_id, repo_path="."):
+def get_commit_info(
+    repo, segment_id, integration_id, remote, commit_id, repo_path=".", queue=None
+):
     try:
         commit = repo.commit(commit_id)
     except Exception as e:
@@ -112,7 +120,8 @@ def get_commit_info(repo, segment_id, integration_id, remote, commit_id, repo_pa
         "segments": [segment_id],
     }
 
-    queue = Queue()
+    if queue is None:
+        queue = Queue()
 
     return queue.send_messages(segment_id, integration_id, [activity])
 
@@ -144,13 +153,14 @@ def parse_commit_file(commit_file_path, repo_path):
         print("No segment")
         return
 
+    queue = Queue()
     bad_commits = []
     for commit in tqdm(commits):
         commit_id = commit.split("\n")[0]
         commit_info = get_commit_info(
-            repo, segment_id, integration_id, remote, commit_id, repo_path
+            repo, segment_id, integration_id, remote, commit_id, repo_path, queue
         )
-        if not commit_info:
+        if not commit_info or not commit_info["delivered"]:
             bad_commits.append(commit_id)
     return bad_commits
 
@@ -1,58 +1,299 @@
 # -*- coding: utf-8 -*-
 """get_remotes endpoint.
 
-Defines the get_remotes function, which return a dictionary of remotes of the form:
+Defines the get_remotes function, which return a dictionary of the remotes of each
+segment, of the form:
 
 {
-  "kubernetes": [
-    "remote_0_0",
-    "remote_0_1",
-    "remote_0_2"
-  ],
-  "linux": [
-    "remote_1_0",
-    "remote_1_1",
-    "remote_1_2",
-    "remote_1_3"
-  ]
+  "segment_0": {
+    "integrationId": "integration_0",
+    "remotes": ["remote_0_0", "remote_0_1"]
+  },
+  "segment_1": {
+    "integrationId": "integration_1",
+    "remotes": ["remote_1_0"]
+  }
 }
 
+The response is cached in REMOTES_CACHE_PATH (default LOCAL_DIR/remotes.json).
+For REMOTES_CACHE_TTL_SECONDS (default 300) the cache is used as is; after that
+the request is conditional (If-None-Match / If-Modified-Since), so an unchanged
+list is not downloaded again, and if the API fails the last list we got is
+used. get_remotes_update also tells the remotes added and removed since the
+last time it was called. A remote is only taken as removed once it has been
+missing from REMOTES_REMOVED_AFTER_FETCHES (default 3) consecutive responses, so
+that a partial response does not get the local state of its remotes deleted.
 """
+from crowdgit import load_env
+
+if __name__ == "__main__":
+    # Run as python -m: .env has to be loaded before the modules below read their settings
+    load_env()
+
 import os
-import requests
+import json
+import time
+import threading
+from dataclasses import dataclass, field
+from functools import cached_property
+from typing import Dict, List, Optional, Tuple
+
+from crowdgit import LOCAL_DIR
 
 from crowdgit.logger import get_logger
 
 logger = get_logger(__name__)
 
+DEFAULT_REMOTES_CACHE_PATH = os.path.join(LOCAL_DIR, "remotes.json")
+REMOTES_CACHE_PATH = os.environ.get("REMOTES_CACHE_PATH", DEFAULT_REMOTES_CACHE_PATH)
+REMOTES_CACHE_TTL_SECONDS = float(os.environ.get("REMOTES_CACHE_TTL_SECONDS", 300))
+REMOTES_REMOVED_AFTER_FETCHES = int(os.environ.get("REMOTES_REMOVED_AFTER_FETCHES", 3))
 
-def get_remotes(host, api_key):
+
+def normalize_remote(remote: str) -> str:
+    """
+    The remote without trailing slash nor '.git' extension, with lowercase scheme and
+    host, so that the spellings of a remote compare equal.
+
+    >>> normalize_remote("HTTPS://GitHub.com/user/Repo.git/")
+    'https://github.com/user/Repo'
+    >>> normalize_remote("https://github.com/user/digit") == normalize_remote("https://github.com/user/digit.git")
+    True
+    """
+    remote = remote.strip().rstrip("/")
+    if remote.endswith(".git"):
+        remote = remote[:-4]
+    scheme, separator, rest = remote.partition("://")
+    if separator:
+        host, slash, path = rest.partition("/")
+        remote = f"{scheme.lower()}://{host.lower()}{slash}{path}"
+    return remote
+
+
+class RemoteIndex:
+    """
+    The (segment id, integration id) pairs tracking each remote, by normalized remote.
+
+    >>> index = RemoteIndex({
+    ...     "s1": {"integrationId": "i1", "remotes": ["https://github.com/a/b.git"]},
+    ...     "s2": {"integrationId": "i2", "remotes": ["https://github.com/a/b", "https://github.com/a/c"]},
+    ... })
+    >>> index.lookup("https://github.com/a/b/")
+    [('s1', 'i1'), ('s2', 'i2')]
+    >>> index.lookup("https://github.com/a/d")
+    []
+    >>> index.diff(RemoteIndex({"s1": {"integrationId": "i1", "remotes": ["https://github.com/a/d"]}}))
+    (['https://github.com/a/b.git', 'https://github.com/a/c'], ['https://github.com/a/d'])
+    """
+
+    def __init__(self, remotes: Dict):
+        # Normalized remote -> (segment id, integration id) pairs, and the spelling of
+        # the remote the first segment tracking it uses
+        self.segments: Dict[str, List[Tuple[str, str]]] = {}
+        self.urls: Dict[str, str] = {}
+        for segment_id, segment in remotes.items():
+            for remote in segment["remotes"]:
+                key = normalize_remote(remote)
+                self.urls.setdefault(key, remote)
+                pairs = self.segments.setdefault(key, [])
+                if (segment_id, segment["integrationId"]) not in pairs:
+                    pairs.append((segment_id, segment["integrationId"]))
+
+    def __len__(self) -> int:
+        return len(self.urls)
+
+    def __contains__(self, remote: str) -> bool:
+        return normalize_remote(remote) in self.urls
+
+    def url(self, remote: str) -> Optional[str]:
+        """The spelling of `remote` in the remotes, None if it is not tracked."""
+        return self.urls.get(normalize_remote(remote))
+
+    def lookup(self, remote: str) -> List[Tuple[str, str]]:
+        return self.segments.get(normalize_remote(remote), [])
+
+    def by_remote(self) -> Dict[str, List[Tuple[str, str]]]:
+        return {self.urls[key]: pairs for key, pairs in self.segments.items()}
+
+    def diff(self, previous: "RemoteIndex") -> Tuple[List[str], List[str]]:
+        """The remotes added and removed since `previous`."""
+        added = sorted(self.urls[key] for key in self.urls.keys() - previous.urls.keys())
+        removed = sorted(previous.urls[key] for key in previous.urls.keys() - self.urls.keys())
+        return added, removed
+
+
+@dataclass
+class RemotesUpdate:
+    remotes: Dict
+    added: List[str] = field(default_factory=list)
+    removed: List[str] = field(default_factory=list)
+
+    @cached_property
+    def index(self) -> RemoteIndex:
+        return RemoteIndex(self.remotes)
+
+
+def remotes_url(host: str) -> str:
     protocol = "http" if "localhost" in host else "https"
-    url = f"{protocol}://{host}/api/git"
-    payload = {}
-    headers = {"Authorization": f"Bearer {api_key}"}
+    return f"{protocol}://{host}/api/git"
 
-    response = requests.request("GET", url, headers=headers, data=payload, timeout=10)
 
-    if response.status_code == 200:
-        return response.json()
+def _request(url: str, headers: Dict):
+    import requests
 
-    logger.error(
-        "Request to get remotes failed with status code %s", response.status_code
-    )
-    return {}
+    return requests.request("GET", url, headers=headers, data={}, timeout=10)
+
+
+class RemotesCache:
+    """The remotes of the API, cached in `path`, see the module's documentation."""
+
+    def __init__(
+        self,
+        path: str = REMOTES_CACHE_PATH,
+        ttl: float = REMOTES_CACHE_TTL_SECONDS,
+        removed_after: int = REMOTES_REMOVED_AFTER_FETCHES,
+    ):
+        self.path = path
+        self.ttl = ttl
+        self.removed_after = max(removed_after, 1)
+        self.lock = threading.Lock()
+
+    def _load(self) -> Dict:
+        try:
+            with open(self.path, "r", encoding="utf-8") as fin:
+                return json.load(fin)
+        except (OSError, ValueError):
+            return {}
+
+    def _save(self, state: Dict):
+        os.makedirs(os.path.dirname(self.path) or ".", exist_ok=True)
+        tmp_path = f"{self.path}.{os.getpid()}.tmp"
+        with open(tmp_path, "w", encoding="utf-8") as fout:
+            json.dump(state, fout)
+        os.replace(tmp_path, self.path)
+
+    def _fetch(self, state: Dict, api_key: str, now: float) -> bool:
+        """Refresh `state` from the API. Returns whether it changed."""
+        headers = {"Authorization": f"Bearer {api_key}"}
+        if state.get("remotes") is not None:
+            if state.get("etag"):
+                headers["If-None-Match"] = state["etag"]
+            if state.get("last_modified"):
+                headers["If-Modified-Since"] = state["last_modified"]
+        try:
+            response = _request(state["url"], headers)
+        except Exception as e:
+            logger.error("Request to get remotes failed: %s", str(e))
+            return False
+
+        if response.status_code == 304 and state.get("remotes") is not None:
+            logger.info(
+                "Remotes not modified since %s", state.get("last_modified") or state.get("etag")
+            )
+            state["fetched_at"] = now
+            return True
+        if response.status_code == 200:
+            state.update(
+                remotes=response.json(),
+                etag=response.headers.get("ETag"),
+                last_modified=response.headers.get("Last-Modified"),
+                fetched_at=now,
+            )
+            return True
+
+        logger.error("Request to get remotes failed with status code %s", response.status_code)
+        return False
+
+    def get(self, host: str, api_key: str, track_changes: bool = False) -> RemotesUpdate:
+        """
+        The remotes of the tenant. With `track_changes`, the update also has the remotes
+        added and removed since the last call with `track_changes`; an empty list of
+        remotes, as the API returns on some failures, is not taken as every remote
+        being removed, and a remote is removed once it has been missing from
+        `removed_after` consecutive fetches.
+        """
+        with self.lock:
+            now = time.time()
+            state = self._load()
+            changed = False
+            if state.get("url") != remotes_url(host):
+                state = {"url": remotes_url(host)}
+            if state.get("remotes") is None or now - state.get("fetched_at", 0) >= self.ttl:
+                changed = self._fetch(state, api_key, now)
+                if state.get("remotes") is not None and not changed:
+                    logger.warning(
+                        "Using the remotes fetched at %s", time.ctime(state["fetched_at"])
+                    )
+            fetched = changed
+
+            update = RemotesUpdate(state.get("remotes") or {})
+            if track_changes and update.remotes:
+                baseline = state.get("baseline")
+                urls = dict(update.index.urls)
+                if baseline is not None:
+                    previous = RemoteIndex(
+                        {"": {"integrationId": "", "remotes": list(baseline.values())}}
+                    )
+                    update.added, missing = update.index.diff(previous)
+                    # Normalized remote -> consecutive fetches it has been missing from
+                    previous_misses = state.get("missing") or {}
+                    misses = {}
+                    for remote in missing:
+                        key = normalize_remote(remote)
+                        misses[key] = previous_misses.get(key, 0) + int(fetched)
+                        if misses[key] >= self.removed_after:
+                            update.removed.append(remote)
+                            del misses[key]
+                        else:
+                            # Still tracked until it has been missing long enough
+                            urls[key] = baseline[key]
+                    if misses != (state.get("missing") or {}):
+                        state["missing"] = misses
+                        changed = True
+                    if update.added or update.removed:
+                        logger.info(
+                            "%d remotes added, %d removed", len(update.added), len(update.removed)
+                        )
+                    if misses:
+                        logger.info(
+                            "%d remotes missing from the response, not removed yet", len(misses)
+                        )
+                if baseline != urls:
+                    state["baseline"] = urls
+                    changed = True
+
+            if changed:
+                self._save(state)
+            return update
+
+
+_cache = None
+_cache_lock = threading.Lock()
+
+
+def get_remotes_cache() -> RemotesCache:
+    global _cache
+    with _cache_lock:
+        if _cache is None:
+            _cache = RemotesCache()
+        return _cache
+
+
+def get_remotes(host, api_key):
+    return get_remotes_cache().get(host, api_key).remotes
+
+
+def get_remotes_update(host, api_key) -> RemotesUpdate:
+    """The remotes, and the changes since the last call, see RemotesCache.get."""
+    return get_remotes_cache().get(host, api_key, track_changes=True)
 
 
 def main():
     from pprint import pprint
-    from crowdgit import load_env
-
-    load_env()
 
     pprint(
         get_remotes(
             os.environ["CROWD_HOST"],
-            os.environ["TENANT_ID"],
             os.environ["CROWD_API_KEY"],
         )
     )
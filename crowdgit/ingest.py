@@ -5,78 +5,76 @@ If called from the command line it expects one argument, the address of a remote
 It will prepare the activites (which will include either cloning it to ENV[REPO_DIR]
 if it has not been cloned yet) and send them to SQS.
 """
+from crowdgit import load_env
+
+if __name__ == "__main__":
+    # Run as python -m: .env has to be loaded before the modules below read their settings
+    load_env()
+
 import os
 import json
+import time
+import signal
+import threading
+import subprocess
 from datetime import datetime
-from typing import List, Dict
+from typing import Callable, Dict, Iterable, List, Optional, Tuple
 from uuid import uuid1 as uuid
 
-import tqdm
-from confluent_kafka import Producer
 import shutil
 
-from crowdgit import LOCAL_DIR
-from crowdgit.get_remotes import get_remotes
+from crowdgit.get_remotes import RemoteIndex, get_remotes_update
 from crowdgit.activity import prepare_crowd_activities
-from crowdgit.repo import get_repo_name, get_local_repo, REPOS_DIR, BAD_COMMITS_DIR
+from crowdgit.repo import (
+    get_repo_name,
+    get_local_repo,
+    get_repo_size,
+    get_default_branch,
+    get_new_commits,
+    get_commits_since_until,
+    get_commits_window,
+    get_tip,
+    list_commits,
+    count_commits,
+    clone_repo,
+    fetch_repo,
+    merge_new_commits,
+    REPOS_DIR,
+    BAD_COMMITS_DIR,
+)
+from crowdgit.outbox import Outbox, OutboxTracker, OUTBOX_DIR
+from crowdgit.dedup import SentFilter, SENT_DIR
+from crowdgit.checkpoint import (
+    OnboardingCheckpoint,
+    ONBOARDING_WINDOW_COMMITS,
+    ONBOARDING_RECENT_DAYS,
+    RECENT,
+    BACKFILL,
+)
+from crowdgit.ratelimit import get_rate_limiter, INCREMENTAL, ONBOARDING
+from crowdgit.partitioning import RANDOM, check_strategy, partition_key, group_by_key
+from crowdgit.producer import get_producer_manager, close_producer, KAFKA_FLUSH_TIMEOUT_SECONDS
+from crowdgit.serialization import Envelope, SQS_MAX_MESSAGE_SIZE_IN_BYTES
+from crowdgit.scheduler import Scheduler
+from crowdgit.lanes import Lanes, classify, HEAVY
+from crowdgit.leases import Lease, owned_by_this_node
+from crowdgit import metrics
 
 from crowdgit.logger import get_logger
 
 logger = get_logger(__name__)
 
 
-SQS_MAX_MESSAGE_SIZE_IN_BYTES = 262144
 SQS_OVERHEAD = 6000
 
-
-def string_converter(o):
-    """
-    Function that converts object to string
-    This will be used when converting to Json, to convert non serializable attributes
-    """
-    return str(o)
-
-
-def baseline_message_size() -> int:
-    """
-    Calculate the size of baseline (with empty activityData) json object in bytes
-    """
-    body = json.dumps(
-        {
-            "type": "create_and_process_activity_result",
-            "tenantId": os.environ["TENANT_ID"],
-            "segmentId": os.environ["TENANT_ID"],
-            "integrationId": os.environ["TENANT_ID"],
-            "activityData": "",
-        },
-        default=string_converter,
-    )
-
-    return len(body.encode("utf-8")) + SQS_OVERHEAD  # 5000 is a rough estimate of the overhead
-
-
-def truncate_to_bytes(s: str, max_bytes: int, encoding="utf-8"):
-    """
-    Truncate the string `s` so that its byte size is strictly less than `max_bytes`.
-
-    Parameters:
-    s (str): The string to truncate.
-    max_bytes (int): The maximum allowed size in bytes.
-    encoding (str): The encoding to use for the byte representation.
-
-    Returns:
-    str: The truncated string.
-    """
-    encoded_string = s.encode(encoding)
-
-    if len(encoded_string) < max_bytes:
-        return s
-
-    truncated_string = s
-    while len(truncated_string.encode(encoding)) >= max_bytes:
-        truncated_string = truncated_string[:-1]
-
-    return truncated_string
+KAFKA_BACKPRESSURE_POLL_SECONDS = 0.5
+# How often the daemon fetches the remotes of the tenant
+REMOTES_REFRESH_SECONDS = float(os.environ.get("REMOTES_REFRESH_SECONDS", 900))
+# Longest the daemon waits for a job before checking for a stop
+DAEMON_TICK_SECONDS = 1.0
+# Windows of older history the daemon backfills per job, so that a due remote waits
+# for at most that long for the heavy lane
+DAEMON_BACKFILL_WINDOWS = int(os.environ.get("DAEMON_BACKFILL_WINDOWS", 1))
 
 
 class Queue:
@@ -86,138 +84,921 @@ class Queue:
 
     def __init__(self):
         """
-        Initialise class to handle SQS requests.
+        Initialise class to handle SQS requests. All queues share the process' producer
+        and rate limits, so creating one is cheap.
         """
         self.kafka_topic = os.environ['KAFKA_TOPIC']
-        self.kafka_producer = Producer(
-            {
-                'bootstrap.servers': os.environ['KAFKA_BROKERS'],
-                'client.id': 'git-integration',
-                **json.loads(os.environ['KAFKA_CONFIG']),
-            }
+        # Onboarding traffic can go to its own topic, so that it never delays
+        # incremental updates downstream
+        self.onboarding_topic = os.environ.get('KAFKA_ONBOARDING_TOPIC') or self.kafka_topic
+        self.rate_limiter = get_rate_limiter()
+        # How messages are keyed, and so partitioned; see crowdgit.partitioning
+        self.partition_key = check_strategy(os.environ.get('KAFKA_PARTITION_KEY', RANDOM))
+        self.group_by_key = os.environ.get('KAFKA_GROUP_BY_KEY', 'false').lower() in (
+            '1',
+            'true',
+            'yes',
         )
+        self.kafka_producer = get_producer_manager().producer
+
+    def wait(self, seconds: float):
+        """Wait for `seconds` while serving delivery reports."""
+        deadline = time.monotonic() + seconds
+        while (remaining := deadline - time.monotonic()) > 0:
+            self.kafka_producer.poll(remaining)
+
+    def wait_for_deliveries(
+        self, outstanding: Callable[[], int], timeout: float = KAFKA_FLUSH_TIMEOUT_SECONDS
+    ) -> int:
+        """
+        Serve delivery reports until `outstanding()` messages is 0 or `timeout` expires.
+
+        The producer is shared with other queues, so instead of flushing it, which would
+        also wait for their messages, we wait only for our own. Returns the number of
+        messages still outstanding.
+        """
+        deadline = time.monotonic() + timeout
+        while outstanding() > 0 and (remaining := deadline - time.monotonic()) > 0:
+            self.kafka_producer.poll(min(remaining, KAFKA_BACKPRESSURE_POLL_SECONDS))
+        return max(outstanding(), 0)
+
+    def produce(
+        self,
+        key: str,
+        value: bytes,
+        on_delivery=None,
+        lane: str = INCREMENTAL,
+        repo: str | None = None,
+    ):
+        """
+        Enqueue a message in the producer's local queue without waiting for the broker.
+
+        The message waits first for the rate limits of its lane and repository. If the
+        local queue is full (BufferError) we poll, which serves delivery reports and
+        frees room in the queue, until the message fits.
+        """
+        wait = self.rate_limiter.reserve(lane, repo)
+        if wait:
+            self.wait(wait)
+
+        topic = self.onboarding_topic if lane == ONBOARDING else self.kafka_topic
+        while True:
+            try:
+                self.kafka_producer.produce(topic, key=key, value=value, on_delivery=on_delivery)
+                break
+            except BufferError:
+                logger.debug("Producer queue full, waiting for deliveries")
+                self.kafka_producer.poll(KAFKA_BACKPRESSURE_POLL_SECONDS)
+
+        # Serve delivery reports of messages already acknowledged
+        self.kafka_producer.poll(0)
 
     def send_messages(
         self,
         segment_id: str,
         integration_id: str,
-        records: List[Dict],
+        records: Iterable[Dict],
         verbose: bool = False,
-    ) -> List[Dict]:
+        batched: bool = True,
+        on_delivered: Callable[[int, bool], None] | None = None,
+        sent_filter: SentFilter | None = None,
+        lane: str = INCREMENTAL,
+        repo: str | None = None,
+    ) -> Dict[str, int]:
         """
         Send a message to the queue
 
         Args:
-            records (List[Dict]): messages to be sent to the queue
+            records (Iterable[Dict]): messages to be sent to the queue
+            batched (bool): if True messages are batched by the producer and we wait for
+                their delivery once at the end; if False we wait for every message as soon
+                as it is produced.
+            on_delivered (callable): called with the position of a record in `records` and
+                whether it was delivered, once the broker reports on it.
+            sent_filter (SentFilter): if given, records it has as already sent to the segment
+                are skipped, and delivered records are added to it.
+            lane (str): ratelimit.INCREMENTAL or ratelimit.ONBOARDING, the rate limiting lane
+                of the messages.
+            repo (str): name of the repository the records come from, for rate limiting.
 
         Returns:
-            list: List of SQS message responses
+            dict: Counts of delivered, failed, pending (not delivered before
+                KAFKA_FLUSH_TIMEOUT_SECONDS) and skipped (already sent) messages.
         """
 
         operation = "upsert_activities_with_members"
+        envelope = Envelope(
+            os.environ["TENANT_ID"],
+            segment_id,
+            integration_id,
+            max_bytes=SQS_MAX_MESSAGE_SIZE_IN_BYTES - SQS_OVERHEAD,
+        )
 
-        def get_body_json(record):
-            body = json.dumps(
-                {
-                    "type": "create_and_process_activity_result",
-                    "tenantId": os.environ["TENANT_ID"],
-                    "segmentId": segment_id,
-                    "integrationId": integration_id,
-                    "activityData": record,
-                },
-                default=string_converter,
-            )
-
-            if len(body.encode("utf-8")) > SQS_MAX_MESSAGE_SIZE_IN_BYTES:
-                logger.warning(
-                    "The activity body is too big (%d bytes). Truncating the body.",
-                    len(body.encode("utf-8")),
-                )
-                record["body"] = truncate_to_bytes(
-                    record["body"], SQS_MAX_MESSAGE_SIZE_IN_BYTES - baseline_message_size()
-                )
-                body = json.dumps(
-                    {
-                        "type": "create_and_process_activity_result",
-                        "tenantId": os.environ["TENANT_ID"],
-                        "segmentId": segment_id,
-                        "integrationId": integration_id,
-                        "activityData": record,
-                    },
-                    default=string_converter,
-                )
-
-                logger.info("Truncated body size: %d bytes", len(body.encode("utf-8")))
+        platform = "git"
+        stats = {"delivered": 0, "failed": 0, "pending": 0, "skipped": 0}
+        # Delivery reports can be served by the producer's polling thread
+        stats_lock = threading.Lock()
 
-            return body
+        def delivery_report(index: int, source_id: str | None):
+            def on_delivery(err, msg):
+                if err is not None:
+                    with stats_lock:
+                        stats["failed"] += 1
+                    logger.error("Failed to deliver message %s: %s", msg.key(), err)
+                else:
+                    with stats_lock:
+                        stats["delivered"] += 1
+                    if sent_filter is not None and source_id:
+                        sent_filter.add(segment_id, source_id)
+                if on_delivered is not None:
+                    on_delivered(index, err is None)
 
-        platform = "git"
-        responses = []
+            return on_delivery
 
         if verbose:
+            import tqdm
+
             commits_iter = tqdm.tqdm(records, desc="Processing records")
         else:
             commits_iter = records
 
-        for record in commits_iter:
-            deduplication_id = str(uuid())
-            message_id = f"{os.environ['TENANT_ID']}-{operation}-{platform}-{deduplication_id}"
+        def message_key(record: Dict) -> str:
+            # Unique per message only with random keys, see crowdgit.partitioning
+            if self.partition_key == RANDOM:
+                key = str(uuid())
+            else:
+                key = partition_key(record, self.partition_key, repo)
+            return f"{os.environ['TENANT_ID']}-{operation}-{platform}-{key}"
 
-            body = get_body_json(record)
+        keyed = ((message_key(record), index, record) for index, record in enumerate(commits_iter))
+        if self.group_by_key:
+            # Needs every record in memory, to emit each key's records contiguously
+            keyed = group_by_key(keyed)
 
-            self.kafka_producer.produce(self.kafka_topic, key=message_id, value=body)
-            self.kafka_producer.flush()
+        sent = 0
+        sent_bytes = 0
+        # Only the time in serialization and in the producer: the records may be
+        # produced lazily by the caller
+        serialize_seconds = 0.0
+        produce_seconds = 0.0
+        for message_id, index, record in keyed:
+            source_id = record.get("sourceId")
+            if sent_filter is not None and source_id:
+                if sent_filter.contains(segment_id, source_id):
+                    stats["skipped"] += 1
+                    if on_delivered is not None:
+                        on_delivered(index, True)
+                    continue
 
-        return responses
+            serialize_start = time.perf_counter()
+            body = envelope.serialize(record)
+            produce_start = time.perf_counter()
+            serialize_seconds += produce_start - serialize_start
+
+            self.produce(
+                message_id,
+                body,
+                on_delivery=delivery_report(index, source_id),
+                lane=lane,
+                repo=repo,
+            )
+            sent += 1
+            sent_bytes += len(body)
+            if not batched:
+                self.wait_for_deliveries(lambda: sent - stats["delivered"] - stats["failed"])
+            produce_seconds += time.perf_counter() - produce_start
+
+        wait_start = time.perf_counter()
+        stats["pending"] = self.wait_for_deliveries(
+            lambda: sent - stats["delivered"] - stats["failed"]
+        )
+        produce_seconds += time.perf_counter() - wait_start
+
+        metrics.observe("serialize", serialize_seconds, repo)
+        metrics.observe("produce", produce_seconds, repo)
+        metrics.inc("messages", stats["delivered"], repo)
+        metrics.inc("failed_messages", stats["failed"], repo)
+        metrics.inc("bytes", sent_bytes, repo)
+        if sent_filter is not None:
+            sent_filter.commit()
+
+        logger.info(
+            "Sent %d messages for segment %s: %d delivered, %d failed, %d pending, "
+            "%d skipped as already sent",
+            sent,
+            segment_id,
+            stats["delivered"],
+            stats["failed"],
+            stats["pending"],
+            stats["skipped"],
+        )
+
+        return stats
+
+    def drain_outbox(
+        self,
+        outbox: Outbox,
+        verbose: bool = False,
+        sent_filter: SentFilter | None = None,
+        lane: str = INCREMENTAL,
+    ) -> Dict[str, int]:
+        """
+        Send the activities pending in `outbox`, acknowledging in the outbox the ones
+        delivered. Those that were not delivered stay in the outbox for the next run.
+        """
+        tracker = OutboxTracker(outbox)
+        try:
+            stats = self.send_messages(
+                outbox.segment_id,
+                outbox.integration_id,
+                outbox.read(),
+                verbose=verbose,
+                on_delivered=tracker,
+                sent_filter=sent_filter,
+                lane=lane,
+                repo=outbox.repo_name,
+            )
+        finally:
+            tracker.commit()
+
+        if outbox.pending():
+            logger.error(
+                "%d activities were not delivered and remain in outbox %s",
+                outbox.pending(),
+                outbox.path,
+            )
+
+        return stats
 
     def ingest_remote(
+        self, segment_id: str, integration_id: str, remote: str, **kwargs
+    ) -> Optional[int]:
+        """Ingest `remote` for one segment, see ingest_segments."""
+        return self.ingest_segments(remote, [(segment_id, integration_id)], **kwargs)
+
+    def ingest_segments(
         self,
-        segment_id: str,
-        integration_id: str,
         remote: str,
+        segments: List[Tuple[str, str]],
         verbose: bool = False,
         since: str = None,
         until: str = None,
-    ):
+        force: bool = False,
+        lease: Lease | None = None,
+        full_history: bool = False,
+        backfill: bool = False,
+        max_windows: Optional[int] = None,
+    ) -> Optional[int]:
+        """
+        Extract the activities of `remote` and send them to each (segment id, integration
+        id) of `segments`: those of the new commits, of the commits between `since` and
+        `until`, or with `full_history`, of every commit, fetching the new ones first.
+        The commits are extracted, and their activities prepared, once for all the
+        segments, and appended to the outbox of each.
+
+        Onboardings, of the whole history, only send the recent commits; with `backfill`,
+        the older commits of an onboarding are sent, or at most `max_windows` windows of
+        them, and with `full_history` too, the whole history at once. See
+        crowdgit.checkpoint.
+
+        Unless `force` is set, activities that were already sent to a segment are not
+        sent to it again.
+
+        Unless the caller passes the `lease` it holds on the repository, the lease is
+        taken for the ingestion.
+
+        Returns the number of commits extracted, or None if the remote was skipped,
+        because it is already being ingested, or failed.
+        """
         repo_name = get_repo_name(remote)
-        semaphore = os.path.join(LOCAL_DIR, "running", repo_name)
-        if not os.path.exists(os.path.dirname(semaphore)):
-            os.makedirs(os.path.dirname(semaphore))
+        checkpoints = {
+            segment_id: OnboardingCheckpoint(repo_name, segment_id) for segment_id, _ in segments
+        }
+        if backfill and not full_history:
+            if all(checkpoint.load() is None for checkpoint in checkpoints.values()):
+                return 0
 
-        if os.path.exists(semaphore):
-            with open(semaphore, "r", encoding="utf-8") as fin:
-                timestamp = fin.read().strip()
-            logger.info("Skipping %s, already running since %s", repo_name, timestamp)
-            return
+        own_lease = lease is None
+        if own_lease:
+            lease = acquire_lease(repo_name)
+            if lease is None:
+                return None
 
-        with open(semaphore, "w", encoding="utf-8") as fout:
-            logger.info("Setting semaphore in %s", semaphore)
-            fout.write(datetime.now().strftime("%Y-%m-%d %H:%M:%S"))
+        for checkpoint in checkpoints.values():
+            # The onboarding may have moved on before we got the lease
+            checkpoint.load()
+            # A reonboard starts over rather than backfill a previous onboarding
+            if full_history and checkpoint.backfilling():
+                checkpoint.clear()
 
-        try:
-            activities = prepare_crowd_activities(
-                remote, verbose=verbose, since=since, until=until
-            )
+        # The whole history, of repositories we have not cloned yet, of reonboards, and
+        # of onboardings that were interrupted, is sent window by window. Repositories
+        # whose older history is left to backfill get their new commits meanwhile
+        cloned = os.path.exists(get_local_repo(remote, REPOS_DIR))
+        onboarding = []
+        incremental = []
+        for segment_id, integration_id in segments:
+            checkpoint = checkpoints[segment_id]
+            if backfill:
+                if full_history or checkpoint.state is not None:
+                    onboarding.append((segment_id, integration_id))
+            elif (
+                since is None
+                and until is None
+                and (
+                    full_history
+                    or not cloned
+                    or (checkpoint.state is not None and not checkpoint.backfilling())
+                )
+            ):
+                onboarding.append((segment_id, integration_id))
+            else:
+                incremental.append((segment_id, integration_id))
 
-        except Exception as e:
-            logger.error("Failed trying to prepare activities for %s. Error:\n%s", remote, str(e))
-            if os.path.exists(semaphore):
-                os.remove(semaphore)
-            return
+        # Activities of onboardings, backfills and since/until go through the onboarding lane
+        lanes = {segment_id: ONBOARDING for segment_id, _ in onboarding}
+        for segment_id, _ in incremental:
+            lanes[segment_id] = INCREMENTAL if since is None and until is None else ONBOARDING
 
+        sent_filter = None
         try:
-            self.send_messages(segment_id, integration_id, activities, verbose=verbose)
+            if not force:
+                sent_filter = SentFilter(repo_name)
+            outboxes = {
+                segment_id: Outbox(repo_name, segment_id, integration_id)
+                for segment_id, integration_id in onboarding + incremental
+            }
+
+            # Activities left over by a previous run that died or could not reach Kafka
+            for segment_id, outbox in outboxes.items():
+                if outbox.pending():
+                    logger.info(
+                        "Resuming %d activities pending in the outbox for %s, segment %s",
+                        outbox.pending(),
+                        remote,
+                        segment_id,
+                    )
+                    self.drain_outbox(
+                        outbox, verbose=verbose, sent_filter=sent_filter, lane=lanes[segment_id]
+                    )
+
+            commits = 0
+            if incremental:
+                try:
+                    if since is None and until is None:
+                        new_commits = get_new_commits(
+                            remote, REPOS_DIR, verbose=verbose, merge=False
+                        )
+                    else:
+                        new_commits = get_commits_since_until(
+                            remote, since, until, REPOS_DIR, verbose=verbose
+                        )
+                    activities = prepare_crowd_activities(remote, new_commits, verbose=verbose)
+                    # Whoever took the repository over sends these
+                    lease.check()
+                    for segment_id, _ in incremental:
+                        outboxes[segment_id].append(activities)
+                    del activities
+
+                    # Only move the local branch forward once the activities are in the
+                    # outboxes
+                    if since is None and until is None and new_commits:
+                        merge_new_commits(remote, REPOS_DIR)
+                except Exception as e:
+                    logger.error(
+                        "Failed trying to prepare activities for %s. Error:\n%s", remote, str(e)
+                    )
+                    return None
+
+                for segment_id, _ in incremental:
+                    lease.check()
+                    self.drain_outbox(
+                        outboxes[segment_id],
+                        verbose=verbose,
+                        sent_filter=sent_filter,
+                        lane=lanes[segment_id],
+                    )
+                commits = len(new_commits)
+
+            # The segments whose onboardings are at the same point are onboarded together
+            groups: Dict[Tuple, List[str]] = {}
+            for segment_id, _ in onboarding:
+                state = checkpoints[segment_id].state or {}
+                groups.setdefault((state.get("tip"), state.get("done")), []).append(segment_id)
+            for group in groups.values():
+                try:
+                    sent = self.onboard_remote(
+                        remote,
+                        [(outboxes[segment_id], checkpoints[segment_id]) for segment_id in group],
+                        lease=lease,
+                        verbose=verbose,
+                        sent_filter=sent_filter,
+                        backfill=backfill,
+                        max_windows=max_windows,
+                    )
+                except Exception as e:
+                    logger.error(
+                        "Failed trying to onboard %s, %.1f%% done. Error:\n%s",
+                        remote,
+                        checkpoints[group[0]].progress(),
+                        str(e),
+                    )
+                    return None
+                commits = max(commits, sent)
+            return commits
         except Exception as e:
-            logger.error("Failed trying to send messages for %s", remote, str(e))
+            logger.error("Failed trying to send messages for %s: %s", remote, str(e))
+            return None
         finally:
-            if os.path.exists(semaphore):
-                os.remove(semaphore)
+            if sent_filter is not None:
+                sent_filter.close()
+            if own_lease:
+                lease.release()
+
+    def onboard_remote(
+        self,
+        remote: str,
+        targets: List[Tuple[Outbox, OnboardingCheckpoint]],
+        lease: Optional[Lease] = None,
+        verbose: bool = False,
+        sent_filter: Optional[SentFilter] = None,
+        lane: str = ONBOARDING,
+        backfill: bool = False,
+        max_windows: Optional[int] = None,
+    ) -> int:
+        """
+        Send the activities of the history of `remote` to the segments of `targets`, the
+        outbox and checkpoint of each, one window of commits at a time, newest first,
+        resuming from the checkpoints (see crowdgit.checkpoint), which must be at the
+        same point. The repository is cloned, or fetched if it already is. If `lease`
+        is lost, the onboarding stops before the next window, at the last checkpoint.
+
+        Only the recent commits are sent, unless `backfill` is set, in which case the
+        older ones are too, or at most `max_windows` windows of them.
+
+        Returns the number of commits sent.
+        """
+        repo_path = get_local_repo(remote, REPOS_DIR)
+        outboxes = [outbox for outbox, _ in targets]
+        checkpoints = [checkpoint for _, checkpoint in targets]
+        checkpoint = checkpoints[0]
+        segment_ids = ", ".join(outbox.segment_id for outbox in outboxes)
+        state = checkpoint.state or {}
+
+        def save(**state):
+            for checkpoint in checkpoints:
+                checkpoint.save(**state)
+
+        if state.get("tip") is None:
+            if any(
+                checkpoint.state and checkpoint.state.get("cloning") for checkpoint in checkpoints
+            ):
+                if os.path.exists(repo_path):
+                    logger.info("Deleting the clone of %s, interrupted while cloning", remote)
+                    shutil.rmtree(repo_path)
+            if os.path.exists(repo_path):
+                save(cloning=False)
+                fetch_repo(remote, REPOS_DIR)
+            else:
+                save(cloning=True)
+                if clone_repo(remote, REPOS_DIR) == 1:
+                    for checkpoint in checkpoints:
+                        checkpoint.clear()
+                    return 0
+            tip = get_tip(repo_path, get_default_branch(repo_path))
+            hashes = list_commits(repo_path, tip)
+            window = ONBOARDING_WINDOW_COMMITS
+            # The commits of the last days come first in the history, and at least a window
+            recent = len(hashes)
+            if ONBOARDING_RECENT_DAYS:
+                cutoff = datetime.fromtimestamp(time.time() - ONBOARDING_RECENT_DAYS * 86400)
+                recent = count_commits(repo_path, tip, since=cutoff.strftime("%Y-%m-%dT%H:%M:%S"))
+                recent = max(min(recent, len(hashes)), min(window, len(hashes)))
+            save(cloning=False, tip=tip, total=len(hashes), recent=recent, done=0, window=window)
+        else:
+            hashes = list_commits(repo_path, state["tip"])
+            logger.info(
+                "Resuming the onboarding of %s for segment %s at %d of %d commits (%.1f%%)",
+                remote,
+                segment_ids,
+                state["done"],
+                state["total"],
+                checkpoint.progress(),
+            )
+
+        window = checkpoint.state["window"]
+        recent = checkpoint.state.get("recent", len(hashes))
+        # The recent commits are sent in windows from the newest, and the older ones in
+        # windows from the last recent commit
+        end = len(hashes) if backfill else recent
+        starts = list(range(checkpoint.state["done"], recent, window))
+        starts += range(max(checkpoint.state["done"], recent), end, window)
+        if backfill and max_windows:
+            starts = starts[:max_windows]
+
+        sent = 0
+        for start in starts:
+            stop = min(start + window, recent if start < recent else end)
+            commits = get_commits_window(repo_path, hashes[start:stop], verbose=verbose)
+            activities = prepare_crowd_activities(remote, commits, verbose=verbose)
+            if lease is not None:
+                lease.check()
+            for outbox in outboxes:
+                outbox.append(activities)
+            sent += len(commits)
+            del commits, activities
+            save(done=stop)
+            logger.info(
+                "Onboarding %s for segment %s: %d of %d commits (%.1f%%)",
+                remote,
+                segment_ids,
+                checkpoint.state["done"],
+                len(hashes),
+                checkpoint.progress(),
+            )
+            for outbox in outboxes:
+                if lease is not None:
+                    lease.check()
+                self.drain_outbox(outbox, verbose=verbose, sent_filter=sent_filter, lane=lane)
+
+        # Only move the local branch forward once the recent activities are in the
+        # outbox: new commits are then sent as they come, while the older ones are
+        # backfilled
+        if hashes and checkpoint.state["done"] >= recent:
+            merge_new_commits(remote, REPOS_DIR, revision=checkpoint.state["tip"])
+        if checkpoint.state["done"] < len(hashes):
+            if checkpoint.backfilling() and not backfill:
+                logger.info(
+                    "Onboarded the %d most recent commits of %s for segment %s, "
+                    "%d older left to backfill",
+                    recent,
+                    remote,
+                    segment_ids,
+                    len(hashes) - checkpoint.state["done"],
+                )
+            return sent
+        for checkpoint in checkpoints:
+            checkpoint.clear()
+        return sent
 
     @staticmethod
     def make_id() -> str:
         return str(uuid())
 
 
+def segments_by_remote(remotes: Dict, remote_filter: str = "") -> Dict[str, List[Tuple[str, str]]]:
+    """
+    The (segment id, integration id) pairs tracking each remote in the response of
+    get_remotes, restricted to `remote_filter` if given.
+
+    >>> segments_by_remote({
+    ...     "s1": {"integrationId": "i1", "remotes": ["https://github.com/a/b"]},
+    ...     "s2": {"integrationId": "i2", "remotes": ["https://github.com/a/b", "https://github.com/a/c"]},
+    ... })
+    {'https://github.com/a/b': [('s1', 'i1'), ('s2', 'i2')], 'https://github.com/a/c': [('s2', 'i2')]}
+    """
+    index = RemoteIndex(remotes)
+    if not remote_filter:
+        return index.by_remote()
+    if remote_filter not in index:
+        return {}
+    return {index.url(remote_filter): index.lookup(remote_filter)}
+
+
+def owned_segments(segments: Dict[str, List[Tuple[str, str]]]) -> Dict[str, List[Tuple[str, str]]]:
+    """The remotes of `segments` that this node ingests, see crowdgit.leases."""
+    owned = {
+        remote: remote_segments
+        for remote, remote_segments in segments.items()
+        if owned_by_this_node(get_repo_name(remote))
+    }
+    if len(owned) < len(segments):
+        logger.info("This node owns %d of %d remotes", len(owned), len(segments))
+    return owned
+
+
+def acquire_lease(repo_name: str) -> Optional[Lease]:
+    """The lease on `repo_name`, or None, logged, if someone else holds it."""
+    lease = Lease(repo_name)
+    if lease.acquire():
+        return lease
+    holder = lease.holder() or {}
+    logger.info(
+        "Skipping %s, already being processed by %s since %s",
+        repo_name,
+        holder.get("owner"),
+        datetime.fromtimestamp(holder.get("acquired_at", time.time())).strftime(
+            "%Y-%m-%d %H:%M:%S"
+        ),
+    )
+    return None
+
+
+def delete_local_repo(remote: str):
+    """Delete the clone and the bad commits of `remote`, so that it is cloned again."""
+    repo_path = get_local_repo(remote, REPOS_DIR)
+    if os.path.exists(repo_path):
+        shutil.rmtree(repo_path)
+        logger.info("Deleted repo %s", remote)
+    else:
+        logger.info("Repo %s not found", remote)
+
+    delete_bad_commits(remote)
+    OnboardingCheckpoint.delete(get_repo_name(remote))
+
+
+def delete_bad_commits(remote: str):
+    """Delete the bad commits stored for `remote`, before its history is extracted again."""
+    bad_commits_path = get_local_repo(remote, BAD_COMMITS_DIR)
+    deleted = False
+    if os.path.exists(bad_commits_path + ".txt"):
+        os.remove(bad_commits_path + ".txt")
+        deleted = True
+    if os.path.exists(bad_commits_path):
+        shutil.rmtree(bad_commits_path)
+        deleted = True
+    if deleted:
+        logger.info("Deleted bad commits for repo %s", remote)
+    else:
+        logger.info("Bad commits for repo %s not found", remote)
+
+
+def drain_outboxes(queue: Optional[Queue], repo_name: str) -> int:
+    """Send what is left in the outboxes of every segment of `repo_name`, with `queue` if
+    given. Returns the number of activities still pending."""
+    outbox_path = os.path.join(OUTBOX_DIR, repo_name)
+    if not os.path.isdir(outbox_path):
+        return 0
+    pending = 0
+    sent_filter = SentFilter(repo_name, SENT_DIR) if queue is not None else None
+    try:
+        for segment_id in sorted(os.listdir(outbox_path)):
+            try:
+                with open(
+                    os.path.join(outbox_path, segment_id, "meta.json"), "r", encoding="utf-8"
+                ) as fin:
+                    integration_id = json.load(fin)["integrationId"]
+            except (OSError, ValueError, KeyError):
+                integration_id = None
+            outbox = Outbox(repo_name, segment_id, integration_id, outbox_dir=OUTBOX_DIR)
+            if outbox.pending() and queue is not None and integration_id is not None:
+                queue.drain_outbox(outbox, sent_filter=sent_filter)
+            pending += outbox.pending()
+    finally:
+        if sent_filter is not None:
+            sent_filter.close()
+    return pending
+
+
+def collect_removed_remotes(removed: Iterable[str], queue: Optional[Queue] = None):
+    """Delete what we keep on disk of the remotes no tenant segment tracks anymore:
+    the clone, the bad commits, the outbox and the record of sent activities. The
+    activities left in the outbox are sent first, with `queue`; an outbox with
+    activities that could not be delivered is kept, with the record of sent activities."""
+    for remote in removed:
+        repo_name = get_repo_name(remote)
+        lease = acquire_lease(repo_name)
+        if lease is None:
+            continue
+        try:
+            logger.info("Remote %s was removed, deleting its local state", remote)
+            delete_local_repo(remote)
+            pending = drain_outboxes(queue, repo_name)
+            if pending:
+                logger.warning(
+                    "Keeping the outbox of removed remote %s: %d activities were not delivered",
+                    remote,
+                    pending,
+                )
+                continue
+            outbox_path = os.path.join(OUTBOX_DIR, repo_name)
+            if os.path.exists(outbox_path):
+                shutil.rmtree(outbox_path)
+            for suffix in (".db", ".bloom"):
+                sent_path = os.path.join(SENT_DIR, repo_name + suffix)
+                if os.path.exists(sent_path):
+                    os.remove(sent_path)
+        finally:
+            lease.release()
+
+
+def ingest_remote_segments(
+    queue: Queue,
+    remote: str,
+    segments: List[Tuple[str, str]],
+    verbose: bool = False,
+    reonboard: bool = False,
+    reclone: bool = False,
+    **kwargs,
+) -> Optional[Tuple[int, bool, int]]:
+    """
+    Ingest `remote` for each of the (segment id, integration id) in `segments`, with a
+    single extraction, see Queue.ingest_segments. The job of a worker lane.
+
+    A reonboard fetches the clone and extracts its whole history again, or with
+    `reclone`, deletes it and clones it again, for a clone that is corrupted.
+
+    Returns the number of commits extracted, whether the ingestion succeeded, and the
+    size of the clone afterwards, or None if another process holds the repository.
+    """
+    # Held for all the segments, and the deletions of a reonboard
+    lease = acquire_lease(get_repo_name(remote))
+    if lease is None:
+        return None
+
+    try:
+        if reonboard:
+            if reclone:
+                logger.info("Reonboard mode enabled, deleting repo %s", remote)
+                delete_local_repo(remote)
+            else:
+                logger.info("Reonboard mode enabled, extracting the history of %s again", remote)
+                delete_bad_commits(remote)
+            kwargs["full_history"] = True
+        logger.info(
+            "Ingesting %s for segments %s",
+            remote,
+            ", ".join(segment_id for segment_id, _ in segments),
+        )
+        commits = queue.ingest_segments(remote, segments, verbose=verbose, lease=lease, **kwargs)
+    finally:
+        lease.release()
+
+    return commits or 0, commits is not None, local_repo_size(remote)
+
+
+def local_repo_size(remote: str) -> int:
+    """Size of the objects of the clone of `remote`, 0 if there is none."""
+    repo_path = get_local_repo(remote, REPOS_DIR)
+    try:
+        return get_repo_size(repo_path) if os.path.exists(repo_path) else 0
+    except subprocess.CalledProcessError:
+        return 0
+
+
+def run_daemon(queue: Queue, remote_filter: str = "", verbose: bool = False):
+    """
+    Ingest the remotes of the tenant as they come due in the adaptive schedule of
+    crowdgit.scheduler, in the worker lane of their size (see crowdgit.lanes), until
+    SIGTERM or SIGINT. The remotes are fetched again every REMOTES_REFRESH_SECONDS.
+
+    When the heavy lane has a free worker and no due remote for it, it backfills the
+    older history of the onboardings, DAEMON_BACKFILL_WINDOWS windows at a time, one
+    remote after the other.
+    """
+    scheduler = Scheduler()
+    stopping = threading.Event()
+    handlers = {
+        signum: signal.signal(signum, lambda *_: stopping.set())
+        for signum in (signal.SIGTERM, signal.SIGINT)
+    }
+    try:
+        _daemon_loop(queue, scheduler, stopping, remote_filter, verbose)
+    finally:
+        for signum, handler in handlers.items():
+            signal.signal(signum, handler)
+    logger.info("Daemon stopped")
+
+
+def _daemon_loop(
+    queue: Queue,
+    scheduler: Scheduler,
+    stopping: threading.Event,
+    remote_filter: str,
+    verbose: bool,
+):
+    lanes = Lanes()
+    # Remotes with older history to backfill, in the order they are backfilled, and the
+    # remotes being polled and backfilled
+    backfills: Dict[str, None] = {}
+    polling = set()
+    backfilling = set()
+
+    def lane_of(remote: str) -> str:
+        repo = scheduler.get(remote)
+        cloned = os.path.exists(get_local_repo(remote, REPOS_DIR))
+        # Polls of remotes that are backfilling only get their new commits
+        if OnboardingCheckpoint.phase(get_repo_name(remote)) == RECENT:
+            cloned = False
+        return classify(cloned, repo.size_bytes, repo.seconds)
+
+    def finish(finished: List):
+        polls = []
+        for key, result, seconds in finished:
+            if isinstance(key, tuple):
+                remote = key[1]
+                backfilling.discard(remote)
+                if isinstance(result, Exception):
+                    logger.error("Failed trying to backfill %s: %s", remote, str(result))
+            else:
+                remote = key
+                polling.discard(remote)
+                polls.append((remote, result, seconds))
+            # To the back of the line, if there is more to backfill
+            backfills.pop(remote, None)
+            if (
+                remote in segments
+                and OnboardingCheckpoint.phase(get_repo_name(remote)) == BACKFILL
+            ):
+                backfills[remote] = None
+        _record_polls(scheduler, polls)
+
+    segments = {}
+    refreshed = None
+    try:
+        while not stopping.is_set():
+            if refreshed is None or time.time() - refreshed >= REMOTES_REFRESH_SECONDS:
+                try:
+                    update = get_remotes_update(
+                        os.environ["CROWD_HOST"], os.environ["CROWD_API_KEY"]
+                    )
+                except Exception as e:
+                    logger.error("Failed trying to get remotes: %s", str(e))
+                    update = None
+                # Keep the remotes we have rather than forget them all when the API fails
+                if update is not None and update.remotes:
+                    segments = segments_by_remote(update.remotes, remote_filter)
+                    if not remote_filter:
+                        segments = owned_segments(segments)
+                    # New remotes are due right away
+                    scheduler.sync(segments)
+                    logger.info("Scheduling %d remotes", len(segments))
+                    collect_removed_remotes(update.removed, queue)
+                    for remote in segments:
+                        if OnboardingCheckpoint.phase(get_repo_name(remote)) == BACKFILL:
+                            backfills.setdefault(remote, None)
+                    for remote in backfills.keys() - segments.keys():
+                        del backfills[remote]
+                refreshed = time.time()
+
+            # Start every due remote whose lane has a free worker. Until we get the
+            # remotes, the schedule may have remotes we no longer track
+            while segments:
+                remote = scheduler.pop_due(
+                    accept=lambda r: r not in backfilling and lanes.has_capacity(lane_of(r))
+                )
+                if remote is None:
+                    break
+                lane = lane_of(remote)
+                logger.info("Polling %s in the %s lane", remote, lane)
+                polling.add(remote)
+                lanes.submit(
+                    lane, remote, ingest_remote_segments, queue, remote, segments[remote], verbose
+                )
+
+            # Then backfill, with what is left of the heavy lane
+            for remote in list(backfills):
+                if not lanes.has_capacity(HEAVY):
+                    break
+                if remote in polling or remote in backfilling:
+                    continue
+                logger.info("Backfilling %s", remote)
+                backfilling.add(remote)
+                lanes.submit(
+                    HEAVY,
+                    (BACKFILL, remote),
+                    ingest_remote_segments,
+                    queue,
+                    remote,
+                    segments[remote],
+                    verbose,
+                    backfill=True,
+                    max_windows=DAEMON_BACKFILL_WINDOWS,
+                )
+
+            wake_up = refreshed + REMOTES_REFRESH_SECONDS
+            next_due = scheduler.next_due()
+            if next_due is not None and segments:
+                wake_up = min(wake_up, next_due)
+            timeout = max(wake_up - time.time(), 0)
+            if lanes.pending():
+                # Due remotes waiting for a worker wait for a job to finish; check for a
+                # stop now and then
+                if not timeout:
+                    timeout = DAEMON_TICK_SECONDS
+                finish(lanes.collect(min(timeout, DAEMON_TICK_SECONDS)))
+            else:
+                stopping.wait(timeout)
+
+        # Let the polls and backfills in progress finish
+        finish(lanes.join())
+    finally:
+        lanes.shutdown()
+
+
+def _record_polls(scheduler: Scheduler, finished: List):
+    for remote, result, seconds in finished:
+        if isinstance(result, Exception):
+            logger.error("Failed trying to ingest %s: %s", remote, str(result))
+            scheduler.record(remote, commits=0, ok=False, seconds=seconds)
+        elif result is None:
+            # Not a failure: it is up to whoever holds the lease
+            scheduler.postpone(remote)
+        else:
+            commits, ok, size_bytes = result
+            scheduler.record(remote, commits, ok, seconds=seconds, size_bytes=size_bytes)
+
+
 def main():
     import argparse
 
@@ -232,7 +1013,16 @@ def main():
     parser.add_argument(
         "--reonboard",
         action="store_true",
-        help="Reonboard mode will delete repo and re-onboard.",
+        help=(
+            "Reonboard mode will fetch the repo and send the activities of its whole "
+            "history again."
+        ),
+        default=False,
+    )
+    parser.add_argument(
+        "--reclone",
+        action="store_true",
+        help="With --reonboard, delete the repo and clone it again, for a corrupted clone.",
         default=False,
     )
     parser.add_argument(
@@ -247,52 +1037,112 @@ def main():
         default=None,
         help="Only ingest commits before this date.",
     )
+    parser.add_argument(
+        "--force",
+        action="store_true",
+        help="Send every activity, even the ones that were already sent.",
+        default=False,
+    )
+    parser.add_argument(
+        "--daemon",
+        action="store_true",
+        help="Keep running, polling each remote on its own adaptive schedule.",
+        default=False,
+    )
     args = parser.parse_args()
 
     if args.reonboard and (args.since or args.until):
         parser.error("Reonboard mode cannot be used with since/until parameters.")
+    if args.reclone and not args.reonboard:
+        parser.error("--reclone can only be used with --reonboard.")
+    if args.daemon and (args.reonboard or args.since or args.until or args.force):
+        parser.error("Daemon mode cannot be used with reonboard, since/until or force.")
 
     queue = Queue()
 
-    remotes = get_remotes(
+    if args.daemon:
+        run_daemon(queue, args.remote, verbose=args.verbose)
+        logger.info("Ingestion metrics:\n%s", metrics.summary())
+        close_producer()
+        return
+
+    update = get_remotes_update(
         os.environ["CROWD_HOST"],
         os.environ["CROWD_API_KEY"],
     )
+    collect_removed_remotes(update.removed, queue)
+    segments = segments_by_remote(update.remotes, args.remote)
+    # A remote asked for explicitly is ingested whichever node owns it
+    if not args.remote:
+        segments = owned_segments(segments)
+    # Onboard the remotes added since the last run first
+    added = set(update.added)
+    segments = dict(sorted(segments.items(), key=lambda item: item[0] not in added))
 
-    for i, segment_id in enumerate(remotes):
-        integration_id = remotes[segment_id]["integrationId"]
-        for j, remote in enumerate(remotes[segment_id]["remotes"]):
+    # The durations of the last ingestions, shared with the daemon
+    scheduler = Scheduler()
+    # Those of reonboards and since/until runs say nothing of the next runs
+    timed = not (args.reonboard or args.since or args.until)
+    lanes = Lanes()
+    try:
+        for i, (remote, remote_segments) in enumerate(segments.items()):
+            # A reonboard extracts the whole history, cloned or not, as do the onboardings
+            # in progress
+            cloned = (
+                os.path.exists(get_local_repo(remote, REPOS_DIR))
+                and not args.reonboard
+                and OnboardingCheckpoint.phase(get_repo_name(remote)) != RECENT
+            )
+            repo = scheduler.get(remote)
+            lane = classify(
+                cloned, local_repo_size(remote) if cloned else 0, repo.seconds if repo else 0.0
+            )
             if args.verbose:
-                print(
-                    f"\n\n{i + 1} / {len(remotes)} segments.\n{j + 1} / {len(remotes[segment_id]['remotes'])} repos."
-                )
-            if not args.remote or (args.remote.rstrip(".git") == remote.rstrip(".git")):
-                if args.reonboard:
-                    logger.info("Reonboard mode enabled, deleting repo %s", remote)
-
-                    repo_path = get_local_repo(remote, REPOS_DIR)
-                    if os.path.exists(repo_path):
-                        shutil.rmtree(repo_path)
-                        logger.info("Deleted repo %s", remote)
-                    else:
-                        logger.info("Repo %s not found", remote)
-
-                    bad_commits_path = get_local_repo(remote, BAD_COMMITS_DIR)
-                    if os.path.exists(bad_commits_path):
-                        shutil.rmtree(bad_commits_path)
-                        logger.info("Deleted bad commits for repo %s", remote)
-                    else:
-                        logger.info("Bad commits for repo %s not found", remote)
+                print(f"\n\n{i + 1} / {len(segments)} repos, {remote} in the {lane} lane.")
+            lanes.submit(
+                lane,
+                remote,
+                ingest_remote_segments,
+                queue,
+                remote,
+                remote_segments,
+                verbose=args.verbose,
+                reonboard=args.reonboard,
+                reclone=args.reclone,
+                since=args.since,
+                until=args.until,
+                force=args.force,
+            )
+        for remote, result, seconds in lanes.join():
+            if isinstance(result, Exception):
+                logger.error("Failed trying to ingest %s: %s", remote, str(result))
+            elif result is not None and timed:
+                scheduler.record_timing(remote, seconds, size_bytes=result[2])
 
-                logger.info(f"Ingesting {remote} for segment {segment_id} ")
-                queue.ingest_remote(
-                    segment_id,
-                    integration_id,
+        # Then, every remote being up to date, backfill the older history of the
+        # onboardings
+        if not (args.since or args.until):
+            for remote, remote_segments in segments.items():
+                if OnboardingCheckpoint.phase(get_repo_name(remote)) != BACKFILL:
+                    continue
+                lanes.submit(
+                    HEAVY,
                     remote,
+                    ingest_remote_segments,
+                    queue,
+                    remote,
+                    remote_segments,
                     verbose=args.verbose,
-                    since=args.since,
-                    until=args.until,
+                    backfill=True,
                 )
+            for remote, result, seconds in lanes.join():
+                if isinstance(result, Exception):
+                    logger.error("Failed trying to backfill %s: %s", remote, str(result))
+    finally:
+        lanes.shutdown()
+
+    logger.info("Ingestion metrics:\n%s", metrics.summary())
+    close_producer()
 
 
 if __name__ == "__main__":
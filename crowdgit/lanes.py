@@ -0,0 +1,118 @@
+# -*- coding: utf-8 -*-
+"""Worker lanes for light and heavy repositories.
+
+Ingesting a repository we have not cloned yet, or a huge one, can take hours,
+and every small repository queued behind it would wait that long. Repositories
+are classified as
+
+    heavy   not cloned yet (the clone and extraction of the whole history), at
+            least HEAVY_REPO_BYTES of objects (default 1 GiB) on disk, or whose
+            last ingestion took at least HEAVY_REPO_SECONDS (default 600)
+    light   every other
+
+and each class has its own pool of worker threads, HEAVY_WORKERS (default 1)
+and LIGHT_WORKERS (default 4), so light repositories keep flowing while the
+heavy ones are being processed.
+"""
+import os
+import time
+import threading
+from concurrent.futures import ThreadPoolExecutor, Future, wait, FIRST_COMPLETED
+from typing import Any, Callable, Dict, Hashable, List, Optional, Tuple
+
+from crowdgit.logger import get_logger
+
+logger = get_logger(__name__)
+
+HEAVY = "heavy"
+LIGHT = "light"
+
+HEAVY_REPO_BYTES = int(os.environ.get("HEAVY_REPO_BYTES", 1 << 30))
+HEAVY_REPO_SECONDS = float(os.environ.get("HEAVY_REPO_SECONDS", 600))
+HEAVY_WORKERS = int(os.environ.get("HEAVY_WORKERS", 1))
+LIGHT_WORKERS = int(os.environ.get("LIGHT_WORKERS", 4))
+
+
+def classify(cloned: bool, size_bytes: int = 0, seconds: float = 0.0) -> str:
+    """
+    Lane of a repository, from whether it is cloned, the size of its objects and how
+    long its last ingestion took.
+
+    >>> classify(cloned=False), classify(cloned=True, size_bytes=10 << 20, seconds=12)
+    ('heavy', 'light')
+    >>> classify(cloned=True, size_bytes=10 << 20, seconds=3600)
+    'heavy'
+    """
+    if not cloned or size_bytes >= HEAVY_REPO_BYTES or seconds >= HEAVY_REPO_SECONDS:
+        return HEAVY
+    return LIGHT
+
+
+class Lanes:
+    """
+    One thread pool per lane. Jobs are submitted with a key, and collected, with the
+    key, their result and how long they took, once they are done.
+
+    >>> lanes = Lanes({HEAVY: 1, LIGHT: 2})
+    >>> lanes.submit(LIGHT, "a", lambda: 1)
+    >>> lanes.submit(LIGHT, "b", lambda: 2)
+    >>> lanes.has_capacity(LIGHT), lanes.has_capacity(HEAVY)
+    (False, True)
+    >>> sorted((key, result) for key, result, _ in lanes.join())
+    [('a', 1), ('b', 2)]
+    >>> lanes.shutdown()
+    """
+
+    def __init__(self, workers: Optional[Dict[str, int]] = None):
+        if workers is None:
+            workers = {HEAVY: HEAVY_WORKERS, LIGHT: LIGHT_WORKERS}
+        self.workers = workers
+        self.executors = {
+            lane: ThreadPoolExecutor(max(count, 1), thread_name_prefix=f"ingest-{lane}")
+            for lane, count in workers.items()
+        }
+        # future -> (lane, key, start time)
+        self.running: Dict[Future, Tuple[str, Hashable, float]] = {}
+        self.lock = threading.Lock()
+
+    def has_capacity(self, lane: str) -> bool:
+        with self.lock:
+            busy = sum(1 for running_lane, _, _ in self.running.values() if running_lane == lane)
+        return busy < max(self.workers[lane], 1)
+
+    def submit(self, lane: str, key: Hashable, func: Callable, *args, **kwargs):
+        future = self.executors[lane].submit(func, *args, **kwargs)
+        with self.lock:
+            self.running[future] = (lane, key, time.monotonic())
+
+    def pending(self) -> int:
+        with self.lock:
+            return len(self.running)
+
+    def collect(self, timeout: Optional[float] = None) -> List[Tuple[Hashable, Any, float]]:
+        """Wait up to `timeout` for a job to finish, and return (key, result, seconds) of
+        every finished job. A job that raised has its exception as result."""
+        with self.lock:
+            futures = list(self.running)
+        if not futures:
+            return []
+        done, _ = wait(futures, timeout=timeout, return_when=FIRST_COMPLETED)
+        finished = []
+        with self.lock:
+            for future in done:
+                _, key, start = self.running.pop(future)
+                error = future.exception()
+                result = future.result() if error is None else error
+                finished.append((key, result, time.monotonic() - start))
+        return finished
+
+    def join(self) -> List[Tuple[Hashable, Any, float]]:
+        """Wait for every job, and return them as collect does."""
+        finished = []
+        while self.pending():
+            finished.extend(self.collect())
+        return finished
+
+    def shutdown(self):
+        for executor in self.executors.values():
+            executor.shutdown(wait=True)
@@ -0,0 +1,313 @@
+# -*- coding: utf-8 -*-
+"""Leases on repositories, so that only one process ingests a repository at a time.
+
+A process takes the lease of a repository before working on it, and renews it
+from a heartbeat thread every LEASE_TTL_SECONDS / 3 while it does. A lease
+that is not renewed expires after LEASE_TTL_SECONDS (default 120), so the
+repositories of a process that crashed are free again within minutes, instead
+of being locked until someone removes a file.
+
+Leases live in the store of LEASE_STORE_URL:
+
+    sqlite:///path/to/leases.db   the default, LOCAL_DIR/leases.db: the processes
+                                  of one node
+    redis://host:port/db          shared by several nodes; needs the redis package
+                                  (pip install ".[cluster]")
+
+With several nodes, CLUSTER_NODES lists their NODE_IDs (default: the host
+name), and each node only ingests the remotes that a consistent hash ring
+over the list assigns to it. Adding or removing a node only moves the
+remotes of its share of the ring; the leases keep two nodes from working on
+the same repository while the lists of the nodes disagree.
+"""
+import os
+import json
+import time
+import uuid
+import bisect
+import socket
+import sqlite3
+import hashlib
+import threading
+from functools import lru_cache
+from typing import Dict, Iterable, Optional
+
+from crowdgit import LOCAL_DIR
+from crowdgit.errors import ConfigurationError, LeaseLostError
+
+from crowdgit.logger import get_logger
+
+logger = get_logger(__name__)
+
+DEFAULT_LEASE_STORE_URL = "sqlite:///" + os.path.abspath(os.path.join(LOCAL_DIR, "leases.db"))
+LEASE_STORE_URL = os.environ.get("LEASE_STORE_URL") or DEFAULT_LEASE_STORE_URL
+LEASE_TTL_SECONDS = float(os.environ.get("LEASE_TTL_SECONDS", 120))
+NODE_ID = os.environ.get("NODE_ID") or socket.gethostname()
+CLUSTER_NODES = [node.strip() for node in os.environ.get("CLUSTER_NODES", "").split(",") if node.strip()]
+RING_REPLICAS = 100
+
+
+class SQLiteLeaseStore:
+    """
+    Leases in a SQLite database, for the processes of one node.
+
+    >>> import tempfile
+    >>> with tempfile.TemporaryDirectory() as tmp_dir:
+    ...     store = SQLiteLeaseStore(os.path.join(tmp_dir, "leases.db"))
+    ...     store.acquire("repo", "a", ttl=60), store.acquire("repo", "b", ttl=60)
+    ...     store.release("repo", "a")
+    ...     store.acquire("repo", "b", ttl=60), store.get("repo")["owner"]
+    (True, False)
+    (True, 'b')
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        connection = self._connect()
+        try:
+            connection.execute(
+                "CREATE TABLE IF NOT EXISTS leases "
+                "(name TEXT PRIMARY KEY, owner TEXT, acquired_at REAL, expires_at REAL)"
+            )
+        finally:
+            connection.close()
+
+    def _connect(self) -> sqlite3.Connection:
+        # One connection per operation: leases are taken from several threads
+        return sqlite3.connect(self.path, timeout=30, isolation_level=None)
+
+    def acquire(self, name: str, owner: str, ttl: float) -> bool:
+        now = time.time()
+        connection = self._connect()
+        try:
+            connection.execute("BEGIN IMMEDIATE")
+            row = connection.execute(
+                "SELECT owner, acquired_at, expires_at FROM leases WHERE name = ?", (name,)
+            ).fetchone()
+            if row is not None and row[0] != owner and row[2] > now:
+                connection.execute("ROLLBACK")
+                return False
+            acquired_at = row[1] if row is not None and row[0] == owner else now
+            connection.execute(
+                "INSERT OR REPLACE INTO leases VALUES (?, ?, ?, ?)",
+                (name, owner, acquired_at, now + ttl),
+            )
+            connection.execute("COMMIT")
+            return True
+        finally:
+            connection.close()
+
+    def renew(self, name: str, owner: str, ttl: float) -> bool:
+        connection = self._connect()
+        try:
+            cursor = connection.execute(
+                "UPDATE leases SET expires_at = ? WHERE name = ? AND owner = ?",
+                (time.time() + ttl, name, owner),
+            )
+            return cursor.rowcount == 1
+        finally:
+            connection.close()
+
+    def release(self, name: str, owner: str):
+        connection = self._connect()
+        try:
+            connection.execute("DELETE FROM leases WHERE name = ? AND owner = ?", (name, owner))
+        finally:
+            connection.close()
+
+    def get(self, name: str) -> Optional[Dict]:
+        """The lease of `name`, as owner, acquired_at and expires_at, if it is held."""
+        connection = self._connect()
+        try:
+            row = connection.execute(
+                "SELECT owner, acquired_at, expires_at FROM leases WHERE name = ? AND expires_at > ?",
+                (name, time.time()),
+            ).fetchone()
+        finally:
+            connection.close()
+        if row is None:
+            return None
+        return {"owner": row[0], "acquired_at": row[1], "expires_at": row[2]}
+
+
+class RedisLeaseStore:
+    """Leases in Redis, shared by several nodes. Every change is a single command or
+    script, so it is atomic."""
+
+    PREFIX = "crowdgit:lease:"
+    # Extend the lease if we own it, KEYS[1] the lease, ARGV the owner and the TTL in ms
+    RENEW = """
+        local lease = redis.call('GET', KEYS[1])
+        if lease and cjson.decode(lease)['owner'] == ARGV[1] then
+            return redis.call('PEXPIRE', KEYS[1], ARGV[2])
+        end
+        return 0
+    """
+    RELEASE = """
+        local lease = redis.call('GET', KEYS[1])
+        if lease and cjson.decode(lease)['owner'] == ARGV[1] then
+            return redis.call('DEL', KEYS[1])
+        end
+        return 0
+    """
+
+    def __init__(self, url: str):
+        try:
+            import redis
+        except ImportError as e:
+            raise ConfigurationError(
+                f"LEASE_STORE_URL {url} needs the redis package: pip install '.[cluster]'"
+            ) from e
+        self.client = redis.Redis.from_url(url)
+        self.renew_script = self.client.register_script(self.RENEW)
+        self.release_script = self.client.register_script(self.RELEASE)
+
+    def acquire(self, name: str, owner: str, ttl: float) -> bool:
+        key = self.PREFIX + name
+        value = json.dumps({"owner": owner, "acquired_at": time.time()})
+        if self.client.set(key, value, nx=True, px=int(ttl * 1000)):
+            return True
+        return self.renew(name, owner, ttl)
+
+    def renew(self, name: str, owner: str, ttl: float) -> bool:
+        return bool(self.renew_script(keys=[self.PREFIX + name], args=[owner, int(ttl * 1000)]))
+
+    def release(self, name: str, owner: str):
+        self.release_script(keys=[self.PREFIX + name], args=[owner])
+
+    def get(self, name: str) -> Optional[Dict]:
+        key = self.PREFIX + name
+        with self.client.pipeline() as pipeline:
+            value, ttl_ms = pipeline.get(key).pttl(key).execute()
+        if value is None:
+            return None
+        return {**json.loads(value), "expires_at": time.time() + max(ttl_ms, 0) / 1000}
+
+
+def make_lease_store(url: str):
+    if url.startswith("sqlite:///"):
+        return SQLiteLeaseStore(url[len("sqlite:///"):])
+    if url.startswith(("redis://", "rediss://", "unix://")):
+        return RedisLeaseStore(url)
+    raise ConfigurationError(f"Unsupported LEASE_STORE_URL {url}, use sqlite:/// or redis://")
+
+
+_store = None
+_store_lock = threading.Lock()
+
+
+def get_lease_store():
+    """The process' lease store, created on first use."""
+    global _store
+    with _store_lock:
+        if _store is None:
+            _store = make_lease_store(LEASE_STORE_URL)
+        return _store
+
+
+class Lease:
+    """
+    Lease on `name`, kept alive by a heartbeat thread from acquire() to release().
+    If the heartbeat fails to renew it, the lease is lost, and check() raises, so that
+    the holder stops before someone else takes over.
+
+    >>> import tempfile
+    >>> with tempfile.TemporaryDirectory() as tmp_dir:
+    ...     store = SQLiteLeaseStore(os.path.join(tmp_dir, "leases.db"))
+    ...     lease, other = Lease("repo", store), Lease("repo", store)
+    ...     lease.acquire(), other.acquire()
+    ...     lease.release()
+    ...     other.acquire()
+    ...     other.release()
+    (True, False)
+    True
+    """
+
+    def __init__(self, name: str, store=None, ttl: float = LEASE_TTL_SECONDS):
+        self.name = name
+        self.store = store if store is not None else get_lease_store()
+        self.ttl = ttl
+        # Unique to this lease: the process may hold leases on several repositories
+        self.owner = f"{NODE_ID}:{os.getpid()}:{uuid.uuid4().hex[:8]}"
+        self.stopped = threading.Event()
+        self.lost = threading.Event()
+        self.thread = None
+
+    def acquire(self) -> bool:
+        if not self.store.acquire(self.name, self.owner, self.ttl):
+            return False
+        self.stopped.clear()
+        self.lost.clear()
+        self.thread = threading.Thread(
+            target=self._heartbeat, name=f"lease-{self.name}", daemon=True
+        )
+        self.thread.start()
+        return True
+
+    def _heartbeat(self):
+        while not self.stopped.wait(self.ttl / 3):
+            try:
+                if not self.store.renew(self.name, self.owner, self.ttl):
+                    logger.error("Lost the lease on %s", self.name)
+                    self.lost.set()
+                    return
+            except Exception as e:
+                logger.error("Failed renewing the lease on %s: %s", self.name, str(e))
+
+    def check(self):
+        """Raise LeaseLostError if the lease was lost."""
+        if self.lost.is_set():
+            raise LeaseLostError(self.name)
+
+    def release(self):
+        self.stopped.set()
+        if self.thread is not None:
+            self.thread.join()
+            self.thread = None
+        self.store.release(self.name, self.owner)
+
+    def holder(self) -> Optional[Dict]:
+        """The lease of whoever holds `name`, see SQLiteLeaseStore.get."""
+        return self.store.get(self.name)
+
+
+class HashRing:
+    """
+    Consistent hash ring of `nodes`, each on `replicas` points.
+
+    >>> ring = HashRing(["node-a", "node-b"])
+    >>> ring.owner("github.com-user-repo") in ("node-a", "node-b")
+    True
+    >>> HashRing(["node-a"]).owner("github.com-user-repo")
+    'node-a'
+    """
+
+    def __init__(self, nodes: Iterable[str], replicas: int = RING_REPLICAS):
+        self.points = sorted(
+            (self._hash(f"{node}#{replica}"), node)
+            for node in set(nodes)
+            for replica in range(replicas)
+        )
+        self.hashes = [point for point, _ in self.points]
+
+    @staticmethod
+    def _hash(key: str) -> int:
+        return int.from_bytes(hashlib.md5(key.encode("utf-8")).digest()[:8], "big")
+
+    def owner(self, key: str) -> str:
+        index = bisect.bisect(self.hashes, self._hash(key)) % len(self.points)
+        return self.points[index][1]
+
+
+def owned_by_this_node(key: str) -> bool:
+    """Whether this node ingests `key` (the name of a repository): always, unless
+    CLUSTER_NODES lists the nodes sharing the work."""
+    if not CLUSTER_NODES:
+        return True
+    return _ring(tuple(CLUSTER_NODES)).owner(key) == NODE_ID
+
+
+@lru_cache(maxsize=4)
+def _ring(nodes) -> HashRing:
+    return HashRing(nodes)
@@ -1,7 +1,10 @@
 import os
+import queue
+import atexit
 import logging
+import threading
 from datetime import datetime
-from logging.handlers import RotatingFileHandler
+from logging.handlers import RotatingFileHandler, QueueHandler, QueueListener
 
 from pythonjsonlogger import jsonlogger
 
@@ -10,13 +13,23 @@ from crowdgit import LOCAL_DIR
 SERVICE = "git-integration"
 LOG_LEVEL = "INFO"
 
+# queue: log calls only enqueue the record, a background thread formats and writes it
+# sync: log calls format and write the record themselves
+LOG_MODE = os.environ.get("LOG_MODE", "queue")
+LOG_MAX_BYTES = int(os.environ.get("LOG_MAX_BYTES", 10 * 1024 * 1024))
+LOG_BACKUP_COUNT = int(os.environ.get("LOG_BACKUP_COUNT", 10))
+# Comma separated module=N: of each message of the module's logger, only one record
+# in N is logged, e.g. "crowdgit.ingest=100,crowdgit.repo=10"
+LOG_SAMPLING = os.environ.get("LOG_SAMPLING", "")
+
 
 class CustomJsonFormatter(jsonlogger.JsonFormatter):
     def add_fields(self, log_record, record, message_dict):
         super(CustomJsonFormatter, self).add_fields(log_record, record, message_dict)
         log_record['name'] = SERVICE
         if not log_record.get('timestamp'):
-            now = datetime.utcnow().strftime('%Y-%m-%dT%H:%M:%S.%fZ')
+            # The time of the call, the record may be formatted later by the listener
+            now = datetime.utcfromtimestamp(record.created).strftime('%Y-%m-%dT%H:%M:%S.%fZ')
             log_record['timestamp'] = now
         if log_record.get('level'):
             log_record['level'] = log_record['level'].upper()
@@ -24,23 +37,155 @@ class CustomJsonFormatter(jsonlogger.JsonFormatter):
             log_record['level'] = record.levelname
 
 
+class SamplingFilter(logging.Filter):
+    """
+    Lets through one record in `every` of each message, counting apart the records of
+    each format string, so rare messages of a chatty logger are not dropped. The first
+    record of each message passes, and the records that pass carry `sampled`, the
+    number of records they stand for.
+
+    >>> sampling = SamplingFilter(3)
+    >>> record = logging.makeLogRecord({"msg": "Invalid hash %s", "args": ("x",)})
+    >>> [sampling.filter(record) for _ in range(7)]
+    [True, False, False, True, False, False, True]
+    >>> record.sampled
+    3
+    """
+
+    def __init__(self, every: int):
+        super().__init__()
+        self.every = every
+        self.counts = {}
+
+    def filter(self, record: logging.LogRecord) -> bool:
+        # Unlocked: concurrent log calls may only shift which record passes
+        count = self.counts.get(record.msg, 0)
+        self.counts[record.msg] = count + 1
+        if count % self.every:
+            return False
+        record.sampled = self.every
+        return True
+
+
+def sampling_rates(spec: str) -> dict:
+    """
+    >>> sampling_rates("crowdgit.ingest=100, crowdgit.repo=10")
+    {'crowdgit.ingest': 100, 'crowdgit.repo': 10}
+    """
+    rates = {}
+    for item in spec.split(","):
+        if item.strip():
+            name, every = item.split("=")
+            rates[name.strip()] = int(every)
+    return rates
+
+
+class _QueueHandler(QueueHandler):
+    def enqueue(self, record):
+        _start_listener()
+        super().enqueue(record)
+
+    def prepare(self, record):
+        # Only merge the arguments, which may change once we return, and render the
+        # traceback, which references the frames; the JSON is left to the listener
+        record = logging.makeLogRecord(record.__dict__)
+        record.msg = record.getMessage()
+        record.args = None
+        if record.exc_info:
+            record.exc_text = logging.Formatter().formatException(record.exc_info)
+            record.exc_info = None
+        return record
+
+
+class _FileRouter(logging.Handler):
+    """Writes each record to the rotating log file of its logger, opened, and its
+    directory created, with the first record."""
+
+    def __init__(self, formatter):
+        super().__init__()
+        self.setFormatter(formatter)
+        self.handlers = {}
+
+    def emit(self, record):
+        handler = self.handlers.get(record.name)
+        if handler is None:
+            name = record.name.split("/", 1)[-1]
+            handler = self.handlers[record.name] = _file_handler(name, self.formatter)
+        handler.handle(record)
+
+    def close(self):
+        for handler in self.handlers.values():
+            handler.close()
+        super().close()
+
+
+def _formatter():
+    return CustomJsonFormatter('%(timestamp)s %(level)s %(name)s %(message)s')
+
+
+def _file_handler(name, formatter):
+    log_file = os.path.join(LOCAL_DIR, 'logs', f'{name}.log')
+    os.makedirs(os.path.dirname(log_file), exist_ok=True)
+    file_handler = RotatingFileHandler(
+        log_file, maxBytes=LOG_MAX_BYTES, backupCount=LOG_BACKUP_COUNT
+    )
+    file_handler.setFormatter(formatter)
+    return file_handler
+
+
+_queue = queue.SimpleQueue()
+_listener = None
+_listener_lock = threading.Lock()
+
+
+def _start_listener():
+    """Start the background listener shared by every logger, with the first record."""
+    global _listener
+    if _listener is not None:
+        return
+    with _listener_lock:
+        if _listener is None:
+            formatter = _formatter()
+            stream_handler = logging.StreamHandler()
+            stream_handler.setFormatter(formatter)
+            _listener = QueueListener(_queue, stream_handler, _FileRouter(formatter))
+            _listener.start()
+
+
+def stop_listener():
+    """Write the records still queued and stop the background listener."""
+    global _listener
+    with _listener_lock:
+        if _listener is not None:
+            _listener.stop()
+            for handler in _listener.handlers:
+                handler.close()
+            _listener = None
+
+
+atexit.register(stop_listener)
+
+
 def get_logger(name):
     logger = logging.getLogger(f"{SERVICE}/{name}")
     logger.setLevel(LOG_LEVEL.upper())
 
     if not logger.handlers:
-        # Add a stream handler
-        stream_handler = logging.StreamHandler()
-        formatter = CustomJsonFormatter('%(timestamp)s %(level)s %(name)s %(message)s')
-        stream_handler.setFormatter(formatter)
-        logger.addHandler(stream_handler)
-
-        # Add a rotating file handler
-        log_file = os.path.join(LOCAL_DIR, 'logs', f'{name}.log')
-        os.makedirs(os.path.dirname(log_file), exist_ok=True)
-        file_handler = RotatingFileHandler(log_file, maxBytes=10000, backupCount=30)
-        file_handler.setFormatter(formatter)
-        logger.addHandler(file_handler)
+        if LOG_MODE == "queue":
+            logger.addHandler(_QueueHandler(_queue))
+        else:
+            # Add a stream handler
+            stream_handler = logging.StreamHandler()
+            formatter = _formatter()
+            stream_handler.setFormatter(formatter)
+            logger.addHandler(stream_handler)
+
+            # Add a rotating file handler
+            logger.addHandler(_FileRouter(formatter))
+
+        every = sampling_rates(LOG_SAMPLING).get(name)
+        if every and every > 1:
+            logger.addFilter(SamplingFilter(every))
 
         logger.propagate = False
 
@@ -1,3 +1,9 @@
+from crowdgit import load_env
+
+if __name__ == "__main__":
+    # Run as python -m: .env has to be loaded before the modules below read their settings
+    load_env()
+
 from urllib.parse import urlparse
 from crowdgit.cm_maintainers_data.scraper import scrape, check_for_updates
 from crowdgit.cm_maintainers_data.cm_database import query, execute
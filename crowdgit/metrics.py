@@ -0,0 +1,179 @@
+# -*- coding: utf-8 -*-
+"""Per-repository, per-stage ingestion metrics.
+
+The ingestion of a repository goes through the stages
+
+    clone       git clone of a repository we did not have
+    fetch       git fetch of the new commits
+    log         git log of the commits (time waiting for git)
+    parse       parsing the git log output into commits
+    numstat     git log --numstat, the insertions and deletions of each commit
+    prepare     turning commits into activities
+    serialize   turning activities into messages
+    produce     handing messages to Kafka and waiting for their delivery
+
+and for each (stage, repo) we keep how many times it ran and for how long,
+plus counters of commits, bad commits, activities, messages and bytes. The
+metrics live in the process: the server exposes them in the Prometheus text
+format on /metrics, and crowd-git-ingest logs a summary when it is done.
+"""
+import time
+import threading
+import contextlib
+from collections import defaultdict
+from typing import Dict, Iterator, Tuple
+
+STAGES = ("clone", "fetch", "log", "parse", "numstat", "prepare", "serialize", "produce")
+
+# Counter names, and their help in the exposition
+COUNTERS = {
+    "commits": "Commits extracted.",
+    "bad_commits": "Commits that could not be parsed.",
+    "activities": "Activities prepared.",
+    "messages": "Messages delivered to Kafka.",
+    "failed_messages": "Messages Kafka failed to deliver.",
+    "bytes": "Bytes of the messages produced.",
+}
+PREFIX = "crowdgit"
+
+
+class Metrics:
+    """
+    Stage timings and counters, labelled by repository.
+
+    >>> metrics = Metrics()
+    >>> metrics.observe("log", 1.5, repo="linux")
+    >>> metrics.inc("commits", 10, repo="linux")
+    >>> print(metrics.render())  # doctest: +ELLIPSIS
+    # HELP crowdgit_stage_seconds_total Seconds spent in each ingestion stage.
+    # TYPE crowdgit_stage_seconds_total counter
+    crowdgit_stage_seconds_total{stage="log",repo="linux"} 1.5
+    ...
+    crowdgit_commits_total{repo="linux"} 10
+    ...
+    """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        # (stage, repo) -> [runs, seconds, seconds of the last run]
+        self.stages: Dict[Tuple[str, str], list] = {}
+        # (counter, repo) -> value
+        self.counters: Dict[Tuple[str, str], float] = defaultdict(float)
+
+    def reset(self):
+        with self.lock:
+            self.stages.clear()
+            self.counters.clear()
+
+    def observe(self, stage: str, seconds: float, repo: str = "", runs: int = 1):
+        """Record `seconds` spent in `stage` for `repo`."""
+        with self.lock:
+            entry = self.stages.setdefault((stage, repo or ""), [0, 0.0, 0.0])
+            entry[0] += runs
+            entry[1] += seconds
+            entry[2] = seconds
+
+    def inc(self, counter: str, value: float = 1, repo: str = ""):
+        with self.lock:
+            self.counters[(counter, repo or "")] += value
+
+    @contextlib.contextmanager
+    def timer(self, stage: str, repo: str = "") -> Iterator[None]:
+        """Time the block as a run of `stage`, also if it raises."""
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(stage, time.perf_counter() - start, repo)
+
+    def render(self) -> str:
+        """The metrics in the Prometheus text exposition format."""
+        with self.lock:
+            stages = sorted(self.stages.items())
+            counters = sorted(self.counters.items())
+
+        lines = []
+
+        def family(name, kind, help_text, samples):
+            lines.append(f"# HELP {PREFIX}_{name} {help_text}")
+            lines.append(f"# TYPE {PREFIX}_{name} {kind}")
+            for labels, value in samples:
+                rendered = ",".join(f'{k}="{_escape(v)}"' for k, v in labels)
+                lines.append(f"{PREFIX}_{name}{{{rendered}}} {_number(value)}")
+
+        def stage_labels(stage, repo):
+            return (("stage", stage), ("repo", repo))
+
+        family(
+            "stage_seconds_total",
+            "counter",
+            "Seconds spent in each ingestion stage.",
+            [(stage_labels(*key), entry[1]) for key, entry in stages],
+        )
+        family(
+            "stage_runs_total",
+            "counter",
+            "Runs of each ingestion stage.",
+            [(stage_labels(*key), entry[0]) for key, entry in stages],
+        )
+        family(
+            "stage_last_seconds",
+            "gauge",
+            "Seconds of the last run of each ingestion stage.",
+            [(stage_labels(*key), entry[2]) for key, entry in stages],
+        )
+        for counter, help_text in COUNTERS.items():
+            family(
+                f"{counter}_total",
+                "counter",
+                help_text,
+                [((("repo", repo),), value) for (name, repo), value in counters if name == counter],
+            )
+        return "\n".join(lines) + "\n"
+
+    def summary(self, top: int = 20) -> str:
+        """Table of the time and counters of each stage, added over repositories,
+        followed by the `top` repositories that took the longest."""
+        from prettytable import PrettyTable
+
+        with self.lock:
+            stages = dict(self.stages)
+            counters = dict(self.counters)
+
+        by_stage = PrettyTable(["stage", "runs", "seconds"])
+        by_stage.align = "r"
+        for stage in STAGES:
+            entries = [entry for (s, _), entry in stages.items() if s == stage]
+            if entries:
+                by_stage.add_row(
+                    [stage, sum(e[0] for e in entries), round(sum(e[1] for e in entries), 2)]
+                )
+
+        repo_seconds = defaultdict(float)
+        for (_, repo), entry in stages.items():
+            repo_seconds[repo] += entry[1]
+        by_repo = PrettyTable(["repo", "seconds"] + list(COUNTERS))
+        by_repo.align = "r"
+        for repo, seconds in sorted(repo_seconds.items(), key=lambda item: -item[1])[:top]:
+            by_repo.add_row(
+                [repo, round(seconds, 2)]
+                + [int(counters.get((counter, repo), 0)) for counter in COUNTERS]
+            )
+        return f"{by_stage}\n{by_repo}"
+
+
+def _escape(value: str) -> str:
+    return value.replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _number(value: float) -> str:
+    return str(int(value)) if float(value).is_integer() else repr(float(value))
+
+
+METRICS = Metrics()
+
+observe = METRICS.observe
+inc = METRICS.inc
+timer = METRICS.timer
+render = METRICS.render
+summary = METRICS.summary
@@ -0,0 +1,251 @@
+# -*- coding: utf-8 -*-
+"""Durable local outbox between activity extraction and Kafka.
+
+Activities prepared for a repository are appended to an outbox on disk before
+they are produced. The outbox is a directory of append-only segment files, one
+JSON record per line, named after the offset of their first record:
+
+    OUTBOX_DIR/<repo name>/<segment id>/
+        meta.json                      integration id of the segment
+        00000000000000000000.jsonl     records 0..n-1
+        00000000000000000120.jsonl     records 120..
+        ack                            offset of the first record not yet delivered
+
+Records are removed, a whole segment at a time, once every record in the
+segment has been acknowledged by the broker. If the process dies, or Kafka is
+unreachable, the records that were not acknowledged are still in the outbox
+and are sent on the next run instead of being lost.
+"""
+import os
+import json
+import itertools
+import threading
+from typing import Dict, Iterable, Iterator, List
+
+from crowdgit import LOCAL_DIR
+from crowdgit.serialization import dumps
+
+from crowdgit.logger import get_logger
+
+logger = get_logger(__name__)
+
+DEFAULT_OUTBOX_DIR = os.path.join(LOCAL_DIR, "outbox")
+OUTBOX_DIR = os.environ.get("OUTBOX_DIR", DEFAULT_OUTBOX_DIR)
+OUTBOX_SEGMENT_BYTES = int(os.environ.get("OUTBOX_SEGMENT_BYTES", 64 * 1024 * 1024))
+
+SEGMENT_SUFFIX = ".jsonl"
+OFFSET_DIGITS = 20
+
+
+def _write_atomically(path: str, content: str):
+    tmp_path = path + ".tmp"
+    with open(tmp_path, "w", encoding="utf-8") as fout:
+        fout.write(content)
+        fout.flush()
+        os.fsync(fout.fileno())
+    os.replace(tmp_path, path)
+
+
+class Outbox:
+    """
+    Append-only outbox of activities for one repository and segment.
+
+    >>> import tempfile
+    >>> with tempfile.TemporaryDirectory() as outbox_dir:
+    ...     outbox = Outbox("repo", "segment", "integration", outbox_dir=outbox_dir)
+    ...     outbox.append([{"sourceId": "a"}, {"sourceId": "b"}])
+    ...     outbox.ack(1)
+    ...     [record["sourceId"] for record in outbox.read()], outbox.pending()
+    2
+    (['b'], 1)
+    """
+
+    def __init__(
+        self,
+        repo_name: str,
+        segment_id: str,
+        integration_id: str,
+        outbox_dir: str = OUTBOX_DIR,
+        segment_bytes: int = OUTBOX_SEGMENT_BYTES,
+    ):
+        self.path = os.path.join(outbox_dir, repo_name, segment_id)
+        self.repo_name = repo_name
+        self.segment_id = segment_id
+        self.integration_id = integration_id
+        self.segment_bytes = segment_bytes
+        self.lock = threading.Lock()
+
+        os.makedirs(self.path, exist_ok=True)
+        meta_path = os.path.join(self.path, "meta.json")
+        if not os.path.exists(meta_path):
+            _write_atomically(meta_path, json.dumps({"integrationId": integration_id}))
+
+        self.acked = self._read_ack()
+        self.next_offset = self._recover()
+
+    def _ack_path(self) -> str:
+        return os.path.join(self.path, "ack")
+
+    def _segment_path(self, base_offset: int) -> str:
+        return os.path.join(self.path, f"{base_offset:0{OFFSET_DIGITS}d}{SEGMENT_SUFFIX}")
+
+    def _segments(self) -> List[int]:
+        """Base offsets of the segments on disk, in order."""
+        return sorted(
+            int(name[: -len(SEGMENT_SUFFIX)])
+            for name in os.listdir(self.path)
+            if name.endswith(SEGMENT_SUFFIX)
+        )
+
+    def _read_ack(self) -> int:
+        if not os.path.exists(self._ack_path()):
+            return 0
+        with open(self._ack_path(), "r", encoding="utf-8") as fin:
+            return int(fin.read().strip() or 0)
+
+    def _recover(self) -> int:
+        """Find the offset of the next record to append. A record half written when the
+        process died (a last line without newline) is discarded."""
+        segments = self._segments()
+        if not segments:
+            return self.acked
+
+        last = segments[-1]
+        path = self._segment_path(last)
+        with open(path, "rb") as fin:
+            content = fin.read()
+
+        complete = content.rfind(b"\n") + 1
+        if complete < len(content):
+            logger.warning("Discarding incomplete record at the end of %s", path)
+            with open(path, "r+b") as fout:
+                fout.truncate(complete)
+
+        return last + content[:complete].count(b"\n")
+
+    def pending(self) -> int:
+        """Number of records not yet acknowledged."""
+        return self.next_offset - self.acked
+
+    def append(self, records: Iterable[Dict]) -> int:
+        """Durably append `records`. Returns the number of records appended."""
+        records = iter(records)
+        first = next(records, None)
+        if first is None:
+            return 0
+        records = itertools.chain([first], records)
+
+        segments = self._segments()
+        base = segments[-1] if segments else self.next_offset
+        path = self._segment_path(base)
+        size = os.path.getsize(path) if os.path.exists(path) else 0
+
+        appended = 0
+        fout = open(path, "ab")
+        try:
+            for record in records:
+                if size >= self.segment_bytes:
+                    fout.flush()
+                    os.fsync(fout.fileno())
+                    fout.close()
+                    path = self._segment_path(self.next_offset)
+                    fout = open(path, "ab")
+                    size = 0
+
+                line = dumps(record) + b"\n"
+                fout.write(line)
+                size += len(line)
+                self.next_offset += 1
+                appended += 1
+
+            fout.flush()
+            os.fsync(fout.fileno())
+        finally:
+            fout.close()
+
+        logger.info("Appended %d records to outbox %s", appended, self.path)
+        return appended
+
+    def read(self) -> Iterator[Dict]:
+        """Iterate over the records not yet acknowledged, in order."""
+        offset = self.acked
+        segments = self._segments()
+        for i, base in enumerate(segments):
+            end = segments[i + 1] if i + 1 < len(segments) else self.next_offset
+            if end <= offset:
+                continue
+            try:
+                fin = open(self._segment_path(base), "rb")
+            except FileNotFoundError:
+                # Deleted by a concurrent ack: all its records were delivered
+                continue
+            with fin:
+                for position, line in enumerate(fin):
+                    if base + position < offset:
+                        continue
+                    if base + position >= self.next_offset:
+                        break
+                    yield json.loads(line)
+                    offset = base + position + 1
+
+    def ack(self, offset: int):
+        """Mark every record before `offset` as delivered and remove the segments that
+        only contain delivered records."""
+        with self.lock:
+            if offset <= self.acked:
+                return
+            self.acked = min(offset, self.next_offset)
+            _write_atomically(self._ack_path(), str(self.acked))
+
+            segments = self._segments()
+            for i, base in enumerate(segments):
+                end = segments[i + 1] if i + 1 < len(segments) else self.next_offset
+                if end <= self.acked:
+                    os.remove(self._segment_path(base))
+
+
+class OutboxTracker:
+    """
+    Turns out-of-order delivery reports into the outbox offset up to which every
+    record has been delivered, and acknowledges it in the outbox every
+    `ack_every` records.
+
+    >>> class FakeOutbox:
+    ...     acked = 10
+    ...     def ack(self, offset):
+    ...         self.acked = offset
+    >>> tracker = OutboxTracker(FakeOutbox(), ack_every=1)
+    >>> tracker(1, True); tracker.outbox.acked
+    10
+    >>> tracker(0, True); tracker.outbox.acked
+    12
+    """
+
+    def __init__(self, outbox: Outbox, ack_every: int = 1000):
+        self.outbox = outbox
+        self.start = outbox.acked
+        self.ack_every = ack_every
+        self.delivered_upto = self.start
+        self.delivered = set()
+        self.failed = False
+        self.lock = threading.Lock()
+
+    def __call__(self, index: int, delivered: bool):
+        """Delivery report for the index-th record read from the outbox."""
+        with self.lock:
+            if not delivered:
+                self.failed = True
+                return
+            self.delivered.add(self.start + index)
+            advanced = self.delivered_upto
+            while advanced in self.delivered:
+                self.delivered.remove(advanced)
+                advanced += 1
+            self.delivered_upto = advanced
+
+        if self.delivered_upto - self.outbox.acked >= self.ack_every:
+            self.outbox.ack(self.delivered_upto)
+
+    def commit(self):
+        """Acknowledge in the outbox everything delivered so far."""
+        self.outbox.ack(self.delivered_upto)
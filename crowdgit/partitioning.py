@@ -0,0 +1,107 @@
+# -*- coding: utf-8 -*-
+"""Kafka message keys of the activities we produce.
+
+Kafka assigns a message to a partition by hashing its key. The key is chosen
+with the KAFKA_PARTITION_KEY environment variable:
+
+    random  a new uuid1 per message, spreading activities evenly over every
+            partition (default)
+    member  the member identity of the activity, so all the activities of a
+            member land on the same partition and the consumer can batch and
+            cache its member upserts
+    repo    the repository, so a repository's activities stay in order
+
+With random keys every message has its own key, as it always had. With member
+and repo keys many messages share a key, so the key no longer identifies a
+message: the topic must not be compacted (cleanup.policy=compact would keep only
+the last activity of each member or repository), and consumers must not drop
+messages as duplicates by key; the sourceId of the activity identifies it.
+
+With KAFKA_GROUP_BY_KEY=true, send_messages also emits the activities sharing a
+key contiguously (in the order each key is first seen), so they end up in the
+same producer batches and consumer polls.
+"""
+from typing import Dict, Iterable, List, Tuple
+from uuid import uuid1 as uuid
+
+from crowdgit.errors import ConfigurationError
+
+RANDOM = "random"
+MEMBER = "member"
+REPO = "repo"
+PARTITION_KEY_STRATEGIES = (RANDOM, MEMBER, REPO)
+
+
+def check_strategy(strategy: str) -> str:
+    """
+    Validate a partition key strategy.
+
+    >>> check_strategy("member")
+    'member'
+    >>> check_strategy("author")
+    Traceback (most recent call last):
+    ...
+    crowdgit.errors.ConfigurationError: Unknown partition key strategy 'author', use one of random, member, repo
+    """
+    if strategy not in PARTITION_KEY_STRATEGIES:
+        raise ConfigurationError(
+            f"Unknown partition key strategy {strategy!r}, "
+            f"use one of {', '.join(PARTITION_KEY_STRATEGIES)}"
+        )
+    return strategy
+
+
+def member_key(record: Dict) -> str | None:
+    """
+    The identity of the member of an activity: its username identity, or else its
+    display name.
+
+    >>> member_key({"member": {"displayName": "Arnd", "identities": [
+    ...     {"value": "arnd@arndb.de", "type": "email"},
+    ...     {"value": "Arnd@arndb.de", "type": "username"}]}})
+    'arnd@arndb.de'
+    >>> member_key({"member": {"displayName": "Arnd"}})
+    'Arnd'
+    >>> member_key({}) is None
+    True
+    """
+    member = record.get("member") or {}
+    for identity in member.get("identities") or ():
+        if identity.get("type") == "username" and identity.get("value"):
+            return identity["value"].lower()
+    return member.get("displayName") or None
+
+
+def partition_key(record: Dict, strategy: str, repo: str | None = None) -> str:
+    """
+    Key of the message of `record`. Falls back to a random key when the record has
+    no member or repository.
+
+    >>> partition_key({"member": {"displayName": "Arnd"}}, MEMBER)
+    'Arnd'
+    >>> partition_key({"channel": "https://github.com/a/b"}, REPO, repo="b")
+    'b'
+    >>> len(partition_key({}, MEMBER))
+    36
+    """
+    key = None
+    if strategy == MEMBER:
+        key = member_key(record)
+    elif strategy == REPO:
+        key = repo or record.get("channel")
+    return key or str(uuid())
+
+
+def group_by_key(keyed: Iterable[Tuple[str, int, Dict]]) -> List[Tuple[str, int, Dict]]:
+    """
+    Reorder (key, index, record) tuples so tuples sharing a key are contiguous. Keys
+    keep the order they are first seen in, and tuples keep their order within a key.
+
+    >>> [index for _, index, _ in group_by_key(
+    ...     [("a", 0, {}), ("b", 1, {}), ("a", 2, {}), ("c", 3, {}), ("b", 4, {})])]
+    [0, 2, 1, 4, 3]
+    """
+    groups = {}
+    for item in keyed:
+        groups.setdefault(item[0], []).append(item)
+    return [item for group in groups.values() for item in group]
@@ -0,0 +1,111 @@
+# -*- coding: utf-8 -*-
+"""Process-wide Kafka producer.
+
+Every Queue in the process (the cron ingestion, each reonboard of the server,
+the bad commits script) shares one confluent_kafka.Producer, so broker
+connections are set up once per process. A background thread polls the
+producer so that delivery reports are served even when nobody is producing,
+and the producer is flushed when the process exits.
+"""
+import os
+import json
+import atexit
+import threading
+from typing import Dict
+
+from crowdgit.logger import get_logger
+
+logger = get_logger(__name__)
+
+# Producer defaults tuned for throughput: let librdkafka accumulate messages into
+# batches instead of waiting for a broker round-trip per message. Anything set in
+# KAFKA_CONFIG takes precedence.
+KAFKA_BATCH_CONFIG = {
+    "linger.ms": 100,
+    "batch.num.messages": 10000,
+    "queue.buffering.max.messages": 100000,
+}
+KAFKA_FLUSH_TIMEOUT_SECONDS = float(os.environ.get("KAFKA_FLUSH_TIMEOUT_SECONDS", 300))
+# How often the background thread serves delivery reports; 0 disables the thread.
+KAFKA_POLL_INTERVAL_SECONDS = float(os.environ.get("KAFKA_POLL_INTERVAL_SECONDS", 0.5))
+
+# confluent_kafka.Producer, imported with the first producer: most runs of the command
+# line tools never produce
+Producer = None
+
+
+def kafka_config() -> Dict:
+    """Producer configuration from the KAFKA_BROKERS and KAFKA_CONFIG (a JSON object)
+    environment variables."""
+    return {
+        "bootstrap.servers": os.environ["KAFKA_BROKERS"],
+        "client.id": "git-integration",
+        **KAFKA_BATCH_CONFIG,
+        **json.loads(os.environ.get("KAFKA_CONFIG") or "{}"),
+    }
+
+
+class ProducerManager:
+    """Owns the producer and the thread polling it."""
+
+    def __init__(self, config: Dict, poll_interval: float = KAFKA_POLL_INTERVAL_SECONDS):
+        self.producer = (Producer or _kafka_producer_class())(config)
+        self.poll_interval = poll_interval
+        self.stopped = threading.Event()
+        self.thread = None
+
+        if poll_interval:
+            self.thread = threading.Thread(
+                target=self._poll_loop, name="kafka-poll", daemon=True
+            )
+            self.thread.start()
+
+    def _poll_loop(self):
+        while not self.stopped.is_set():
+            try:
+                self.producer.poll(self.poll_interval)
+            except Exception as e:
+                logger.error("Failed polling the Kafka producer: %s", str(e))
+
+    def close(self, timeout: float = KAFKA_FLUSH_TIMEOUT_SECONDS) -> int:
+        """Stop polling and flush. Returns the number of messages still undelivered."""
+        self.stopped.set()
+        if self.thread is not None:
+            self.thread.join()
+        pending = self.producer.flush(timeout)
+        if pending:
+            logger.error("%d messages were not delivered before shutting down", pending)
+        return pending
+
+
+def _kafka_producer_class():
+    global Producer
+    from confluent_kafka import Producer as KafkaProducer
+
+    Producer = KafkaProducer
+    return Producer
+
+
+_manager = None
+_manager_lock = threading.Lock()
+
+
+def get_producer_manager() -> ProducerManager:
+    """The process' ProducerManager, created on first use."""
+    global _manager
+    with _manager_lock:
+        if _manager is None:
+            _manager = ProducerManager(kafka_config(), KAFKA_POLL_INTERVAL_SECONDS)
+        return _manager
+
+
+def close_producer():
+    """Flush and close the process' producer, if it was created."""
+    global _manager
+    with _manager_lock:
+        manager, _manager = _manager, None
+    if manager is not None:
+        manager.close()
+
+
+atexit.register(close_producer)
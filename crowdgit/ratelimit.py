@@ -0,0 +1,147 @@
+# -*- coding: utf-8 -*-
+"""Rate limiting of the messages we produce.
+
+Traffic is split in two lanes: "incremental" (new commits of repositories we
+already track) and "onboarding" (first clone, reonboards and --since/--until
+backfills). Each lane has a token bucket for the whole tenant and one per
+repository, so that a huge onboarding cannot flood the topic and delay the
+incremental updates of every other repository downstream.
+
+Rates are in messages per second, configured with the environment variables
+
+    PRODUCE_RATE_INCREMENTAL         tenant-wide, incremental lane (default: unlimited)
+    PRODUCE_RATE_ONBOARDING          tenant-wide, onboarding lane (default: unlimited)
+    PRODUCE_RATE_REPO_INCREMENTAL    per repository, incremental lane (default: unlimited)
+    PRODUCE_RATE_REPO_ONBOARDING     per repository, onboarding lane (default: unlimited)
+
+A rate of 0 means unlimited. Buckets hold PRODUCE_BURST_SECONDS (default 1)
+seconds worth of tokens.
+"""
+import os
+import time
+import threading
+from typing import Dict
+
+INCREMENTAL = "incremental"
+ONBOARDING = "onboarding"
+LANES = (INCREMENTAL, ONBOARDING)
+
+DEFAULT_RATES = {
+    "PRODUCE_RATE_INCREMENTAL": 0,
+    "PRODUCE_RATE_ONBOARDING": 0,
+    "PRODUCE_RATE_REPO_INCREMENTAL": 0,
+    "PRODUCE_RATE_REPO_ONBOARDING": 0,
+}
+
+
+class TokenBucket:
+    """
+    Token bucket refilled at `rate` tokens per second, holding up to `burst` tokens.
+
+    reserve() always takes the tokens, and returns how long the caller has to wait
+    before using them, so concurrent callers are served in order.
+
+    >>> now = [0.0]
+    >>> bucket = TokenBucket(rate=10, burst=2, clock=lambda: now[0])
+    >>> bucket.reserve(), bucket.reserve(), bucket.reserve()
+    (0.0, 0.0, 0.1)
+    >>> now[0] = 1.0
+    >>> bucket.reserve()
+    0.0
+    """
+
+    def __init__(self, rate: float, burst: float, clock=time.monotonic):
+        self.rate = rate
+        self.burst = max(burst, 1)
+        self.clock = clock
+        self.tokens = self.burst
+        self.updated = clock()
+        self.lock = threading.Lock()
+
+    def reserve(self, tokens: float = 1) -> float:
+        with self.lock:
+            now = self.clock()
+            self.tokens = min(self.burst, self.tokens + (now - self.updated) * self.rate)
+            self.updated = now
+            self.tokens -= tokens
+            if self.tokens >= 0:
+                return 0.0
+            return round(-self.tokens / self.rate, 6)
+
+
+class RateLimiter:
+    """
+    Tenant and repository token buckets for each lane.
+
+    >>> limiter = RateLimiter({ONBOARDING: 1}, {}, burst_seconds=1)
+    >>> limiter.reserve(ONBOARDING, "repo"), limiter.reserve(ONBOARDING, "repo") > 0
+    (0.0, True)
+    >>> limiter.reserve(INCREMENTAL, "repo")
+    0.0
+    """
+
+    def __init__(
+        self,
+        tenant_rates: Dict[str, float],
+        repo_rates: Dict[str, float],
+        burst_seconds: float = 1,
+    ):
+        self.repo_rates = repo_rates
+        self.burst_seconds = burst_seconds
+        self.tenant_buckets = {
+            lane: TokenBucket(rate, rate * burst_seconds)
+            for lane, rate in tenant_rates.items()
+            if rate
+        }
+        self.repo_buckets = {}
+        self.lock = threading.Lock()
+
+    @classmethod
+    def from_env(cls) -> "RateLimiter":
+        def rate(name):
+            return float(os.environ.get(name, DEFAULT_RATES[name]))
+
+        return cls(
+            {
+                INCREMENTAL: rate("PRODUCE_RATE_INCREMENTAL"),
+                ONBOARDING: rate("PRODUCE_RATE_ONBOARDING"),
+            },
+            {
+                INCREMENTAL: rate("PRODUCE_RATE_REPO_INCREMENTAL"),
+                ONBOARDING: rate("PRODUCE_RATE_REPO_ONBOARDING"),
+            },
+            burst_seconds=float(os.environ.get("PRODUCE_BURST_SECONDS", 1)),
+        )
+
+    def _repo_bucket(self, lane: str, repo: str) -> TokenBucket | None:
+        rate = self.repo_rates.get(lane)
+        if not rate or not repo:
+            return None
+        with self.lock:
+            bucket = self.repo_buckets.get((lane, repo))
+            if bucket is None:
+                bucket = TokenBucket(rate, rate * self.burst_seconds)
+                self.repo_buckets[(lane, repo)] = bucket
+            return bucket
+
+    def reserve(self, lane: str, repo: str | None = None, tokens: float = 1) -> float:
+        """Take `tokens` from the lane's buckets. Returns the seconds to wait before
+        producing."""
+        wait = 0.0
+        for bucket in (self.tenant_buckets.get(lane), self._repo_bucket(lane, repo)):
+            if bucket is not None:
+                wait = max(wait, bucket.reserve(tokens))
+        return wait
+
+
+_limiter = None
+_limiter_lock = threading.Lock()
+
+
+def get_rate_limiter() -> RateLimiter:
+    """The process' RateLimiter, configured from the environment on first use."""
+    global _limiter
+    with _limiter_lock:
+        if _limiter is None:
+            _limiter = RateLimiter.from_env()
+        return _limiter
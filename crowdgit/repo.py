@@ -1,16 +1,22 @@
 # -*- coding: utf-8 -*-
 
+from crowdgit import load_env
+
+if __name__ == "__main__":
+    # Run as python -m: .env has to be loaded before the modules below read their settings
+    load_env()
+
 import os
 import subprocess
 import time
 import re
-from typing import List, Optional, Dict, Literal
+import threading
+from typing import Iterator, List, Optional, Dict, Literal
 import datetime
 
-import tqdm
-
 from crowdgit import LOCAL_DIR
 import crowdgit.errors as E
+from crowdgit import metrics
 
 from crowdgit.logger import get_logger
 
@@ -22,6 +28,20 @@ REPOS_DIR = os.environ.get("REPOS_DIR", DEFAULT_REPOS_DIR)
 DEFAULT_BAD_COMMITS_DIR = os.path.join(LOCAL_DIR, "bad-commits")
 BAD_COMMITS_DIR = os.environ.get("BAD_COMMITS_DIR", DEFAULT_BAD_COMMITS_DIR)
 
+# How Signed-off-by:-like lines are found: "regex" matches every line of the commit
+# message in Python, "git" has git log parse the trailer block of each message. They
+# differ on the trailer-like lines outside the final block, like those of the commits
+# listed in a squashed merge, which only "regex" counts (see test_trailers).
+TRAILER_EXTRACTION = os.environ.get("TRAILER_EXTRACTION", "regex")
+# Separates the trailers of a commit in the git log output. It is not a line
+# boundary for str.splitlines, so the trailers of a commit are a single line.
+TRAILER_SEPARATOR = "\x1f"
+
+
+def _repo_label(repo_path: str) -> str:
+    # Local clones are named after get_repo_name of their remote
+    return os.path.basename(os.path.abspath(repo_path))
+
 
 def get_repo_name(remote: str) -> str:
     """Get the domain and path segments from the remote URL and join them with '-'.
@@ -91,6 +111,25 @@ def get_local_repo(remote: str, repos_dir: str) -> str:
     return os.path.join(repos_dir, get_repo_name(remote))
 
 
+def get_repo_size(repo_path: str) -> int:
+    """Get the size of the objects of a local repository, loose and packed.
+
+    :param repo_path: The path to the local repository.
+    :return: The size in bytes, as reported by git count-objects.
+
+    >>> get_repo_size(".") > 0
+    True
+    """
+    output = subprocess.run(
+        ["git", "-C", repo_path, "count-objects", "-v"],
+        check=True,
+        capture_output=True,
+        text=True,
+    ).stdout
+    fields = dict(line.split(": ", 1) for line in output.splitlines() if ": " in line)
+    return (int(fields.get("size", 0)) + int(fields.get("size-pack", 0))) * 1024
+
+
 def is_valid_commit_hash(commit_hash: str) -> bool:
     """Check if the given commit hash is valid.
 
@@ -142,13 +181,14 @@ def clone_repo(remote: str, repos_dir: str) -> None | Literal[1]:
 
         logger.info("Cloning %s to %s", remote, repo_path)
         start_time = time.time()
-        result = subprocess.run(
-            ["git", "clone", remote, repo_path],
-            check=False,
-            stdout=subprocess.PIPE,
-            stderr=subprocess.PIPE,
-            input=b"\n",  # Simulate pressing Enter to bypass username prompt
-        )
+        with metrics.timer("clone", _repo_label(repo_path)):
+            result = subprocess.run(
+                ["git", "clone", remote, repo_path],
+                check=False,
+                stdout=subprocess.PIPE,
+                stderr=subprocess.PIPE,
+                input=b"\n",  # Simulate pressing Enter to bypass username prompt
+            )
         end_time = time.time()
 
         if result.returncode != 0:
@@ -183,36 +223,118 @@ def store_bad_commits(commit_lines: str, repo_path: str):
             fout.write("\n-------------\n")
 
 
-def get_commits(
+COMMIT_SPLITTER = "--CROWD-END-OF-COMMIT--"
+
+
+def _revisions_args(commit_range: str, revisions: Optional[List[str]]) -> List[str]:
+    # Given commits are read from the standard input, there may be too many for the
+    # command line; --no-walk=unsorted outputs them alone, in the given order
+    if revisions is not None:
+        return ["--no-walk=unsorted", "--stdin"]
+    return [commit_range]
+
+
+def _write_revisions(stdin, revisions: List[str]):
+    try:
+        for revision in revisions:
+            stdin.write(f"{revision}\n".encode())
+        stdin.close()
+    except BrokenPipeError:
+        pass
+
+
+def _selection(new_only: bool, revisions: Optional[List[str]]) -> str:
+    if revisions is not None:
+        return "window"
+    return "new only" if new_only else "all"
+
+
+def _parse_commit(commit_text: str, repo_path: str, trailers: bool) -> Optional[Dict]:
+    """Parse the git log output of a commit, or store it as a bad commit and return None."""
+    commit_lines = commit_text.strip().splitlines()
+
+    if len(commit_lines) < 8:
+        store_bad_commits(commit_text, repo_path)
+        return None
+
+    commit_hash = commit_lines[0]
+    author_datetime = commit_lines[1]
+    author_name = commit_lines[2]
+    author_email = commit_lines[3]
+
+    # Check for empty author email
+    if author_email is None or author_email.strip() == "":
+        store_bad_commits(commit_text, repo_path)
+        return None
+
+    commit_datetime = commit_lines[4]
+    commit_datetime_obj = datetime.datetime.strptime(commit_datetime, "%Y-%m-%dT%H:%M:%S%z")
+    if commit_datetime_obj > datetime.datetime.now(datetime.timezone.utc) + datetime.timedelta(
+        days=1
+    ):
+        commit_datetime = author_datetime
+    committer_name = commit_lines[5]
+    committer_email = commit_lines[6]
+    parent_hashes = commit_lines[7].split()
+
+    message_start = 9
+    if trailers:
+        trailer_line = commit_lines[9] if len(commit_lines) >= 10 else ""
+        commit_trailers = [t for t in trailer_line.split(TRAILER_SEPARATOR) if t.strip()]
+        message_start = 10
+
+    if len(commit_lines) > message_start:
+        commit_message = commit_lines[message_start:]
+    else:
+        commit_message = ""
+
+    if not (is_valid_commit_hash(commit_hash) and is_valid_datetime(commit_datetime)):
+        logger.error(
+            "Invalid commit data found: hash=%s, datetime=%s",
+            commit_hash,
+            commit_datetime,
+        )
+        store_bad_commits(commit_text, repo_path)
+        return None
+
+    is_merge_commit = len(parent_hashes) > 1
+    is_main_branch = True
+
+    commit = {
+        "hash": commit_hash,
+        "author_datetime": author_datetime,
+        "author_name": author_name,
+        "author_email": author_email,
+        "committer_datetime": commit_datetime,
+        "committer_name": committer_name,
+        "committer_email": committer_email,
+        "is_main_branch": is_main_branch,
+        "is_merge_commit": is_merge_commit,
+        "message": commit_message,
+    }
+    if trailers:
+        commit["trailers"] = commit_trailers
+    return commit
+
+
+def iter_commits(
     repo_path: str,
     default_branch: str,
     new_only: bool = False,
     since: Optional[str] = None,
     until: Optional[str] = None,
-    verbose: bool = False,
-) -> List[Dict]:
-    """Get the commits of the repository.
-
-    :param repo_path: The local path to the repository.
-    :param default_branch: The default branch name.
-    :param new_only: If True, get only the new commits.
-    :param since: The starting date to fetch commits (optional).
-    :param until: The end date to fetch commits (optional).
-    :return: A list of dictionaries containing commit information.
-    :return: A list of dictionaries containing commit information. Each dictionary contains the
-             following keys:
-                - 'hash': The commit hash (str).
-                - 'datetime': The commit date and time in ISO 8601 format (str).
-                - 'author_name': The author's name (str).
-                - 'author_email': The author's email (str).
-                - 'committer_name': The committer's name (str).
-                - 'committer_email': The committer's email (str).
-                - 'is_main_branch': A boolean indicating if the commit is on the main branch.
-                - 'is_merge_commit': A boolean indicating if the commit is a merge commit.
-                - 'message': The commit message as a list of strings, where each string is a line
-                             of the message.
+    trailers: Optional[bool] = None,
+    revisions: Optional[List[str]] = None,
+) -> Iterator[Dict]:
+    """Iterate over the commits of the repository as git log outputs them, holding
+    only one commit in memory. Takes the arguments of get_commits, and yields the
+    same dictionaries.
+
+    :raise subprocess.CalledProcessError: If git log fails.
     """
-    logger.info("Extracting commits from %s", repo_path)
+    if trailers is None:
+        trailers = TRAILER_EXTRACTION == "git"
+
     if new_only:
         commit_range = f"..origin/{default_branch}"
     else:
@@ -224,15 +346,16 @@ def get_commits(
     elif not new_only and default_branch == "*":
         commit_range = f"HEAD"
 
-    splitter = "--CROWD-END-OF-COMMIT--"
-
+    # With trailers, the parsed trailers of the message go in a line of their own
+    # before it. Needs git >= 2.22 for the separator option.
+    trailers_format = "%(trailers:only,unfold,separator=%x1f)%n" if trailers else ""
     git_log_command = [
         "git",
         "-C",
         repo_path,
         "log",
-        commit_range,
-        f"--pretty=format:%H%n%aI%n%an%n%ae%n%cI%n%cn%n%ce%n%P%n%d%n%B%n{splitter}",
+        *_revisions_args(commit_range, revisions),
+        f"--pretty=format:%H%n%aI%n%an%n%ae%n%cI%n%cn%n%ce%n%P%n%d%n{trailers_format}%B%n{COMMIT_SPLITTER}",
     ]
 
     if since:
@@ -244,116 +367,115 @@ def get_commits(
     subprocess.check_output(["git", "-C", repo_path, "config", "core.abbrevCommit", "false"])
 
     start_time = time.time()
-    try:
-        commits_output = (
-            subprocess.check_output(git_log_command).decode("utf-8", errors="replace").strip()
-        )
-    except Exception as e:
-        logger.error(
-            "Failed trying to extract commits for %s with %s: \n%s",
-            repo_path,
-            " ".join(git_log_command),
-            str(e),
-        )
-        return []
-
-    end_time = time.time()
-
-    if not commits_output:
-        logger.info("Did not find any commit output in %s", repo_path)
-        return []
-
+    count = 0
     bad_commits = 0
-    commits = []
-
-    commits_texts = commits_output.split(splitter)
-    if verbose:
-        commits_iter = tqdm.tqdm(commits_texts, desc="Parsing commits")
-    else:
-        commits_iter = commits_texts
-
-    for commit_text in commits_iter:
-        commit_lines = commit_text.strip().splitlines()
-
-        if len(commit_lines) < 8:
-            bad_commits += 1
-            store_bad_commits(commit_text, repo_path)
-            continue
-
-        if (len(commit_lines)) < 9:
-            from pprint import pprint as pp
-
-            pp(commit_lines)
-
-        commit_hash = commit_lines[0]
-        author_datetime = commit_lines[1]
-        author_name = commit_lines[2]
-        author_email = commit_lines[3]
-        
-        # Check for empty author email
-        if author_email is None or author_email.strip() == "":
-            bad_commits += 1
-            store_bad_commits(commit_text, repo_path)
-            continue
-        
-        commit_datetime = commit_lines[4]
-        commit_datetime_obj = datetime.datetime.strptime(commit_datetime, "%Y-%m-%dT%H:%M:%S%z")
-        if commit_datetime_obj > datetime.datetime.now(datetime.timezone.utc) + datetime.timedelta(
-            days=1
-        ):
-            commit_datetime = author_datetime
-        committer_name = commit_lines[5]
-        committer_email = commit_lines[6]
-        parent_hashes = commit_lines[7].split()
-        if len(commit_lines) >= 9:
-            ref_names = commit_lines[8].strip()
-        else:
-            ref_names = ""
-
-        if len(commit_lines) >= 10:
-            commit_message = commit_lines[9:]
-        else:
-            commit_message = ""
-
-        if not (is_valid_commit_hash(commit_hash) and is_valid_datetime(commit_datetime)):
-            logger.error(
-                "Invalid commit data found: hash=%s, datetime=%s",
-                commit_hash,
-                commit_datetime,
-            )
+    # Time parsing, and yielded to the caller, to tell apart the time waiting for git
+    parse_seconds = 0.0
+    consumer_seconds = 0.0
+    with subprocess.Popen(
+        git_log_command,
+        stdout=subprocess.PIPE,
+        stdin=subprocess.PIPE if revisions is not None else None,
+    ) as process:
+        if revisions is not None:
+            # From a thread: git may fill the output pipe before reading them all
+            threading.Thread(
+                target=_write_revisions, args=(process.stdin, revisions), daemon=True
+            ).start()
+        lines = []
+        # Split on \n only: messages may have other line boundaries, which
+        # _parse_commit deals with
+        for raw_line in process.stdout:
+            line = raw_line.decode("utf-8", errors="replace")
+            if line.rstrip("\r\n") != COMMIT_SPLITTER:
+                lines.append(line)
+                continue
+            parse_start = time.perf_counter()
+            commit = _parse_commit("".join(lines), repo_path, trailers)
+            parse_seconds += time.perf_counter() - parse_start
+            lines = []
+            if commit is None:
+                bad_commits += 1
+                continue
+            count += 1
+            yielded = time.perf_counter()
+            yield commit
+            consumer_seconds += time.perf_counter() - yielded
+
+        if "".join(lines).strip():
             bad_commits += 1
-            store_bad_commits(commit_text, repo_path)
-            continue
+            store_bad_commits("".join(lines), repo_path)
 
-        is_merge_commit = len(parent_hashes) > 1
-        is_main_branch = True
-
-        commits.append(
-            {
-                "hash": commit_hash,
-                "author_datetime": author_datetime,
-                "author_name": author_name,
-                "author_email": author_email,
-                "committer_datetime": commit_datetime,
-                "committer_name": committer_name,
-                "committer_email": committer_email,
-                "is_main_branch": is_main_branch,
-                "is_merge_commit": is_merge_commit,
-                "message": commit_message,
-            }
-        )
+    if process.returncode:
+        raise subprocess.CalledProcessError(process.returncode, git_log_command)
 
+    end_time = time.time()
+    repo_name = _repo_label(repo_path)
+    metrics.observe("log", end_time - start_time - parse_seconds - consumer_seconds, repo_name)
+    metrics.observe("parse", parse_seconds, repo_name)
+    metrics.inc("commits", count, repo_name)
+    metrics.inc("bad_commits", bad_commits, repo_name)
     logger.info(
         "%d commits (%s) extracted from %s in %d s (%1.f min), %d bad commits",
-        len(commits),
-        "new only" if new_only else "all",
+        count,
+        _selection(new_only, revisions),
         repo_path,
         int(end_time - start_time),
         (end_time - start_time) / 60,
         bad_commits,
     )
 
-    return commits
+
+def get_commits(
+    repo_path: str,
+    default_branch: str,
+    new_only: bool = False,
+    since: Optional[str] = None,
+    until: Optional[str] = None,
+    verbose: bool = False,
+    trailers: Optional[bool] = None,
+    revisions: Optional[List[str]] = None,
+) -> List[Dict]:
+    """Get the commits of the repository.
+
+    :param repo_path: The local path to the repository.
+    :param default_branch: The default branch name.
+    :param new_only: If True, get only the new commits.
+    :param since: The starting date to fetch commits (optional).
+    :param until: The end date to fetch commits (optional).
+    :param trailers: If True, git parses the trailers of each message, and they are
+                     returned in 'trailers'. Defaults to TRAILER_EXTRACTION == "git".
+    :param revisions: If given, get only these commits, by hash, instead of those of
+                      the default branch.
+    :return: A list of dictionaries containing commit information. Each dictionary contains the
+             following keys:
+                - 'hash': The commit hash (str).
+                - 'datetime': The commit date and time in ISO 8601 format (str).
+                - 'author_name': The author's name (str).
+                - 'author_email': The author's email (str).
+                - 'committer_name': The committer's name (str).
+                - 'committer_email': The committer's email (str).
+                - 'is_main_branch': A boolean indicating if the commit is on the main branch.
+                - 'is_merge_commit': A boolean indicating if the commit is a merge commit.
+                - 'message': The commit message as a list of strings, where each string is a line
+                             of the message.
+                - 'trailers': Only with trailers, the "Key: value" trailers of the message
+                              (list of str), folded lines unfolded.
+    """
+    logger.info("Extracting commits from %s", repo_path)
+    commits_iter = iter_commits(
+        repo_path, default_branch, new_only, since, until, trailers, revisions
+    )
+    if verbose:
+        import tqdm
+
+        commits_iter = tqdm.tqdm(commits_iter, desc="Parsing commits")
+
+    try:
+        return list(commits_iter)
+    except Exception as e:
+        logger.error("Failed trying to extract commits for %s: \n%s", repo_path, str(e))
+        return []
 
 
 def get_insertions_deletions(
@@ -363,6 +485,7 @@ def get_insertions_deletions(
     since: Optional[str] = None,
     until: Optional[str] = None,
     verbose: bool = False,
+    revisions: Optional[List[str]] = None,
 ) -> Dict[str, Dict]:
     """Get the insertions and deletions for each commit in the repository.
 
@@ -371,10 +494,27 @@ def get_insertions_deletions(
     :param new_only: If True, get insertions and deletions only for new commits.
     :param since: The starting date to fetch commits (optional).
     :param until: The end date to fetch commits (optional).
+    :param revisions: If given, only for these commits, by hash (optional).
     :return: A dictionary with commit hash as key and a dictionary with keys
              insertions/deletions as value.
     """
     logger.info("Extracting insertions/deletions from %s", repo_path)
+    with metrics.timer("numstat", _repo_label(repo_path)):
+        return _get_insertions_deletions(
+            repo_path, default_branch, new_only, since, until, verbose, revisions
+        )
+
+
+def _get_insertions_deletions(
+    repo_path: str,
+    default_branch: str,
+    new_only: bool,
+    since: Optional[str],
+    until: Optional[str],
+    verbose: bool,
+    revisions: Optional[List[str]] = None,
+    strict: bool = False,
+) -> Dict[str, Dict]:
     if new_only:
         commit_range = f"..origin/{default_branch}"
     else:
@@ -391,7 +531,7 @@ def get_insertions_deletions(
         "-C",
         repo_path,
         "log",
-        commit_range,
+        *_revisions_args(commit_range, revisions),
         "--pretty=format:%H",
         "--cc",
         "--numstat",
@@ -408,9 +548,16 @@ def get_insertions_deletions(
     start_time = time.time()
     try:
         commits_output = (
-            subprocess.check_output(git_log_command).decode("utf-8", errors="replace").strip()
+            subprocess.check_output(
+                git_log_command,
+                input="\n".join(revisions).encode() if revisions is not None else None,
+            )
+            .decode("utf-8", errors="replace")
+            .strip()
         )
     except:
+        if strict:
+            raise
         return {}
 
     end_time = time.time()
@@ -423,6 +570,8 @@ def get_insertions_deletions(
 
     commits_texts = commits_output.split("\n\n")
     if verbose:
+        import tqdm
+
         commits_iter = tqdm.tqdm(commits_texts, desc="Extracting insertions/deletions")
     else:
         commits_iter = commits_texts
@@ -459,7 +608,7 @@ def get_insertions_deletions(
     logger.info(
         "Changes for %d commits (%s) extracted from %s in %d s (%.1f min), %d bad commits",
         len(changes),
-        "new only" if new_only else "all",
+        _selection(new_only, revisions),
         repo_path,
         int(end_time - start_time),
         (end_time - start_time) / 60,
@@ -469,11 +618,101 @@ def get_insertions_deletions(
     return changes
 
 
+def merge_new_commits(remote: str, repos_dir: str = REPOS_DIR, revision: Optional[str] = None):
+    """Merge the fetched commits of the default branch into the local repository, so that
+    they are not considered new anymore.
+
+    :param remote: The remote repository URL.
+    :param repos_dir: The local directory where repositories are stored (default: REPOS_DIR).
+    :param revision: Merge only up to this commit of the default branch (optional).
+    """
+    repo_path = get_local_repo(remote, repos_dir)
+    default_branch = get_default_branch(repo_path)
+    # Detached: the commits are those of HEAD, there is no branch to move forward
+    if default_branch == "*":
+        return
+    subprocess.run(
+        ["git", "-C", repo_path, "merge", revision or f"origin/{default_branch}"],
+        check=True,
+        stdout=subprocess.DEVNULL,
+        stderr=subprocess.DEVNULL,
+    )
+
+
+def fetch_repo(remote: str, repos_dir: str = REPOS_DIR):
+    """Fetch the remote changes of the local repository, without merging them."""
+    repo_path = get_local_repo(remote, repos_dir)
+    logger.info("Fetching %s", repo_path)
+    with metrics.timer("fetch", _repo_label(repo_path)):
+        subprocess.run(
+            ["git", "-C", repo_path, "fetch"],
+            check=True,
+            stdout=subprocess.DEVNULL,
+            stderr=subprocess.DEVNULL,
+        )
+
+
+def get_tip(repo_path: str, default_branch: str) -> str:
+    """The hash of the last commit of the default branch, as fetched."""
+    revision = "HEAD" if default_branch == "*" else f"origin/{default_branch}"
+    return subprocess.check_output(
+        ["git", "-C", repo_path, "rev-parse", revision], text=True
+    ).strip()
+
+
+def list_commits(repo_path: str, tip: str) -> List[str]:
+    """The hashes of the history of `tip`, in the order git log outputs them, newest
+    first. The same `tip` always gives the same list."""
+    output = subprocess.check_output(["git", "-C", repo_path, "rev-list", tip], text=True)
+    return output.split()
+
+
+def count_commits(repo_path: str, tip: str, since: Optional[str] = None) -> int:
+    """The number of commits in the history of `tip`, committed after `since` if given."""
+    command = ["git", "-C", repo_path, "rev-list", "--count", tip]
+    if since:
+        command.append(f"--since={since}")
+    return int(subprocess.check_output(command, text=True).strip())
+
+
+def get_commits_window(repo_path: str, hashes: List[str], verbose: bool = False) -> List[Dict]:
+    """The commits of `hashes`, as get_new_commits returns them, with their insertions
+    and deletions.
+
+    Unlike get_commits, it raises subprocess.CalledProcessError if git fails: the
+    window must not be taken as done when its commits could not be read.
+    """
+    if not hashes:
+        return []
+    # The default branch is not used: the commits are given
+    commits_iter = iter_commits(repo_path, "*", revisions=hashes)
+    if verbose:
+        import tqdm
+
+        commits_iter = tqdm.tqdm(commits_iter, desc="Parsing commits")
+    commits = list(commits_iter)
+    with metrics.timer("numstat", _repo_label(repo_path)):
+        insertions_deletions = _get_insertions_deletions(
+            repo_path, "*", False, None, None, verbose, hashes, strict=True
+        )
+    return [
+        commit | insertions_deletions.get(commit["hash"], {"insertions": 0, "deletions": 0})
+        for commit in commits
+    ]
+
+
 # :prompt:get-new-commits
-def get_new_commits(remote: str, repos_dir: str = REPOS_DIR, verbose: bool = False) -> List[Dict]:
+def get_new_commits(
+    remote: str,
+    repos_dir: str = REPOS_DIR,
+    verbose: bool = False,
+    merge: bool = True,
+) -> List[Dict]:
     """Get new commits from the remote repository.
     :param remote: The remote repository URL.
     :param repos_dir: The local directory where repositories are stored (default: REPOS_DIR).
+    :param merge: If False the new commits are not merged into the local repository, and
+                  will be returned again until merge_new_commits is called.
     :return: A list of dictionaries with commit data and insertion/deletion information.
              Each dictionary contains the following keys:
                 - 'hash': The commit hash (str).
@@ -514,14 +753,7 @@ def get_new_commits(remote: str, repos_dir: str = REPOS_DIR, verbose: bool = Fal
         )
         return new_commits
 
-    logger.info("Fetching %s", repo_path)
-    # Fetch the remote changes without merging
-    subprocess.run(
-        ["git", "-C", repo_path, "fetch"],
-        check=True,
-        stdout=subprocess.DEVNULL,
-        stderr=subprocess.DEVNULL,
-    )
+    fetch_repo(remote, repos_dir)
 
     default_branch = get_default_branch(repo_path)
     new_commits = get_commits(repo_path, default_branch, new_only=True, verbose=verbose)
@@ -529,15 +761,10 @@ def get_new_commits(remote: str, repos_dir: str = REPOS_DIR, verbose: bool = Fal
         repo_path, default_branch, new_only=True, verbose=verbose
     )
 
-    if new_commits:
-        subprocess.run(
-            ["git", "-C", repo_path, "merge", f"origin/{default_branch}"],
-            check=True,
-            stdout=subprocess.DEVNULL,
-            stderr=subprocess.DEVNULL,
-        )
-    else:
+    if not new_commits:
         logger.info("No new commits")
+    elif merge:
+        merge_new_commits(remote, repos_dir)
 
     return _add_insertions_deletions(new_commits, insertions_deletions)
 
@@ -574,7 +801,7 @@ def get_commits_since_until(
 
 def main():
     import argparse
-    import json
+    from crowdgit.streaming import write_records, write_mapping
 
     parser = argparse.ArgumentParser(description="Get commit data from Git repositories.")
     subparsers = parser.add_subparsers(dest="command")
@@ -607,12 +834,20 @@ def main():
         ),
     )
 
-    parser.add_argument("--output", required=True, help="Output JSON file to store the results.")
+    parser.add_argument(
+        "--output",
+        required=True,
+        help=(
+            "Output file to store the results: JSONL if it ends in .jsonl, "
+            'a JSON array otherwise. "-" writes JSONL to the standard output.'
+        ),
+    )
 
     args = parser.parse_args()
 
     if args.command == "get-commits":
-        result = get_commits(
+        # Streamed: commits are written as git log outputs them
+        result = iter_commits(
             args.repo_path,
             get_default_branch(args.repo_path),
             args.new_only,
@@ -632,10 +867,13 @@ def main():
     else:
         parser.error("Invalid command")
 
-    with open(args.output, "w", encoding="utf-8") as output_file:
-        json.dump(result, output_file, indent=2)
+    if isinstance(result, dict):
+        count = write_mapping(result.items(), args.output, "hash", "changes")
+    else:
+        count = write_records(result, args.output)
 
-    print(f"Results saved to {args.output}")
+    if args.output != "-":
+        print(f"{count} results saved to {args.output}")
 
 
 if __name__ == "__main__":
@@ -0,0 +1,226 @@
+# -*- coding: utf-8 -*-
+"""Adaptive polling schedule of the repositories, for the ingestion daemon.
+
+Each remote has its own polling interval, derived from the rate at which it
+gets new commits (an exponentially weighted average over its polls):
+
+    - a poll that finds commits sets the interval to the expected time until
+      SCHEDULE_TARGET_COMMITS more commits land,
+    - a poll that finds none, or fails, multiplies the interval by
+      SCHEDULE_BACKOFF, so dormant and broken repositories are polled less
+      and less often,
+
+always within [SCHEDULE_MIN_INTERVAL_SECONDS, SCHEDULE_MAX_INTERVAL_SECONDS].
+Remotes are served in order of their due time, so the most overdue comes
+first, and remotes we never polled are due right away. The schedule is saved
+to SCHEDULE_PATH after every poll, so a restart picks it up where it was.
+"""
+import os
+import json
+import heapq
+import time
+from dataclasses import dataclass, asdict
+from typing import Callable, Dict, Iterable, List, Optional
+
+from crowdgit import LOCAL_DIR
+
+from crowdgit.logger import get_logger
+
+logger = get_logger(__name__)
+
+DEFAULT_SCHEDULE_PATH = os.path.join(LOCAL_DIR, "schedule.json")
+SCHEDULE_PATH = os.environ.get("SCHEDULE_PATH", DEFAULT_SCHEDULE_PATH)
+SCHEDULE_MIN_INTERVAL_SECONDS = float(os.environ.get("SCHEDULE_MIN_INTERVAL_SECONDS", 300))
+SCHEDULE_MAX_INTERVAL_SECONDS = float(os.environ.get("SCHEDULE_MAX_INTERVAL_SECONDS", 86400))
+SCHEDULE_TARGET_COMMITS = float(os.environ.get("SCHEDULE_TARGET_COMMITS", 1))
+SCHEDULE_BACKOFF = float(os.environ.get("SCHEDULE_BACKOFF", 2))
+# Weight of the last poll in the average commit rate
+RATE_SMOOTHING = 0.3
+
+
+@dataclass
+class RepoSchedule:
+    remote: str
+    next_poll: float = 0.0
+    interval: float = SCHEDULE_MIN_INTERVAL_SECONDS
+    last_poll: Optional[float] = None
+    # Average commits per second
+    rate: float = 0.0
+    failures: int = 0
+    # Duration of the last poll, and size of the objects of the clone after it, to
+    # pick its worker lane
+    seconds: float = 0.0
+    size_bytes: int = 0
+
+
+class Scheduler:
+    """
+    Priority queue of remotes by due time, with per-remote adaptive intervals.
+
+    >>> scheduler = Scheduler(path=None, min_interval=60, max_interval=3600)
+    >>> scheduler.sync(["https://github.com/a/busy", "https://github.com/a/idle"], now=0)
+    >>> scheduler.pop_due(now=0), scheduler.pop_due(now=0), scheduler.pop_due(now=0)
+    ('https://github.com/a/busy', 'https://github.com/a/idle', None)
+    >>> scheduler.record("https://github.com/a/busy", commits=0, ok=True, now=0)
+    >>> scheduler.record("https://github.com/a/idle", commits=0, ok=True, now=0)
+    >>> scheduler.record("https://github.com/a/busy", commits=30, ok=True, now=120)
+    >>> scheduler.record("https://github.com/a/idle", commits=0, ok=True, now=120)
+    >>> scheduler.get("https://github.com/a/busy").interval
+    60.0
+    >>> scheduler.get("https://github.com/a/idle").interval
+    120.0
+    """
+
+    def __init__(
+        self,
+        path: Optional[str] = SCHEDULE_PATH,
+        min_interval: float = SCHEDULE_MIN_INTERVAL_SECONDS,
+        max_interval: float = SCHEDULE_MAX_INTERVAL_SECONDS,
+        target_commits: float = SCHEDULE_TARGET_COMMITS,
+        backoff: float = SCHEDULE_BACKOFF,
+    ):
+        self.path = path
+        self.min_interval = min_interval
+        self.max_interval = max_interval
+        self.target_commits = target_commits
+        self.backoff = backoff
+        self.repos: Dict[str, RepoSchedule] = {}
+        # (next_poll, remote); entries whose time no longer matches the remote's are stale
+        self.heap: List = []
+
+        if path and os.path.exists(path):
+            with open(path, "r", encoding="utf-8") as fin:
+                for state in json.load(fin):
+                    self._push(RepoSchedule(**state))
+
+    def _push(self, repo: RepoSchedule):
+        self.repos[repo.remote] = repo
+        heapq.heappush(self.heap, (repo.next_poll, repo.remote))
+
+    def get(self, remote: str) -> Optional[RepoSchedule]:
+        return self.repos.get(remote)
+
+    def sync(self, remotes: Iterable[str], now: float = None):
+        """Schedule the remotes we did not know of, due `now`, and forget the ones
+        no longer in `remotes`."""
+        now = time.time() if now is None else now
+        remotes = set(remotes)
+        for remote in sorted(remotes - self.repos.keys()):
+            self._push(RepoSchedule(remote, next_poll=now, interval=self.min_interval))
+        for remote in self.repos.keys() - remotes:
+            del self.repos[remote]
+
+    def next_due(self) -> Optional[float]:
+        """Due time of the next remote to poll, None if there are none."""
+        while self.heap:
+            next_poll, remote = self.heap[0]
+            repo = self.repos.get(remote)
+            if repo is not None and repo.next_poll == next_poll:
+                return next_poll
+            heapq.heappop(self.heap)
+        return None
+
+    def pop_due(self, now: float = None, accept: Callable[[str], bool] = None) -> Optional[str]:
+        """The most overdue remote, if any is due, among those `accept` accepts. It is
+        not scheduled again until its poll is recorded."""
+        now = time.time() if now is None else now
+        skipped = []
+        remote = None
+        while True:
+            next_poll = self.next_due()
+            if next_poll is None or next_poll > now:
+                break
+            entry = heapq.heappop(self.heap)
+            if accept is None or accept(entry[1]):
+                remote = entry[1]
+                break
+            skipped.append(entry)
+        for entry in skipped:
+            heapq.heappush(self.heap, entry)
+        return remote
+
+    def postpone(self, remote: str, now: float = None):
+        """Schedule the next poll of `remote` one interval from `now`, as it is, for a
+        poll that did not happen: another process was ingesting the remote."""
+        now = time.time() if now is None else now
+        repo = self.repos.get(remote)
+        if repo is None:
+            return
+        repo.next_poll = now + repo.interval
+        heapq.heappush(self.heap, (repo.next_poll, remote))
+        logger.info("Next poll of %s in %d s (skipped, ingested elsewhere)", remote, repo.interval)
+        self.save()
+
+    def record_timing(self, remote: str, seconds: float, size_bytes: int = None):
+        """Record how long an ingestion of `remote` outside of the schedule took, and the
+        size of its clone, for its worker lane, without moving its next poll."""
+        repo = self.repos.get(remote)
+        if repo is None:
+            repo = RepoSchedule(remote, interval=self.min_interval)
+            self._push(repo)
+        repo.seconds = seconds
+        if size_bytes is not None:
+            repo.size_bytes = size_bytes
+        self.save()
+
+    def record(
+        self,
+        remote: str,
+        commits: int,
+        ok: bool,
+        now: float = None,
+        seconds: float = None,
+        size_bytes: int = None,
+    ):
+        """Schedule the next poll of `remote` from the result of the one that just ended:
+        whether it succeeded and how many new commits it found."""
+        now = time.time() if now is None else now
+        repo = self.repos.get(remote)
+        if repo is None:
+            return
+        if seconds is not None:
+            repo.seconds = seconds
+        if size_bytes is not None:
+            repo.size_bytes = size_bytes
+
+        if not ok:
+            repo.failures += 1
+            interval = repo.interval * self.backoff
+        else:
+            repo.failures = 0
+            first_poll = repo.last_poll is None
+            # The first poll clones the whole history, which says nothing of the rate
+            if not first_poll and now > repo.last_poll:
+                observed = commits / (now - repo.last_poll)
+                repo.rate = RATE_SMOOTHING * observed + (1 - RATE_SMOOTHING) * repo.rate
+            repo.last_poll = now
+            if first_poll:
+                interval = self.min_interval
+            elif commits and repo.rate:
+                interval = self.target_commits / repo.rate
+            elif commits:
+                interval = self.min_interval
+            else:
+                interval = repo.interval * self.backoff
+
+        repo.interval = float(min(max(interval, self.min_interval), self.max_interval))
+        repo.next_poll = now + repo.interval
+        heapq.heappush(self.heap, (repo.next_poll, remote))
+        logger.info(
+            "Next poll of %s in %d s (%d commits, %.2f commits/hour%s)",
+            remote,
+            repo.interval,
+            commits,
+            repo.rate * 3600,
+            "" if ok else f", {repo.failures} failures",
+        )
+        self.save()
+
+    def save(self):
+        if not self.path:
+            return
+        os.makedirs(os.path.dirname(self.path) or ".", exist_ok=True)
+        tmp_path = self.path + ".tmp"
+        with open(tmp_path, "w", encoding="utf-8") as fout:
+            json.dump([asdict(repo) for repo in self.repos.values()], fout)
+        os.replace(tmp_path, self.path)
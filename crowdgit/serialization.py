@@ -0,0 +1,134 @@
+# -*- coding: utf-8 -*-
+"""Serialization of activities into the messages we produce.
+
+Every message is the same envelope around a different activity, so the envelope
+is rendered once per (tenant, segment, integration) and only the activity is
+serialized per message. If orjson is installed it is used as encoder, unless
+CROWD_JSON_ENCODER is set to "json".
+"""
+import os
+import json
+from typing import Dict
+
+try:
+    import orjson
+except ImportError:  # pragma: no cover
+    orjson = None
+
+from crowdgit.logger import get_logger
+
+logger = get_logger(__name__)
+
+SQS_MAX_MESSAGE_SIZE_IN_BYTES = 262144
+
+JSON_ENCODER = os.environ.get("CROWD_JSON_ENCODER", "orjson" if orjson else "json")
+
+
+def string_converter(o):
+    """
+    Function that converts object to string
+    This will be used when converting to Json, to convert non serializable attributes
+    """
+    return str(o)
+
+
+def dumps(obj) -> bytes:
+    """Serialize `obj` to compact UTF-8 JSON bytes.
+
+    >>> dumps({"a": [1, "ñ"]}).decode("utf-8")
+    '{"a":[1,"ñ"]}'
+    """
+    if JSON_ENCODER == "orjson" and orjson:
+        return orjson.dumps(obj, default=string_converter)
+    return json.dumps(
+        obj, default=string_converter, ensure_ascii=False, separators=(",", ":")
+    ).encode("utf-8")
+
+
+def truncate_to_bytes(s: str, max_bytes: int, encoding="utf-8"):
+    """
+    Truncate the string `s` so that its byte size is strictly less than `max_bytes`.
+
+    The string is encoded once and cut at the byte limit; a multi-byte character
+    split by the cut is dropped.
+
+    Parameters:
+    s (str): The string to truncate.
+    max_bytes (int): The maximum allowed size in bytes.
+    encoding (str): The encoding to use for the byte representation.
+
+    Returns:
+    str: The truncated string.
+
+    >>> truncate_to_bytes("abcdef", 4)
+    'abc'
+    >>> truncate_to_bytes("añb", 3)
+    'a'
+    >>> truncate_to_bytes("abc", 10)
+    'abc'
+    """
+    encoded_string = s.encode(encoding)
+
+    if len(encoded_string) < max_bytes:
+        return s
+
+    return encoded_string[: max(max_bytes - 1, 0)].decode(encoding, errors="ignore")
+
+
+class Envelope:
+    """
+    Pre-rendered message envelope for one tenant, segment and integration.
+
+    >>> envelope = Envelope("t", "s", "i", max_bytes=200)
+    >>> json.loads(envelope.serialize({"body": "hi"}))["activityData"]
+    {'body': 'hi'}
+    >>> len(envelope.serialize({"body": "x" * 500})) <= 200
+    True
+    """
+
+    def __init__(
+        self,
+        tenant_id: str,
+        segment_id: str,
+        integration_id: str,
+        max_bytes: int = SQS_MAX_MESSAGE_SIZE_IN_BYTES,
+    ):
+        head = dumps(
+            {
+                "type": "create_and_process_activity_result",
+                "tenantId": tenant_id,
+                "segmentId": segment_id,
+                "integrationId": integration_id,
+                "activityData": None,
+            }
+        )
+        # The placeholder is the last key, so the envelope splits around it
+        self.prefix = head[: -len(b"null}")]
+        self.suffix = b"}"
+        self.max_bytes = max_bytes
+
+    def serialize(self, record: Dict) -> bytes:
+        """Serialize `record` inside the envelope. If the message would be bigger than
+        max_bytes the record's body is truncated (in place) until it fits."""
+        data = dumps(record)
+        size = len(self.prefix) + len(data) + len(self.suffix)
+
+        if size > self.max_bytes and isinstance(record.get("body"), str):
+            logger.warning(
+                "The activity body is too big (%d bytes). Truncating the body.",
+                size,
+            )
+            body_bytes = len(record["body"].encode("utf-8"))
+            while size > self.max_bytes and body_bytes > 0:
+                # Escaping makes the serialized body bigger than the raw one, so the
+                # raw body is shrunk in proportion to the excess
+                escaped_bytes = max(len(dumps(record["body"])) - 2, 1)
+                excess = size - self.max_bytes
+                body_bytes = max(body_bytes * (escaped_bytes - excess) // escaped_bytes, 0)
+                record["body"] = truncate_to_bytes(record["body"], body_bytes + 1)
+                data = dumps(record)
+                size = len(self.prefix) + len(data) + len(self.suffix)
+
+            logger.info("Truncated body size: %d bytes", size)
+
+        return self.prefix + data + self.suffix
@@ -2,26 +2,35 @@ from fastapi import FastAPI
 from fastapi import Depends, HTTPException, status
 from fastapi.security import HTTPBearer, HTTPAuthorizationCredentials
 from fastapi.background import BackgroundTasks
+from fastapi.responses import PlainTextResponse
 import os
+from crowdgit import load_env
+
+# Before the modules below read their settings. The server runs from crowdgit/
+load_env(os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir, ".env"))
+
 from crowdgit import LOCAL_DIR
 import asyncio
-from dotenv import load_dotenv
 from crowdgit.repo import get_repo_name
 import logging
 import secrets
-from crowdgit.ingest import Queue
-from crowdgit.get_remotes import get_remotes
-import shutil
+from crowdgit.ingest import Queue, acquire_lease, delete_bad_commits, delete_local_repo
+from crowdgit.leases import get_lease_store
+from crowdgit.producer import close_producer
+from crowdgit import metrics
+from crowdgit.get_remotes import RemoteIndex, get_remotes
+from datetime import datetime
 from threading import Semaphore
 
-load_dotenv()
-
 app = FastAPI()
 auth_scheme = HTTPBearer()
 
+
+@app.on_event("shutdown")
+def shutdown():
+    close_producer()
+
 DEFAULT_REPOS_DIR = os.path.join("..", "..", LOCAL_DIR, "repos")
-BAD_COMMITS_DIR = os.path.join("..", "..", LOCAL_DIR, "bad_commits")
-RUNNING_DIR = os.path.join("..", "..", LOCAL_DIR, "running")
 REPOS_DIR = os.environ.get("REPOS_DIR", DEFAULT_REPOS_DIR)
 
 
@@ -31,47 +40,59 @@ def get_local_repo(remote: str, repos_dir: str) -> str:
     return os.path.join(repos_dir, get_repo_name(remote))
 
 
-def reonboard_repo(remote: str, since: str = None, until: str = None):
-    """Reonboard a repository by deleting and re-ingesting it.
+def reonboard_repo(
+    remote: str, since: str = None, until: str = None, force: bool = False, reclone: bool = False
+):
+    """Reonboard a repository by fetching it and re-ingesting its whole history, or the
+    commits between since and until.
 
     :param remote: The remote URL of the repository to reonboard
+    :param force: Send all activities, also the ones that were already sent
+    :param reclone: Delete the local repository and clone it again, for a corrupted clone
     """
     with semaphore:
         queue = Queue()
-        repo_path = get_local_repo(remote, REPOS_DIR)
-
-        remotes = get_remotes(
-            os.environ["CROWD_HOST"],
-            os.environ["CROWD_API_KEY"],
-        )
 
-        # Find matching remote in tenant's remotes
-        for segment_id in remotes:
-            integration_id = remotes[segment_id]["integrationId"]
-            for tenant_remote in remotes[segment_id]["remotes"]:
-                if remote.rstrip(".git") == tenant_remote.rstrip(".git"):
-                    repo_path = get_local_repo(remote, REPOS_DIR)
-                    if os.path.exists(repo_path):
-                        shutil.rmtree(repo_path)
-                        logging.info("Deleted repo %s", remote)
-                    else:
-                        logging.info("Repo %s not found", remote)
-
-                    bad_commits_path = get_local_repo(remote, BAD_COMMITS_DIR)
-                    if os.path.exists(bad_commits_path):
-                        shutil.rmtree(bad_commits_path)
-                        logging.info("Deleted bad commits for repo %s", remote)
-                    else:
-                        logging.info("Bad commits for repo %s not found", remote)
-
-                    logging.info("Ingesting %s for segment %s", remote, segment_id)
-                    queue.ingest_remote(
-                        segment_id=segment_id,
-                        integration_id=integration_id,
-                        remote=remote,
-                        since=since,
-                        until=until,
-                    )
+        # Held through the deletions and every segment's ingestion
+        lease = acquire_lease(get_repo_name(remote))
+        if lease is None:
+            return
+
+        try:
+            index = RemoteIndex(
+                get_remotes(
+                    os.environ["CROWD_HOST"],
+                    os.environ["CROWD_API_KEY"],
+                )
+            )
+
+            segments = index.lookup(remote)
+            # As crowd-git-ingest --reonboard does
+            if reclone and segments:
+                delete_local_repo(remote)
+            elif segments and since is None and until is None:
+                delete_bad_commits(remote)
+
+            # The segments of the tenant tracking the remote, with a single extraction
+            if segments:
+                logging.info(
+                    "Ingesting %s for segments %s",
+                    remote,
+                    ", ".join(segment_id for segment_id, _ in segments),
+                )
+                queue.ingest_segments(
+                    remote,
+                    segments,
+                    since=since,
+                    until=until,
+                    force=force,
+                    lease=lease,
+                    full_history=since is None and until is None,
+                    # Asked for explicitly, the whole history, not only the recent part
+                    backfill=since is None and until is None,
+                )
+        finally:
+            lease.release()
 
 
 @app.get("/")
@@ -85,6 +106,17 @@ async def root(token: HTTPAuthorizationCredentials = Depends(auth_scheme)):
     return {"message": "Hello World"}
 
 
+@app.get("/metrics", response_class=PlainTextResponse)
+async def ingestion_metrics(token: HTTPAuthorizationCredentials = Depends(auth_scheme)):
+    if not secrets.compare_digest(token.credentials, os.environ["AUTH_TOKEN"]):
+        raise HTTPException(
+            status_code=status.HTTP_401_UNAUTHORIZED,
+            detail="Incorrect bearer token",
+            headers={"WWW-Authenticate": "Bearer"},
+        )
+    return PlainTextResponse(metrics.render(), media_type="text/plain; version=0.0.4")
+
+
 @app.get("/stats")
 async def repo_stats(remote: str, token: HTTPAuthorizationCredentials = Depends(auth_scheme)):
     if not secrets.compare_digest(token.credentials, os.environ["AUTH_TOKEN"]):
@@ -205,6 +237,7 @@ async def reonboard_remote_period(
     since: str,
     until: str,
     bg_tasks: BackgroundTasks,
+    force: bool = False,
     token: HTTPAuthorizationCredentials = Depends(auth_scheme),
 ):
     if not secrets.compare_digest(token.credentials, os.environ["AUTH_TOKEN"]):
@@ -220,15 +253,16 @@ async def reonboard_remote_period(
         raise HTTPException(status_code=404, detail="Repository not found")
 
     repo_name = get_repo_name(remote)
-    semaphore = os.path.join(RUNNING_DIR, repo_name)
-
-    if os.path.exists(semaphore):
-        with open(semaphore, "r", encoding="utf-8") as fin:
-            timestamp = fin.read().strip()
-        logging.info("Skipping %s, already running since %s", repo_name, timestamp)
-        return {"message": f"Repository {repo_name} is already being processed since {timestamp}"}
+    holder = get_lease_store().get(repo_name)
+
+    if holder is not None:
+        timestamp = datetime.fromtimestamp(holder["acquired_at"]).strftime("%Y-%m-%d %H:%M:%S")
+        logging.info("Skipping %s, already being processed by %s since %s", repo_name, holder["owner"], timestamp)
+        return {
+            "message": f"Repository {repo_name} is already being processed by {holder['owner']} since {timestamp}"
+        }
     
-    bg_tasks.add_task(reonboard_repo, remote, since, until)
+    bg_tasks.add_task(reonboard_repo, remote, since, until, force)
     return {"message": "Reonboarding started"}
 
 
@@ -236,6 +270,8 @@ async def reonboard_remote_period(
 async def reonboard_remote(
     remote: str,
     bg_tasks: BackgroundTasks,
+    force: bool = False,
+    reclone: bool = False,
     token: HTTPAuthorizationCredentials = Depends(auth_scheme),
 ):
     if not secrets.compare_digest(token.credentials, os.environ["AUTH_TOKEN"]):
@@ -251,13 +287,14 @@ async def reonboard_remote(
         raise HTTPException(status_code=404, detail="Repository not found")
 
     repo_name = get_repo_name(remote)
-    semaphore = os.path.join(RUNNING_DIR, repo_name)
+    holder = get_lease_store().get(repo_name)
 
-    if os.path.exists(semaphore):
-        with open(semaphore, "r", encoding="utf-8") as fin:
-            timestamp = fin.read().strip()
-        logging.info("Skipping %s, already running since %s", repo_name, timestamp)
-        return {"message": f"Repository {repo_name} is already being processed since {timestamp}"}
+    if holder is not None:
+        timestamp = datetime.fromtimestamp(holder["acquired_at"]).strftime("%Y-%m-%d %H:%M:%S")
+        logging.info("Skipping %s, already being processed by %s since %s", repo_name, holder["owner"], timestamp)
+        return {
+            "message": f"Repository {repo_name} is already being processed by {holder['owner']} since {timestamp}"
+        }
 
-    bg_tasks.add_task(reonboard_repo, remote)
+    bg_tasks.add_task(reonboard_repo, remote, force=force, reclone=reclone)
     return {"message": "Reonboarding started"}
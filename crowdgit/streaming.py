@@ -0,0 +1,191 @@
+# -*- coding: utf-8 -*-
+"""Streaming reading and writing of the records of the command line tools.
+
+Commits and activities are read and written one record at a time, so offline
+runs over huge repositories need constant memory, and the tools can be piped
+together with "-" for standard input or output.
+
+Two formats are supported:
+
+    JSONL   one JSON record per line, used for paths ending in .jsonl or .ndjson
+            and for "-"
+    JSON    a JSON array of records, the format the tools used to write, for
+            every other path. Arrays are also parsed incrementally.
+
+Input files are detected by their content: an array if it starts with "[",
+JSONL otherwise.
+"""
+import sys
+import json
+import contextlib
+from typing import Dict, Iterable, Iterator, IO, Tuple, Any
+
+from crowdgit.serialization import dumps
+
+READ_CHUNK_SIZE = 1 << 16
+JSONL_SUFFIXES = (".jsonl", ".ndjson")
+
+_decoder = json.JSONDecoder()
+
+
+def is_jsonl_path(path: str) -> bool:
+    """
+    >>> is_jsonl_path("commits.jsonl"), is_jsonl_path("-"), is_jsonl_path("commits.json")
+    (True, True, False)
+    """
+    return path == "-" or path.lower().endswith(JSONL_SUFFIXES)
+
+
+@contextlib.contextmanager
+def open_input(path: str) -> Iterator[IO[str]]:
+    if path == "-":
+        yield sys.stdin
+    else:
+        with open(path, "r", encoding="utf-8") as fin:
+            yield fin
+
+
+@contextlib.contextmanager
+def open_output(path: str) -> Iterator[IO[bytes]]:
+    if path == "-":
+        yield sys.stdout.buffer
+        sys.stdout.buffer.flush()
+    else:
+        with open(path, "wb") as fout:
+            yield fout
+
+
+def iter_json_array(fin: IO[str], chunk_size: int = READ_CHUNK_SIZE) -> Iterator[Any]:
+    """
+    Parse the items of the JSON array in `fin` one at a time, keeping in memory only
+    the text of the item being parsed.
+
+    >>> import io
+    >>> list(iter_json_array(io.StringIO('[{"a": 1}, {"b": [2, 3]}, 45]'), chunk_size=4))
+    [{'a': 1}, {'b': [2, 3]}, 45]
+    """
+    buffer = ""
+    position = 0
+    eof = False
+
+    def fill(size: int) -> bool:
+        nonlocal buffer, position, eof
+        if eof:
+            return False
+        data = fin.read(size)
+        if not data:
+            eof = True
+            return False
+        buffer = buffer[position:] + data
+        position = 0
+        return True
+
+    def skip(chars: str):
+        nonlocal position
+        while True:
+            while position < len(buffer) and buffer[position] in chars:
+                position += 1
+            if position < len(buffer) or not fill(chunk_size):
+                return
+
+    skip(" \t\r\n")
+    if buffer[position : position + 1] != "[":
+        raise ValueError("Not a JSON array")
+    position += 1
+
+    read_size = chunk_size
+    while True:
+        skip(" \t\r\n,")
+        if position >= len(buffer):
+            raise ValueError("Unterminated JSON array")
+        if buffer[position] == "]":
+            return
+        try:
+            item, end = _decoder.raw_decode(buffer, position)
+            # A number at the end of the buffer may continue in the next chunk
+            if end < len(buffer) or eof:
+                yield item
+                position = end
+                read_size = chunk_size
+                continue
+        except json.JSONDecodeError:
+            if eof:
+                raise
+        # The item is not all in the buffer yet: read more, more each time, so huge
+        # items are not parsed over and over
+        fill(read_size)
+        read_size *= 2
+
+
+def read_records(path: str) -> Iterator[Dict]:
+    """Iterate over the records of a JSONL file or JSON array in `path` ("-" is
+    the standard input)."""
+    with open_input(path) as fin:
+        first = fin.read(1)
+        while first.isspace():
+            first = fin.read(1)
+        if not first:
+            return
+
+        if first == "[":
+            yield from iter_json_array(_Prepended(first, fin))
+            return
+
+        yield from (json.loads(line) for line in _Prepended(first, fin) if line.strip())
+
+
+def write_records(records: Iterable[Dict], path: str) -> int:
+    """Write `records` to `path` ("-" is the standard output), as JSONL or as a JSON
+    array depending on the path. Returns the number of records written."""
+    count = 0
+    with open_output(path) as fout:
+        if is_jsonl_path(path):
+            for record in records:
+                fout.write(dumps(record) + b"\n")
+                count += 1
+            return count
+
+        fout.write(b"[")
+        for record in records:
+            fout.write(b",\n" if count else b"\n")
+            fout.write(dumps(record))
+            count += 1
+        fout.write(b"\n]\n")
+    return count
+
+
+def write_mapping(items: Iterable[Tuple[str, Any]], path: str, key: str, value: str) -> int:
+    """Write (key, value) pairs as a JSON object, or, for JSONL paths, as one
+    {key: ..., value: ...} record per pair. Returns the number of pairs written."""
+    if is_jsonl_path(path):
+        return write_records(({key: k, value: v} for k, v in items), path)
+
+    count = 0
+    with open_output(path) as fout:
+        fout.write(b"{")
+        for k, v in items:
+            fout.write(b",\n" if count else b"\n")
+            fout.write(dumps(k) + b": " + dumps(v))
+            count += 1
+        fout.write(b"\n}\n")
+    return count
+
+
+class _Prepended:
+    """A text file with `prefix` put back in front of it."""
+
+    def __init__(self, prefix: str, fin: IO[str]):
+        self.prefix = prefix
+        self.fin = fin
+
+    def read(self, size: int = -1) -> str:
+        prefix, self.prefix = self.prefix, ""
+        if size < 0:
+            return prefix + self.fin.read()
+        return prefix + self.fin.read(max(size - len(prefix), 0))
+
+    def __iter__(self) -> Iterator[str]:
+        if self.prefix:
+            prefix, self.prefix = self.prefix, ""
+            yield prefix + self.fin.readline()
+        yield from self.fin
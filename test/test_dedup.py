@@ -0,0 +1,46 @@
+# -*- coding: utf-8 -*-
+
+import os
+
+import crowdgit.dedup
+from crowdgit.dedup import BloomFilter, SentFilter
+
+
+def test_bloom_filter_false_positive_rate():
+    bloom = BloomFilter(10_000, error_rate=0.01)
+    for i in range(10_000):
+        bloom.add(f"in-{i}".encode())
+
+    assert all(f"in-{i}".encode() in bloom for i in range(10_000))
+    false_positives = sum(f"out-{i}".encode() in bloom for i in range(10_000))
+    assert false_positives < 300
+
+
+def test_sent_filter_persists_and_grows(monkeypatch, tmp_path):
+    monkeypatch.setattr(crowdgit.dedup, "BLOOM_INITIAL_CAPACITY", 10)
+    sent = SentFilter("repo", sent_dir=tmp_path)
+    for i in range(50):
+        sent.add("segment", str(i))
+    assert sent.contains("segment", "3")  # not committed yet
+    sent.close()
+
+    sent = SentFilter("repo", sent_dir=tmp_path)
+    assert sent.count == 50
+    assert sent.bloom.capacity >= 50
+    assert all(sent.contains("segment", str(i)) for i in range(50))
+    assert not any(sent.contains("segment", str(i)) for i in range(50, 100))
+    assert (sent.checked, sent.suppressed) == (100, 50)
+    sent.close()
+
+
+def test_sent_filter_rebuilds_stale_bloom(tmp_path):
+    sent = SentFilter("repo", sent_dir=tmp_path)
+    sent.add("segment", "a")
+    sent.close()
+
+    with open(os.path.join(tmp_path, "repo.bloom"), "wb") as fout:
+        fout.write(b"garbage")
+
+    sent = SentFilter("repo", sent_dir=tmp_path)
+    assert sent.contains("segment", "a")
+    sent.close()
@@ -1,6 +1,10 @@
 # -*- coding: utf-8 -*-
 
+from Levenshtein import distance
+
 from crowdgit.activity import extract_activities, extract_activities_fuzzy
+from crowdgit.activitymap import ActivityMap
+from crowdgit.fuzzy import DENYLIST, normalize
 
 
 def test_extract_activities():
@@ -111,3 +115,37 @@ def test_extract_activities():
     ]
 
     assert extract_activities(real_commit_message.split("\n")) == expected_activities
+
+
+def test_extract_activities_fuzzy_keys():
+    commit_message = [
+        "Signed-of-by: Arnd Bergmann <arnd@arndb.de>",
+        "Revieved-by: Ben Noordhuis <info@bnoordhuis.nl>",
+        "Cc: Colin Ihrig <cjihrig@gmail.com>",
+        "Fixes: Anna Henningsen <anna@addaleax.net>",
+    ]
+    expected_activities = [
+        {"Signed-off-by": {"name": "Arnd Bergmann", "email": "arnd@arndb.de"}},
+        {"Reviewed-by": {"name": "Ben Noordhuis", "email": "info@bnoordhuis.nl"}},
+    ]
+    assert extract_activities(commit_message) == []
+    # Short unrelated names (Cc, Fixes) are not stretched into a match
+    assert extract_activities(commit_message, fuzzy=True) == expected_activities
+    assert extract_activities_fuzzy(commit_message) == expected_activities
+
+
+def test_extract_activities_fuzzy_keeps_real_trailers():
+    # Real trailers a typo or two away from a key are not counted as that key
+    commit_message = [
+        "Ported-by: Arnd Bergmann <arnd@arndb.de>",
+        "Asked-by: Ben Noordhuis <info@bnoordhuis.nl>",
+        "Linked-by: Colin Ihrig <cjihrig@gmail.com>",
+    ]
+    assert extract_activities(commit_message, fuzzy=True) == []
+    assert extract_activities_fuzzy(commit_message) == []
+
+
+def test_fuzzy_denylist_is_one_edit_from_its_key():
+    for name, key in DENYLIST.items():
+        assert normalize(name) == name and name not in ActivityMap
+        assert key in ActivityMap and distance(name, key) == 1
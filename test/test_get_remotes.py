@@ -0,0 +1,96 @@
+# -*- coding: utf-8 -*-
+
+import crowdgit.get_remotes
+from crowdgit.get_remotes import RemotesCache
+
+
+class FakeResponse:
+    def __init__(self, status_code, body=None, etag=None):
+        self.status_code = status_code
+        self.body = body
+        self.headers = {"ETag": etag} if etag else {}
+
+    def json(self):
+        return self.body
+
+
+def remotes_of(*remotes):
+    return {"s1": {"integrationId": "i1", "remotes": list(remotes)}}
+
+
+def serve(monkeypatch, responses):
+    requests = []
+
+    def request(url, headers):
+        requests.append(headers)
+        return responses.pop(0)
+
+    monkeypatch.setattr(crowdgit.get_remotes, "_request", request)
+    return requests
+
+
+def test_conditional_requests_after_ttl(monkeypatch, tmp_path):
+    cache = RemotesCache(str(tmp_path / "remotes.json"), ttl=60)
+    body = remotes_of("https://github.com/a/b")
+    requests = serve(monkeypatch, [FakeResponse(200, body, etag='"v1"'), FakeResponse(304), FakeResponse(500)])
+
+    assert cache.get("crowd.dev", "key").remotes == body
+    # Within the TTL, from the cache only
+    assert cache.get("crowd.dev", "key").remotes == body
+    assert len(requests) == 1
+
+    cache.ttl = 0
+    assert cache.get("crowd.dev", "key").remotes == body
+    assert requests[1]["If-None-Match"] == '"v1"'
+    # The API failing, the last list we got
+    assert cache.get("crowd.dev", "key").remotes == body
+    assert len(requests) == 3
+
+
+def test_changes_between_fetches(monkeypatch, tmp_path):
+    cache = RemotesCache(str(tmp_path / "remotes.json"), ttl=0, removed_after=1)
+    serve(
+        monkeypatch,
+        [
+            FakeResponse(200, remotes_of("https://github.com/a/b", "https://github.com/a/c")),
+            FakeResponse(200, remotes_of("https://github.com/a/b.git", "https://github.com/a/d")),
+            FakeResponse(200, {}),
+            FakeResponse(200, remotes_of("https://github.com/a/b")),
+        ],
+    )
+
+    first = cache.get("crowd.dev", "key", track_changes=True)
+    assert (first.added, first.removed) == ([], [])
+    # Another spelling of a remote is the same remote
+    second = cache.get("crowd.dev", "key", track_changes=True)
+    assert (second.added, second.removed) == (["https://github.com/a/d"], ["https://github.com/a/c"])
+    assert second.index.lookup("https://github.com/a/b/") == [("s1", "i1")]
+    # An empty list removes nothing
+    third = cache.get("crowd.dev", "key", track_changes=True)
+    assert (third.added, third.removed) == ([], [])
+    fourth = cache.get("crowd.dev", "key", track_changes=True)
+    assert (fourth.added, fourth.removed) == ([], ["https://github.com/a/d"])
+
+
+def test_remote_is_removed_once_missing_from_consecutive_fetches(monkeypatch, tmp_path):
+    cache = RemotesCache(str(tmp_path / "remotes.json"), ttl=0, removed_after=3)
+    both = remotes_of("https://github.com/a/b", "https://github.com/a/c")
+    partial = remotes_of("https://github.com/a/b")
+    serve(
+        monkeypatch,
+        [FakeResponse(200, both)]
+        + [FakeResponse(200, partial)] * 2
+        + [FakeResponse(200, both)]
+        + [FakeResponse(200, partial), FakeResponse(500), FakeResponse(304), FakeResponse(200, partial)],
+    )
+
+    cache.get("crowd.dev", "key", track_changes=True)
+    # Missing from two responses, and back
+    assert cache.get("crowd.dev", "key", track_changes=True).removed == []
+    assert cache.get("crowd.dev", "key", track_changes=True).removed == []
+    assert cache.get("crowd.dev", "key", track_changes=True).added == []
+    # A failed request is not a response it is missing from
+    assert cache.get("crowd.dev", "key", track_changes=True).removed == []
+    assert cache.get("crowd.dev", "key", track_changes=True).removed == []
+    assert cache.get("crowd.dev", "key", track_changes=True).removed == []
+    assert cache.get("crowd.dev", "key", track_changes=True).removed == ["https://github.com/a/c"]
@@ -0,0 +1,638 @@
+# -*- coding: utf-8 -*-
+
+import os
+import json
+import signal
+import subprocess
+import threading
+import time
+
+import pytest
+
+import crowdgit.checkpoint
+import crowdgit.ingest
+import crowdgit.leases
+import crowdgit.metrics
+import crowdgit.producer
+import crowdgit.ratelimit
+import crowdgit.repo
+import crowdgit.scheduler
+from benchmarks.synthetic import RepoSpec, generate_repo
+from crowdgit.checkpoint import OnboardingCheckpoint
+from crowdgit.ingest import Queue
+from crowdgit.repo import get_repo_name
+from crowdgit.outbox import Outbox
+from crowdgit.dedup import SentFilter
+from crowdgit.get_remotes import RemotesUpdate
+from crowdgit.leases import Lease, SQLiteLeaseStore
+from crowdgit.ratelimit import ONBOARDING
+
+
+class FakeProducer:
+    """Stands in for confluent_kafka.Producer. Its local queue holds `capacity`
+    messages; delivery reports are served on blocking poll and flush."""
+
+    def __init__(self, config, capacity=3, fail_keys=()):
+        self.config = config
+        self.capacity = capacity
+        self.fail_keys = set(fail_keys)
+        self.in_flight = []
+        self.delivered = []
+        self.buffer_errors = 0
+        self.flushes = 0
+        self.topics = []
+
+    def produce(self, topic, key=None, value=None, on_delivery=None):
+        if len(self.in_flight) >= self.capacity:
+            self.buffer_errors += 1
+            raise BufferError("Local: Queue full")
+        self.in_flight.append((key, value, on_delivery))
+        self.topics.append(topic)
+
+    def poll(self, timeout=None):
+        # Nothing is acknowledged by the broker without waiting for it
+        if timeout == 0:
+            return 0
+        served = 0
+        while self.in_flight:
+            key, value, on_delivery = self.in_flight.pop(0)
+            err = "delivery failed" if key in self.fail_keys else None
+            if err is None:
+                self.delivered.append((key, value))
+            if on_delivery:
+                on_delivery(err, FakeMessage(key))
+            served += 1
+        return served
+
+    def flush(self, timeout=None):
+        self.flushes += 1
+        self.poll()
+        return 0
+
+
+class FailEverything:
+    def __contains__(self, key):
+        return True
+
+
+class FakeMessage:
+    def __init__(self, key):
+        self._key = key
+
+    def key(self):
+        return self._key
+
+
+def make_queue(monkeypatch, **producer_kwargs):
+    monkeypatch.setenv("TENANT_ID", "tenant")
+    monkeypatch.setenv("KAFKA_TOPIC", "topic")
+    monkeypatch.setenv("KAFKA_BROKERS", "localhost:9092")
+    monkeypatch.setenv("KAFKA_CONFIG", '{"linger.ms": 5}')
+    monkeypatch.setattr(
+        crowdgit.producer, "Producer", lambda config: FakeProducer(config, **producer_kwargs)
+    )
+    # A fresh process-wide producer and rate limiter, served only by the test
+    monkeypatch.setattr(crowdgit.producer, "KAFKA_POLL_INTERVAL_SECONDS", 0)
+    monkeypatch.setattr(crowdgit.producer, "_manager", None)
+    monkeypatch.setattr(crowdgit.ratelimit, "_limiter", None)
+    return Queue()
+
+
+@pytest.fixture
+def local_dirs(monkeypatch, tmp_path):
+    """Every directory the ingestion writes to, and the lease store, in tmp_path."""
+    monkeypatch.setattr(crowdgit.leases, "_store", SQLiteLeaseStore(str(tmp_path / "leases.db")))
+    monkeypatch.setattr(crowdgit.ingest, "REPOS_DIR", str(tmp_path / "repos"))
+    monkeypatch.setattr(crowdgit.ingest, "BAD_COMMITS_DIR", str(tmp_path / "bad-commits"))
+    monkeypatch.setattr(crowdgit.repo, "BAD_COMMITS_DIR", str(tmp_path / "bad-commits"))
+    monkeypatch.setattr(crowdgit.checkpoint, "CHECKPOINT_DIR", str(tmp_path / "checkpoints"))
+    monkeypatch.setattr(crowdgit.ingest, "OUTBOX_DIR", str(tmp_path / "outbox"))
+    monkeypatch.setattr(crowdgit.ingest, "SENT_DIR", str(tmp_path / "sent"))
+    monkeypatch.setattr(
+        crowdgit.ingest,
+        "Outbox",
+        lambda *args, outbox_dir=None: Outbox(*args, outbox_dir=str(tmp_path / "outbox")),
+    )
+    monkeypatch.setattr(
+        crowdgit.ingest,
+        "SentFilter",
+        lambda name, sent_dir=None: SentFilter(name, sent_dir=str(tmp_path / "sent")),
+    )
+    return tmp_path
+
+
+def test_send_messages_batched(monkeypatch):
+    queue = make_queue(monkeypatch, capacity=3)
+    records = [{"sourceId": str(i), "body": "body"} for i in range(10)]
+
+    stats = queue.send_messages("segment", "integration", records)
+
+    producer = queue.kafka_producer
+    assert stats == {"delivered": 10, "failed": 0, "pending": 0, "skipped": 0}
+    # The shared producer is not flushed, we only wait for our own messages
+    assert producer.flushes == 0
+    assert producer.buffer_errors > 0
+    assert [json.loads(value)["activityData"]["sourceId"] for _, value in producer.delivered] == [
+        str(i) for i in range(10)
+    ]
+    # KAFKA_CONFIG overrides the batching defaults
+    assert producer.config["linger.ms"] == 5
+
+
+def test_queues_share_the_producer(monkeypatch):
+    queue = make_queue(monkeypatch)
+    other = Queue()
+    assert other.kafka_producer is queue.kafka_producer
+    assert other.rate_limiter is queue.rate_limiter
+
+    crowdgit.producer.close_producer()
+    assert queue.kafka_producer.flushes == 1
+    assert Queue().kafka_producer is not queue.kafka_producer
+
+
+def test_send_messages_counts_failures(monkeypatch):
+    queue = make_queue(monkeypatch)
+    queue.kafka_producer.fail_keys = {"tenant-upsert_activities_with_members-git-bad"}
+
+    keys = iter(["good", "bad", "good"])
+    monkeypatch.setattr(crowdgit.ingest, "uuid", lambda: next(keys))
+
+    stats = queue.send_messages("segment", "integration", [{"body": ""}] * 3)
+    assert stats == {"delivered": 2, "failed": 1, "pending": 0, "skipped": 0}
+
+
+def test_send_messages_metrics(monkeypatch):
+    queue = make_queue(monkeypatch)
+    metrics = crowdgit.metrics.Metrics()
+    monkeypatch.setattr(crowdgit.metrics, "METRICS", metrics)
+    monkeypatch.setattr(crowdgit.metrics, "observe", metrics.observe)
+    monkeypatch.setattr(crowdgit.metrics, "inc", metrics.inc)
+
+    queue.send_messages("segment", "integration", [{"body": "body"}] * 4, repo="repo")
+
+    assert metrics.stages[("serialize", "repo")][0] == 1
+    assert metrics.stages[("produce", "repo")][0] == 1
+    assert metrics.counters[("messages", "repo")] == 4
+    assert metrics.counters[("bytes", "repo")] > 0
+    exposition = metrics.render()
+    assert 'crowdgit_messages_total{repo="repo"} 4' in exposition
+    assert 'crowdgit_stage_runs_total{stage="produce",repo="repo"} 1' in exposition
+
+
+def test_drain_outbox_keeps_undelivered(monkeypatch, tmp_path):
+    queue = make_queue(monkeypatch)
+    outbox = Outbox("repo", "segment", "integration", outbox_dir=tmp_path)
+    outbox.append([{"sourceId": str(i), "body": ""} for i in range(3)])
+
+    queue.kafka_producer.fail_keys = {"tenant-upsert_activities_with_members-git-bad"}
+    keys = iter(["good", "bad", "good"])
+    monkeypatch.setattr(crowdgit.ingest, "uuid", lambda: next(keys))
+
+    stats = queue.drain_outbox(outbox)
+    assert stats == {"delivered": 2, "failed": 1, "pending": 0, "skipped": 0}
+    assert outbox.pending() == 2
+
+    monkeypatch.setattr(crowdgit.ingest, "uuid", lambda: "good")
+    queue.kafka_producer.delivered = []
+    queue.drain_outbox(outbox)
+
+    assert outbox.pending() == 0
+    delivered = queue.kafka_producer.delivered
+    assert [json.loads(value)["activityData"]["sourceId"] for _, value in delivered] == ["1", "2"]
+
+
+def test_send_messages_skips_already_sent(monkeypatch, tmp_path):
+    queue = make_queue(monkeypatch)
+    sent_filter = SentFilter("repo", sent_dir=tmp_path)
+    records = [{"sourceId": str(i), "body": ""} for i in range(4)]
+
+    queue.send_messages("segment", "integration", records[:2], sent_filter=sent_filter)
+    stats = queue.send_messages("segment", "integration", records, sent_filter=sent_filter)
+    assert stats == {"delivered": 2, "failed": 0, "pending": 0, "skipped": 2}
+
+    # Other segments tracking the same repository still get everything
+    stats = queue.send_messages("other", "integration", records, sent_filter=sent_filter)
+    assert stats["delivered"] == 4
+
+    # Without the filter (forced) everything is sent again
+    stats = queue.send_messages("segment", "integration", records)
+    assert stats["delivered"] == 4
+
+
+def test_onboarding_lane_is_rate_limited(monkeypatch):
+    monkeypatch.setenv("PRODUCE_RATE_ONBOARDING", "10")
+    monkeypatch.setenv("KAFKA_ONBOARDING_TOPIC", "onboarding-topic")
+    queue = make_queue(monkeypatch)
+    waits = []
+    monkeypatch.setattr(queue, "wait", waits.append)
+    records = [{"sourceId": str(i), "body": ""} for i in range(30)]
+
+    queue.send_messages("segment", "integration", records)
+    assert waits == []
+    assert set(queue.kafka_producer.topics) == {"topic"}
+
+    queue.kafka_producer.topics = []
+    queue.send_messages("segment", "integration", records, lane=ONBOARDING, repo="repo")
+    # 10 messages of burst, then one every 0.1 s
+    assert len(waits) == 20
+    assert set(queue.kafka_producer.topics) == {"onboarding-topic"}
+
+
+def test_member_keys_grouped(monkeypatch, tmp_path):
+    monkeypatch.setenv("KAFKA_PARTITION_KEY", "member")
+    monkeypatch.setenv("KAFKA_GROUP_BY_KEY", "true")
+    queue = make_queue(monkeypatch, capacity=100)
+    outbox = Outbox("repo", "segment", "integration", outbox_dir=tmp_path)
+    authors = ["a", "b", "a", "c", "b", "a"]
+    outbox.append(
+        {
+            "sourceId": str(i),
+            "member": {"identities": [{"value": f"{author}@example.com", "type": "username"}]},
+        }
+        for i, author in enumerate(authors)
+    )
+
+    queue.drain_outbox(outbox)
+
+    delivered = queue.kafka_producer.delivered
+    assert [key.rsplit("-", 1)[1] for key, _ in delivered] == [
+        "a@example.com", "a@example.com", "a@example.com",
+        "b@example.com", "b@example.com", "c@example.com",
+    ]
+    assert [json.loads(value)["activityData"]["sourceId"] for _, value in delivered] == [
+        "0", "2", "5", "1", "4", "3"
+    ]
+    # Out of order deliveries still acknowledge the whole outbox
+    assert outbox.pending() == 0
+
+
+def test_daemon_polls_due_remotes(monkeypatch, local_dirs):
+    queue = make_queue(monkeypatch)
+    monkeypatch.setenv("CROWD_HOST", "localhost")
+    monkeypatch.setenv("CROWD_API_KEY", "key")
+    remotes = {
+        "s1": {"integrationId": "i1", "remotes": ["https://github.com/a/b"]},
+        "s2": {"integrationId": "i2", "remotes": ["https://github.com/a/b", "https://github.com/a/c"]},
+    }
+    monkeypatch.setattr(crowdgit.ingest, "get_remotes_update", lambda host, key: RemotesUpdate(remotes))
+
+    calls = []
+
+    def ingest_segments(remote, segments, verbose=False, lease=None):
+        calls.append((remote, segments))
+        if len(calls) == 2:
+            os.kill(os.getpid(), signal.SIGTERM)
+        return 5
+
+    monkeypatch.setattr(queue, "ingest_segments", ingest_segments)
+    monkeypatch.setattr(
+        crowdgit.ingest,
+        "Scheduler",
+        lambda: crowdgit.scheduler.Scheduler(path=str(local_dirs / "schedule.json"), min_interval=3600),
+    )
+
+    crowdgit.ingest.run_daemon(queue)
+
+    # Each remote once, for every segment tracking it, then nothing is due for an hour
+    assert sorted(calls) == [
+        ("https://github.com/a/b", [("s1", "i1"), ("s2", "i2")]),
+        ("https://github.com/a/c", [("s2", "i2")]),
+    ]
+    schedule = json.load(open(local_dirs / "schedule.json"))
+    assert sorted(repo["remote"] for repo in schedule) == ["https://github.com/a/b", "https://github.com/a/c"]
+    assert signal.getsignal(signal.SIGTERM) == signal.SIG_DFL
+
+
+def test_heavy_remote_does_not_block_light_ones(monkeypatch, local_dirs):
+    queue = make_queue(monkeypatch)
+    monkeypatch.setenv("CROWD_HOST", "localhost")
+    monkeypatch.setenv("CROWD_API_KEY", "key")
+    # Only the light remote is cloned
+    os.makedirs(local_dirs / "repos" / "github.com-a-light")
+    remotes = {
+        "s1": {"integrationId": "i1", "remotes": ["https://github.com/a/heavy", "https://github.com/a/light"]},
+    }
+    monkeypatch.setattr(crowdgit.ingest, "get_remotes_update", lambda host, key: RemotesUpdate(remotes))
+    monkeypatch.setattr(
+        crowdgit.ingest,
+        "Scheduler",
+        lambda: crowdgit.scheduler.Scheduler(path=str(local_dirs / "schedule.json"), min_interval=3600),
+    )
+
+    light_done = threading.Event()
+    finished = []
+
+    def ingest_segments(remote, segments, verbose=False, lease=None):
+        if remote.endswith("heavy"):
+            # Would time out if the light remote were queued behind this one
+            assert light_done.wait(5)
+            os.kill(os.getpid(), signal.SIGTERM)
+        else:
+            light_done.set()
+        finished.append((remote, threading.current_thread().name))
+        return 1
+
+    monkeypatch.setattr(queue, "ingest_segments", ingest_segments)
+
+    crowdgit.ingest.run_daemon(queue)
+
+    assert [remote for remote, _ in finished] == ["https://github.com/a/light", "https://github.com/a/heavy"]
+    assert finished[0][1].startswith("ingest-light")
+    assert finished[1][1].startswith("ingest-heavy")
+
+
+def test_cron_lanes_use_the_last_durations(monkeypatch, local_dirs):
+    make_queue(monkeypatch)
+    monkeypatch.setenv("CROWD_HOST", "localhost")
+    monkeypatch.setenv("CROWD_API_KEY", "key")
+    remotes = {"s1": {"integrationId": "i1", "remotes": ["https://github.com/a/fast", "https://github.com/a/slow"]}}
+    monkeypatch.setattr(crowdgit.ingest, "get_remotes_update", lambda host, key: RemotesUpdate(remotes))
+    for name in ("github.com-a-fast", "github.com-a-slow"):
+        os.makedirs(local_dirs / "repos" / name)
+    schedule_path = str(local_dirs / "schedule.json")
+    crowdgit.scheduler.Scheduler(path=schedule_path).record_timing("https://github.com/a/slow", 3600)
+    monkeypatch.setattr(
+        crowdgit.ingest, "Scheduler", lambda: crowdgit.scheduler.Scheduler(path=schedule_path)
+    )
+    lanes = {}
+
+    def ingest_remote_segments(queue, remote, segments, **kwargs):
+        lanes[remote] = threading.current_thread().name
+        return 0, True, 1024
+
+    monkeypatch.setattr(crowdgit.ingest, "ingest_remote_segments", ingest_remote_segments)
+    monkeypatch.setattr("sys.argv", ["crowd-git-ingest"])
+
+    crowdgit.ingest.main()
+
+    assert lanes["https://github.com/a/slow"].startswith("ingest-heavy")
+    assert lanes["https://github.com/a/fast"].startswith("ingest-light")
+    # For the next run
+    scheduler = crowdgit.scheduler.Scheduler(path=schedule_path)
+    assert scheduler.get("https://github.com/a/slow").seconds < 3600
+    assert scheduler.get("https://github.com/a/fast").size_bytes == 1024
+
+
+def test_ingest_remote_skips_leased_repo(monkeypatch, local_dirs):
+    queue = make_queue(monkeypatch)
+    store = crowdgit.leases.get_lease_store()
+    assert store.acquire("github.com-a-b", "another-node", ttl=60)
+
+    assert queue.ingest_remote("s1", "i1", "https://github.com/a/b") is None
+    # Neither cloned nor released
+    assert not os.path.exists(local_dirs / "repos")
+    assert store.get("github.com-a-b")["owner"] == "another-node"
+
+
+def test_remote_leased_elsewhere_is_not_a_failed_poll(monkeypatch, local_dirs):
+    queue = make_queue(monkeypatch)
+    store = crowdgit.leases.get_lease_store()
+    assert store.acquire("github.com-a-b", "another-node", ttl=60)
+    scheduler = crowdgit.scheduler.Scheduler(path=None, min_interval=60)
+    scheduler.sync(["https://github.com/a/b"], now=0)
+    remote = scheduler.pop_due(now=0)
+
+    result = crowdgit.ingest.ingest_remote_segments(queue, remote, [("s1", "i1")])
+    crowdgit.ingest._record_polls(scheduler, [(remote, result, 0.1)])
+
+    assert result is None
+    repo = scheduler.get(remote)
+    assert repo.failures == 0 and repo.interval == 60
+    # Polled again in one interval
+    assert scheduler.next_due() is not None
+
+
+def test_removed_remote_state_is_deleted(local_dirs):
+    for repo_name in ("github.com-a-removed", "github.com-a-kept"):
+        os.makedirs(local_dirs / "repos" / repo_name)
+        os.makedirs(local_dirs / "outbox" / repo_name / "s1")
+        SentFilter(repo_name, str(local_dirs / "sent")).close()
+
+    crowdgit.ingest.collect_removed_remotes(["https://github.com/a/removed"])
+
+    assert os.listdir(local_dirs / "repos") == ["github.com-a-kept"]
+    assert os.listdir(local_dirs / "outbox") == ["github.com-a-kept"]
+    assert all(name.startswith("github.com-a-kept") for name in os.listdir(local_dirs / "sent"))
+
+
+def test_removed_remote_outbox_is_sent_before_it_is_deleted(monkeypatch, local_dirs):
+    for segment_id in ("s1", "s2"):
+        outbox = Outbox("github.com-a-removed", segment_id, "i1", outbox_dir=str(local_dirs / "outbox"))
+        outbox.append([{"sourceId": f"{segment_id}-{i}", "body": "body"} for i in range(3)])
+
+    # Kafka fails: nothing is lost
+    queue = make_queue(monkeypatch)
+    queue.kafka_producer.fail_keys = FailEverything()
+    crowdgit.ingest.collect_removed_remotes(["https://github.com/a/removed"], queue)
+    assert Outbox("github.com-a-removed", "s1", "i1", outbox_dir=str(local_dirs / "outbox")).pending() == 3
+
+    queue = make_queue(monkeypatch)
+    crowdgit.ingest.collect_removed_remotes(["https://github.com/a/removed"], queue)
+    delivered = {json.loads(value)["activityData"]["sourceId"] for _, value in queue.kafka_producer.delivered}
+    assert delivered == {f"{segment_id}-{i}" for segment_id in ("s1", "s2") for i in range(3)}
+    assert os.listdir(local_dirs / "outbox") == []
+    assert os.listdir(local_dirs / "sent") == []
+
+
+def test_interrupted_onboarding_resumes(monkeypatch, local_dirs):
+    queue = make_queue(monkeypatch)
+    remote = generate_repo(str(local_dirs / "origin"), RepoSpec(commits=25, merge_ratio=0.0, members=5, seed=1))
+    monkeypatch.setattr(crowdgit.ingest, "ONBOARDING_WINDOW_COMMITS", 10)
+    monkeypatch.setattr(crowdgit.ingest, "ONBOARDING_RECENT_DAYS", 0)
+    windows = []
+    activities = []
+    prepare = crowdgit.ingest.prepare_crowd_activities
+
+    def prepare_window(remote, commits, verbose=False):
+        windows.append(len(commits))
+        activities.extend(prepare(remote, commits))
+        return prepare(remote, commits)
+
+    drain = queue.drain_outbox
+
+    def drain_or_die(*args, **kwargs):
+        # Killed while producing the second window
+        if len(windows) == 2 and not resumed:
+            raise RuntimeError("killed")
+        return drain(*args, **kwargs)
+
+    monkeypatch.setattr(crowdgit.ingest, "prepare_crowd_activities", prepare_window)
+    monkeypatch.setattr(queue, "drain_outbox", drain_or_die)
+
+    resumed = False
+    assert queue.ingest_remote("s1", "i1", remote) is None
+    checkpoint = OnboardingCheckpoint(get_repo_name(remote), "s1")
+    assert checkpoint.load()["done"] == 20 and checkpoint.progress() == 80
+
+    resumed = True
+    assert queue.ingest_remote("s1", "i1", remote) == 5
+
+    # The windows already in the outbox are not extracted again
+    assert windows == [10, 10, 5]
+    assert checkpoint.load() is None
+    delivered = [json.loads(value)["activityData"]["sourceId"] for _, value in queue.kafka_producer.delivered]
+    assert set(delivered) == {activity["sourceId"] for activity in activities}
+    # Onboarded: the next run only looks for new commits
+    assert queue.ingest_remote("s1", "i1", remote) == 0
+
+
+def test_onboarding_sends_recent_commits_first(monkeypatch, local_dirs):
+    queue = make_queue(monkeypatch)
+    remote = generate_repo(str(local_dirs / "origin"), RepoSpec(commits=25, merge_ratio=0.0, members=5, seed=1))
+    monkeypatch.setattr(crowdgit.ingest, "ONBOARDING_WINDOW_COMMITS", 5)
+    # The committer dates of the synthetic history are not in order: say the 12 newest
+    # commits are those of the last days
+    monkeypatch.setattr(crowdgit.ingest, "ONBOARDING_RECENT_DAYS", 90)
+    monkeypatch.setattr(crowdgit.ingest, "count_commits", lambda repo_path, tip, since=None: 12)
+    windows = []
+    activities = []
+    prepare = crowdgit.ingest.prepare_crowd_activities
+
+    def prepare_window(remote, commits, verbose=False):
+        windows.append(len(commits))
+        activities.extend(prepare(remote, commits))
+        return prepare(remote, commits)
+
+    monkeypatch.setattr(crowdgit.ingest, "prepare_crowd_activities", prepare_window)
+    repo_name = get_repo_name(remote)
+
+    assert queue.ingest_remote("s1", "i1", remote) == 12
+    assert windows == [5, 5, 2]
+    assert OnboardingCheckpoint.phase(repo_name) == crowdgit.checkpoint.BACKFILL
+
+    # Meanwhile, polls only send the new commits
+    subprocess.run(
+        ["git", "-C", remote, "-c", "user.name=New", "-c", "user.email=new@example.com",
+         "commit", "-q", "--allow-empty", "-m", "New commit"],
+        check=True,
+    )
+    assert queue.ingest_remote("s1", "i1", remote) == 1
+    assert windows == [5, 5, 2, 1]
+
+    assert queue.ingest_remote("s1", "i1", remote, backfill=True, max_windows=1) == 5
+    assert queue.ingest_remote("s1", "i1", remote, backfill=True) == 8
+    assert windows == [5, 5, 2, 1, 5, 5, 3]
+    assert OnboardingCheckpoint.phase(repo_name) is None
+    assert queue.ingest_remote("s1", "i1", remote, backfill=True) == 0
+
+    delivered = [json.loads(value)["activityData"]["sourceId"] for _, value in queue.kafka_producer.delivered]
+    assert set(delivered) == {activity["sourceId"] for activity in activities}
+
+
+def test_remote_is_extracted_once_for_every_segment(monkeypatch, local_dirs):
+    queue = make_queue(monkeypatch)
+    remote = generate_repo(str(local_dirs / "origin"), RepoSpec(commits=25, merge_ratio=0.0, members=5, seed=1))
+    monkeypatch.setattr(crowdgit.ingest, "ONBOARDING_WINDOW_COMMITS", 10)
+    monkeypatch.setattr(crowdgit.ingest, "ONBOARDING_RECENT_DAYS", 0)
+    windows = []
+    prepare = crowdgit.ingest.prepare_crowd_activities
+
+    def prepare_window(remote, commits, verbose=False):
+        windows.append(len(commits))
+        return prepare(remote, commits)
+
+    monkeypatch.setattr(crowdgit.ingest, "prepare_crowd_activities", prepare_window)
+    segments = [("s1", "i1"), ("s2", "i2")]
+
+    def delivered(segment_id):
+        messages = [json.loads(value) for _, value in queue.kafka_producer.delivered]
+        return {
+            message["activityData"]["sourceId"] for message in messages if message["segmentId"] == segment_id
+        }
+
+    assert queue.ingest_segments(remote, segments) == 25
+    assert windows == [10, 10, 5]
+    assert delivered("s1") and delivered("s1") == delivered("s2")
+
+    # The new commits are sent to both, instead of the second segment finding none left
+    subprocess.run(
+        ["git", "-C", remote, "-c", "user.name=New", "-c", "user.email=new@example.com",
+         "commit", "-q", "--allow-empty", "-m", "New commit"],
+        check=True,
+    )
+    before = len(delivered("s1"))
+    assert queue.ingest_segments(remote, segments) == 1
+    assert windows == [10, 10, 5, 1]
+    assert len(delivered("s1")) > before and delivered("s1") == delivered("s2")
+
+
+def test_onboarding_stops_when_the_lease_is_lost(monkeypatch, local_dirs):
+    queue = make_queue(monkeypatch)
+    remote = generate_repo(str(local_dirs / "origin"), RepoSpec(commits=25, merge_ratio=0.0, members=5, seed=1))
+    monkeypatch.setattr(crowdgit.ingest, "ONBOARDING_WINDOW_COMMITS", 10)
+    monkeypatch.setattr(crowdgit.ingest, "ONBOARDING_RECENT_DAYS", 0)
+    repo_name = get_repo_name(remote)
+    store = crowdgit.leases.get_lease_store()
+    lease = Lease(repo_name, store, ttl=0.3)
+    assert lease.acquire()
+    windows = []
+    first_window = set()
+    prepare = crowdgit.ingest.prepare_crowd_activities
+
+    def prepare_window(remote, commits, verbose=False):
+        windows.append(len(commits))
+        activities = prepare(remote, commits)
+        if len(windows) == 1:
+            first_window.update(activity["sourceId"] for activity in activities)
+        else:
+            # Expired while the window was extracted, and taken by another node
+            store.release(repo_name, lease.owner)
+            assert store.acquire(repo_name, "another-node", ttl=60)
+            time.sleep(0.3)
+        return activities
+
+    monkeypatch.setattr(crowdgit.ingest, "prepare_crowd_activities", prepare_window)
+
+    try:
+        assert queue.ingest_remote("s1", "i1", remote, lease=lease) is None
+    finally:
+        lease.release()
+
+    # The second window was neither sent nor checkpointed
+    assert windows == [10, 10]
+    assert OnboardingCheckpoint(repo_name, "s1").load()["done"] == 10
+    delivered = [json.loads(value)["activityData"]["sourceId"] for _, value in queue.kafka_producer.delivered]
+    assert set(delivered) == first_window
+
+
+def test_failed_window_is_not_checkpointed(monkeypatch, local_dirs):
+    queue = make_queue(monkeypatch)
+    remote = generate_repo(str(local_dirs / "origin"), RepoSpec(commits=25, merge_ratio=0.0, members=5, seed=1))
+    monkeypatch.setattr(crowdgit.ingest, "ONBOARDING_WINDOW_COMMITS", 10)
+    monkeypatch.setattr(crowdgit.ingest, "ONBOARDING_RECENT_DAYS", 0)
+    windows = []
+    iter_commits = crowdgit.repo.iter_commits
+
+    def iter_or_fail(repo_path, *args, **kwargs):
+        windows.append(len(kwargs["revisions"]))
+        # git log fails on the second window
+        if len(windows) == 2:
+            raise subprocess.CalledProcessError(128, ["git", "log"])
+        return iter_commits(repo_path, *args, **kwargs)
+
+    monkeypatch.setattr(crowdgit.repo, "iter_commits", iter_or_fail)
+    repo_name = get_repo_name(remote)
+
+    assert queue.ingest_remote("s1", "i1", remote) is None
+    assert OnboardingCheckpoint(repo_name, "s1").load()["done"] == 10
+
+    assert queue.ingest_remote("s1", "i1", remote) == 15
+    assert windows == [10, 10, 10, 5]
+    assert OnboardingCheckpoint.phase(repo_name) is None
+
+
+def test_reonboard_reuses_the_clone(monkeypatch, local_dirs):
+    queue = make_queue(monkeypatch)
+    remote = generate_repo(str(local_dirs / "origin"), RepoSpec(commits=20, merge_ratio=0.0, members=5, seed=1))
+    monkeypatch.setattr(crowdgit.ingest, "ONBOARDING_WINDOW_COMMITS", 10)
+    monkeypatch.setattr(crowdgit.ingest, "ONBOARDING_RECENT_DAYS", 0)
+    segments = [("s1", "i1")]
+
+    assert queue.ingest_segments(remote, segments) == 20
+    marker = os.path.join(local_dirs / "repos", get_repo_name(remote), ".git", "reonboard-marker")
+    open(marker, "w").close()
+    assert queue.ingest_segments(remote, segments) == 0
+
+    # The whole history again, from the same clone
+    assert queue.ingest_segments(remote, segments, full_history=True, force=True) == 20
+    assert os.path.exists(marker)
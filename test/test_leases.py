@@ -0,0 +1,42 @@
+# -*- coding: utf-8 -*-
+
+import time
+
+from crowdgit.leases import HashRing, Lease, SQLiteLeaseStore
+
+
+def test_lease_of_a_crashed_holder_expires(tmp_path):
+    store = SQLiteLeaseStore(str(tmp_path / "leases.db"))
+
+    assert store.acquire("repo", "crashed", ttl=0.2)
+    assert not store.acquire("repo", "other", ttl=60)
+    assert store.get("repo")["owner"] == "crashed"
+    # Never renewed nor released
+    time.sleep(0.3)
+    assert store.get("repo") is None
+    assert store.acquire("repo", "other", ttl=60)
+    assert not store.renew("repo", "crashed", ttl=60)
+
+
+def test_heartbeat_keeps_lease(tmp_path):
+    store = SQLiteLeaseStore(str(tmp_path / "leases.db"))
+    lease = Lease("repo", store, ttl=0.3)
+
+    assert lease.acquire()
+    time.sleep(1)
+    assert not Lease("repo", store, ttl=0.3).acquire()
+    lease.release()
+    assert store.get("repo") is None
+
+
+def test_adding_a_node_moves_its_share_of_the_keys():
+    keys = [f"github.com-org-repo{i}" for i in range(3000)]
+    before = HashRing(["node-a", "node-b", "node-c"])
+    after = HashRing(["node-a", "node-b", "node-c", "node-d"])
+
+    moved = [key for key in keys if before.owner(key) != after.owner(key)]
+
+    # Only to the new node, and about a quarter of them
+    assert all(after.owner(key) == "node-d" for key in moved)
+    assert 0.15 < len(moved) / len(keys) < 0.35
+
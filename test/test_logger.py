@@ -0,0 +1,31 @@
+# -*- coding: utf-8 -*-
+
+import json
+import queue
+
+import crowdgit.logger
+
+
+def test_queue_mode_writes_each_logger_file(monkeypatch, tmp_path):
+    # A listener of our own, writing to tmp_path
+    monkeypatch.setattr(crowdgit.logger, "LOCAL_DIR", str(tmp_path))
+    monkeypatch.setattr(crowdgit.logger, "LOG_MODE", "queue")
+    monkeypatch.setattr(crowdgit.logger, "LOG_SAMPLING", "test-logger-b=2")
+    monkeypatch.setattr(crowdgit.logger, "_queue", queue.SimpleQueue())
+    monkeypatch.setattr(crowdgit.logger, "_listener", None)
+
+    logger_a = crowdgit.logger.get_logger("test-logger-a")
+    logger_b = crowdgit.logger.get_logger("test-logger-b")
+    args = ["first"]
+    logger_a.info("Message %s", args)
+    # Arguments are rendered in the call, not by the listener
+    args.append("second")
+    for i in range(5):
+        logger_b.warning("Sampled %d", i)
+    crowdgit.logger.stop_listener()
+
+    records_a = [json.loads(line) for line in open(tmp_path / "logs" / "test-logger-a.log")]
+    records_b = [json.loads(line) for line in open(tmp_path / "logs" / "test-logger-b.log")]
+    assert [record["message"] for record in records_a] == ["Message ['first']"]
+    assert [record["message"] for record in records_b] == ["Sampled 0", "Sampled 2", "Sampled 4"]
+    assert all(record["sampled"] == 2 for record in records_b)
@@ -0,0 +1,68 @@
+# -*- coding: utf-8 -*-
+
+import os
+
+from crowdgit.outbox import Outbox, OutboxTracker
+
+
+def records(start, end):
+    return [{"sourceId": str(i), "body": "x" * 50} for i in range(start, end)]
+
+
+def source_ids(outbox):
+    return [int(record["sourceId"]) for record in outbox.read()]
+
+
+def test_append_read_ack_across_segments(tmp_path):
+    outbox = Outbox("repo", "segment", "integration", outbox_dir=tmp_path, segment_bytes=200)
+
+    assert outbox.append(records(0, 10)) == 10
+    assert outbox.append(records(10, 12)) == 2
+    assert len(outbox._segments()) > 1
+    assert source_ids(outbox) == list(range(12))
+
+    outbox.ack(7)
+    assert outbox.pending() == 5
+    assert source_ids(outbox) == list(range(7, 12))
+    assert min(outbox._segments()) <= 7
+
+    # A new process sees the same state
+    reopened = Outbox("repo", "segment", "integration", outbox_dir=tmp_path, segment_bytes=200)
+    assert (reopened.acked, reopened.next_offset) == (7, 12)
+    assert source_ids(reopened) == list(range(7, 12))
+
+    reopened.ack(12)
+    assert reopened.pending() == 0
+    assert reopened._segments() == []
+    reopened.append(records(12, 13))
+    assert source_ids(reopened) == [12]
+
+
+def test_recovers_from_incomplete_record(tmp_path):
+    outbox = Outbox("repo", "segment", "integration", outbox_dir=tmp_path)
+    outbox.append(records(0, 3))
+
+    segment = outbox._segment_path(outbox._segments()[-1])
+    with open(segment, "ab") as fout:
+        fout.write(b'{"sourceId": "3", "bo')
+
+    reopened = Outbox("repo", "segment", "integration", outbox_dir=tmp_path)
+    assert reopened.next_offset == 3
+    reopened.append(records(3, 4))
+    assert source_ids(reopened) == [0, 1, 2, 3]
+    assert os.path.getsize(segment) > 0
+
+
+def test_tracker_only_acks_contiguous_deliveries(tmp_path):
+    outbox = Outbox("repo", "segment", "integration", outbox_dir=tmp_path)
+    outbox.append(records(0, 5))
+    tracker = OutboxTracker(outbox, ack_every=1)
+
+    tracker(0, True)
+    tracker(2, True)
+    tracker(1, False)
+    tracker(3, True)
+    tracker.commit()
+
+    assert outbox.acked == 1
+    assert source_ids(outbox) == [1, 2, 3, 4]
@@ -1,5 +1,7 @@
 # -*- coding: utf-8 -*-
 
+import json
+
 from crowdgit.activity import prepare_crowd_activities
 
 
@@ -59,3 +61,79 @@ def test_prepare_crowd_activities():
                               ('co-authored-commit', 'somebody@else.com'),
                               ('signed-off-commit', 'somebody@else.com'),
                               ('reviewed-commit', 'john@example.com')]
+
+
+def test_body_by_reference(monkeypatch):
+    import crowdgit.activity
+
+    commits = [
+        dict(commit, author_datetime=commit["datetime"], committer_datetime=commit["datetime"])
+        for commit in commit_data
+    ]
+    remote = "https://github.com/user/repo"
+
+    activities = prepare_crowd_activities(remote, commits)
+    assert {a["body"] for a in activities[:4]} == {"\n".join(commit_data[0]["message"])}
+    # One string per commit, shared by all its activities
+    assert len({id(a["body"]) for a in activities}) == 2
+
+    monkeypatch.setattr(crowdgit.activity, "ACTIVITY_BODY_MODE", "ref")
+    activities = prepare_crowd_activities(remote, commits)
+    authored = [a for a in activities if a["type"] == "authored-commit"]
+    others = [a for a in activities if a["type"] != "authored-commit"]
+    assert [a["body"] for a in authored] == ["\n".join(c["message"]) for c in commit_data]
+    assert {a["body"] for a in others} == {""}
+    assert [a["attributes"]["bodyRef"] for a in others] == [a["sourceParentId"] for a in others]
+    assert {a["attributes"]["bodyRef"] for a in others} == {"123456", "789012"}
+
+
+def test_parallel_preparation_keeps_order():
+    from crowdgit.activity import prepare_crowd_activities_parallel
+
+    commits = [
+        dict(
+            commit,
+            hash=f"{i:06d}",
+            author_datetime=commit["datetime"],
+            committer_datetime=commit["datetime"],
+        )
+        for i in range(25)
+        for commit in commit_data
+    ]
+    remote = "https://github.com/user/repo"
+
+    serial = prepare_crowd_activities(remote, commits, workers=1)
+    parallel = prepare_crowd_activities_parallel(remote, commits, workers=2, chunk_size=7)
+    assert parallel == serial
+
+
+def test_members_are_shared_and_keep_their_shape():
+    from benchmarks.members import legacy_member, people_of
+
+    commits = [
+        dict(commit, author_datetime=commit["datetime"], committer_datetime=commit["datetime"])
+        for commit in commit_data
+    ]
+    commits[1]["message"] = commits[1]["message"] + [
+        "Reviewed-by: <nobody@example.com>",
+        "Acked-by: Cc: Someone <cc@example.com>",
+    ]
+    activities = prepare_crowd_activities("https://github.com/a/b", commits, workers=1)
+    people = people_of(commits)
+    assert len(people) == len(activities)
+
+    members = {}
+    for (name, email), activity in zip(people, activities):
+        # One member object per (name, email) of the run
+        assert members.setdefault((name, email), activity["member"]) is activity["member"]
+        # As the member of each activity used to be built
+        assert json.dumps(activity["member"]) == json.dumps(legacy_member(name, email))
+    assert len(members) == 6
+    assert members[("", "nobody@example.com")] == {
+        "displayName": "nobody",
+        "identities": [
+            {"platform": "git", "value": "nobody@example.com", "type": "username", "verified": True},
+            {"platform": "git", "value": "nobody@example.com", "type": "email", "verified": False},
+        ],
+    }
+    assert members[("Cc: Someone", "cc@example.com")]["displayName"] == ""
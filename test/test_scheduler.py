@@ -0,0 +1,53 @@
+# -*- coding: utf-8 -*-
+
+from crowdgit.scheduler import Scheduler
+
+REMOTE = "https://github.com/user/repo"
+
+
+def make_scheduler(path=None):
+    return Scheduler(path=path, min_interval=60, max_interval=3600, backoff=2)
+
+
+def test_idle_and_failing_remotes_back_off_up_to_the_maximum():
+    scheduler = make_scheduler()
+    scheduler.sync([REMOTE], now=0)
+    scheduler.record(REMOTE, commits=1000, ok=True, now=0)
+
+    intervals = []
+    now = 0
+    for _ in range(8):
+        now += scheduler.get(REMOTE).interval
+        scheduler.record(REMOTE, commits=0, ok=True, now=now)
+        intervals.append(scheduler.get(REMOTE).interval)
+    assert intervals == [120, 240, 480, 960, 1920, 3600, 3600, 3600]
+
+    scheduler.record(REMOTE, commits=0, ok=False, now=now)
+    assert scheduler.get(REMOTE).failures == 1
+    assert scheduler.get(REMOTE).interval == 3600
+
+
+def test_most_overdue_first_and_removed_remotes_dropped():
+    scheduler = make_scheduler()
+    scheduler.sync(["a", "b", "c"], now=0)
+    # Polled in order, but done at different times: next due b, c, a
+    for remote, done in (("a", 30), ("b", 10), ("c", 20)):
+        assert scheduler.pop_due(now=0) == remote
+        scheduler.record(remote, commits=0, ok=True, now=done)
+
+    scheduler.sync(["a", "b"], now=100)
+    assert scheduler.pop_due(now=50) is None
+    assert [scheduler.pop_due(now=1000) for _ in range(3)] == ["b", "a", None]
+
+
+def test_schedule_survives_restarts(tmp_path):
+    path = str(tmp_path / "schedule.json")
+    scheduler = make_scheduler(path)
+    scheduler.sync([REMOTE], now=0)
+    scheduler.pop_due(now=0)
+    scheduler.record(REMOTE, commits=10, ok=True, now=0)
+    scheduler.record(REMOTE, commits=10, ok=True, now=600)
+
+    restarted = make_scheduler(path)
+    assert restarted.get(REMOTE) == scheduler.get(REMOTE)
+    assert restarted.next_due() == scheduler.get(REMOTE).next_poll
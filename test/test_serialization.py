@@ -0,0 +1,39 @@
+# -*- coding: utf-8 -*-
+
+import json
+
+from crowdgit.serialization import Envelope, truncate_to_bytes
+
+
+def test_truncate_to_bytes():
+    assert truncate_to_bytes("", 1) == ""
+    assert truncate_to_bytes("abc", 3) == "ab"
+    # Never splits a multi-byte character
+    assert truncate_to_bytes("ñññ", 5) == "ññ"
+    assert truncate_to_bytes("ñññ", 4) == "ñ"
+    assert truncate_to_bytes("😀😀", 8) == "😀"
+
+
+def test_envelope_serialize():
+    envelope = Envelope("tenant", "segment", "integration")
+    record = {"sourceId": "abc", "body": 'line "one"\nlíne two'}
+
+    assert json.loads(envelope.serialize(record)) == {
+        "type": "create_and_process_activity_result",
+        "tenantId": "tenant",
+        "segmentId": "segment",
+        "integrationId": "integration",
+        "activityData": record,
+    }
+
+
+def test_envelope_truncates_oversized_body():
+    envelope = Envelope("tenant", "segment", "integration", max_bytes=1000)
+    # Quotes and newlines take two bytes once escaped
+    record = {"sourceId": "abc", "body": '"\n' * 2000}
+
+    message = envelope.serialize(record)
+
+    assert len(message) <= 1000
+    assert json.loads(message)["activityData"]["body"] == record["body"]
+    assert record["body"].startswith('"\n"\n')
@@ -0,0 +1,68 @@
+# -*- coding: utf-8 -*-
+
+import os
+
+import crowdgit.checkpoint
+import crowdgit.ingest
+import crowdgit.leases
+import crowdgit.server
+from crowdgit.checkpoint import OnboardingCheckpoint
+from crowdgit.leases import SQLiteLeaseStore
+
+REMOTE = "https://github.com/a/b"
+
+
+class FakeQueue:
+    calls = []
+
+    def ingest_segments(self, remote, segments, **kwargs):
+        self.calls.append((remote, segments, kwargs))
+        return 0
+
+
+def reonboard(monkeypatch, tmp_path, **kwargs):
+    monkeypatch.setenv("CROWD_HOST", "localhost")
+    monkeypatch.setenv("CROWD_API_KEY", "key")
+    monkeypatch.setattr(crowdgit.leases, "_store", SQLiteLeaseStore(str(tmp_path / "leases.db")))
+    monkeypatch.setattr(
+        crowdgit.server,
+        "get_remotes",
+        lambda host, key: {"s1": {"integrationId": "i1", "remotes": [REMOTE]}},
+    )
+    monkeypatch.setattr(crowdgit.server, "Queue", FakeQueue)
+    FakeQueue.calls = []
+    crowdgit.server.reonboard_repo(REMOTE, **kwargs)
+    return FakeQueue.calls
+
+
+def make_local_state(monkeypatch, tmp_path):
+    monkeypatch.setattr(crowdgit.ingest, "REPOS_DIR", str(tmp_path / "repos"))
+    monkeypatch.setattr(crowdgit.ingest, "BAD_COMMITS_DIR", str(tmp_path / "bad-commits"))
+    monkeypatch.setattr(crowdgit.checkpoint, "CHECKPOINT_DIR", str(tmp_path / "checkpoints"))
+    os.makedirs(tmp_path / "repos" / "github.com-a-b")
+    os.makedirs(tmp_path / "bad-commits")
+    (tmp_path / "bad-commits" / "github.com-a-b.txt").write_text("abc\n")
+    # An onboarding interrupted before its recent commits were sent
+    OnboardingCheckpoint("github.com-a-b", "s1").save(tip="abc", total=10, recent=5, done=0, window=5)
+
+
+def test_reclone_deletes_the_onboarding_checkpoint(monkeypatch, tmp_path):
+    make_local_state(monkeypatch, tmp_path)
+
+    calls = reonboard(monkeypatch, tmp_path, reclone=True)
+
+    assert not os.path.exists(tmp_path / "repos" / "github.com-a-b")
+    assert not os.path.exists(tmp_path / "bad-commits" / "github.com-a-b.txt")
+    # Its tip was in the deleted clone
+    assert OnboardingCheckpoint.phase("github.com-a-b") is None
+    assert [(remote, segments) for remote, segments, _ in calls] == [(REMOTE, [("s1", "i1")])]
+    assert calls[0][2]["full_history"]
+
+
+def test_reonboard_deletes_the_bad_commits(monkeypatch, tmp_path):
+    make_local_state(monkeypatch, tmp_path)
+
+    reonboard(monkeypatch, tmp_path)
+
+    assert os.path.exists(tmp_path / "repos" / "github.com-a-b")
+    assert not os.path.exists(tmp_path / "bad-commits" / "github.com-a-b.txt")
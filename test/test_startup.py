@@ -0,0 +1,93 @@
+# -*- coding: utf-8 -*-
+"""Guards the startup of crowd-git-ingest and of the server: modules only needed
+by some code paths must not be imported with them."""
+import os
+import sys
+import subprocess
+
+import pytest
+
+# Loaded by the code paths that use them: producing, progress bars, the remotes API
+LAZY_MODULES = ("confluent_kafka", "tqdm", "requests", "prettytable")
+
+
+def import_profile(module: str, cwd: str) -> dict:
+    """Cumulative import time, in microseconds, of every module imported with `module`."""
+    env = {**os.environ, "CROWD_LOCAL_DIR": os.path.join(cwd, "local")}
+    result = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", f"import {module}"],
+        cwd=cwd,
+        env=env,
+        capture_output=True,
+        text=True,
+        check=True,
+    )
+    profile = {}
+    for line in result.stderr.splitlines():
+        if line.startswith("import time:") and "|" in line:
+            _, cumulative, name = line.split("|")
+            if cumulative.strip().isdigit():
+                profile[name.strip()] = int(cumulative)
+    return profile
+
+
+@pytest.mark.parametrize("module", ["crowdgit.ingest", "crowdgit.server"])
+def test_import_is_lazy(module, tmp_path):
+    if module == "crowdgit.server":
+        pytest.importorskip("fastapi")
+
+    profile = import_profile(module, str(tmp_path))
+
+    assert module in profile
+    slowest = sorted(profile.items(), key=lambda item: -item[1])[:10]
+    loaded = [name for name in LAZY_MODULES if name in profile]
+    assert not loaded, f"{module} imports {loaded}; slowest imports (us): {slowest}"
+    # Nor are log, repository or state directories created
+    assert os.listdir(tmp_path) == []
+
+
+def test_import_does_not_load_env(tmp_path):
+    # .env is loaded by the entry points, not when the package is imported
+    (tmp_path / ".env").write_text("CROWDGIT_STARTUP_TEST=loaded\n")
+    env = {**os.environ, "HOME": str(tmp_path), "CROWD_LOCAL_DIR": str(tmp_path / "local")}
+    env.pop("CROWDGIT_STARTUP_TEST", None)
+    result = subprocess.run(
+        [
+            sys.executable,
+            "-c",
+            "import os, sys, crowdgit, crowdgit.ingest; "
+            "print('dotenv' in sys.modules, os.environ.get('CROWDGIT_STARTUP_TEST'))",
+        ],
+        cwd=tmp_path,
+        env=env,
+        capture_output=True,
+        text=True,
+        check=True,
+    )
+    assert result.stdout.split() == ["False", "None"]
+
+
+def test_run_as_module_loads_env_first(tmp_path):
+    # python -m crowdgit.ingest reads its directories after loading .env
+    (tmp_path / ".env").write_text(f"CROWD_LOCAL_DIR={tmp_path / 'from-env'}\n")
+    env = {**os.environ, "HOME": str(tmp_path)}
+    for name in ("CROWD_LOCAL_DIR", "REPOS_DIR"):
+        env.pop(name, None)
+    result = subprocess.run(
+        [
+            sys.executable,
+            "-c",
+            "import runpy, sys; sys.argv = ['ingest', '--help']\n"
+            "try:\n"
+            "    runpy.run_module('crowdgit.ingest', run_name='__main__', alter_sys=True)\n"
+            "except SystemExit:\n"
+            "    pass\n"
+            "print(sys.modules['crowdgit.repo'].REPOS_DIR, file=sys.stderr)",
+        ],
+        cwd=tmp_path,
+        env={**env, "PYTHONPATH": os.getcwd()},
+        capture_output=True,
+        text=True,
+        check=True,
+    )
+    assert result.stderr.splitlines()[-1] == str(tmp_path / "from-env" / "repos")
@@ -0,0 +1,43 @@
+# -*- coding: utf-8 -*-
+
+import json
+
+from crowdgit.streaming import read_records, write_records, write_mapping, iter_json_array
+
+RECORDS = [{"hash": str(i), "message": ["línea", "x" * i]} for i in range(50)] + [{}]
+
+
+def test_round_trip(tmp_path):
+    for name in ("records.jsonl", "records.json"):
+        path = str(tmp_path / name)
+        assert write_records(iter(RECORDS), path) == len(RECORDS)
+        assert list(read_records(path)) == RECORDS
+
+    # JSON output is still a plain JSON array
+    with open(tmp_path / "records.json", encoding="utf-8") as fin:
+        assert json.load(fin) == RECORDS
+
+
+def test_reads_legacy_indented_arrays_incrementally(tmp_path):
+    path = tmp_path / "legacy.json"
+    path.write_text(json.dumps(RECORDS, indent=2), encoding="utf-8")
+    assert list(read_records(str(path))) == RECORDS
+
+    with open(path, encoding="utf-8") as fin:
+        records = iter_json_array(fin, chunk_size=16)
+        assert next(records) == RECORDS[0]
+        # Only a few chunks were read to parse the first record
+        assert fin.tell() < 200
+
+
+def test_mapping(tmp_path):
+    items = [("a", [1]), ("b", [])]
+    write_mapping(iter(items), str(tmp_path / "m.json"), "hash", "activities")
+    write_mapping(iter(items), str(tmp_path / "m.jsonl"), "hash", "activities")
+
+    with open(tmp_path / "m.json", encoding="utf-8") as fin:
+        assert json.load(fin) == dict(items)
+    assert list(read_records(str(tmp_path / "m.jsonl"))) == [
+        {"hash": "a", "activities": [1]},
+        {"hash": "b", "activities": []},
+    ]
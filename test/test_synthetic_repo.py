@@ -0,0 +1,22 @@
+# -*- coding: utf-8 -*-
+
+from benchmarks.synthetic import RepoSpec, generate_repo
+from crowdgit.repo import get_commits, get_insertions_deletions
+
+
+def test_synthetic_repo(tmp_path):
+    spec = RepoSpec(commits=60, merge_ratio=0.2, members=20, seed=1)
+    repo = generate_repo(str(tmp_path / "a"), spec)
+
+    commits = get_commits(repo, "*")
+    merges = [commit for commit in commits if commit["is_merge_commit"]]
+    assert merges
+    # Each merge brings a side branch commit
+    assert len(commits) == spec.commits + len(merges)
+    assert all(commit["message"][-1].count(": ") for commit in commits)
+    assert len(get_insertions_deletions(repo, "*")) == len(commits)
+
+    # Same spec, same history
+    again = get_commits(generate_repo(str(tmp_path / "b"), spec), "*")
+    assert [c["hash"] for c in again] == [c["hash"] for c in commits]
+
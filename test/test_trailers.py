@@ -0,0 +1,186 @@
+# -*- coding: utf-8 -*-
+
+import os
+import subprocess
+
+import pytest
+
+from crowdgit.repo import get_commits
+from crowdgit.activity import extract_activities, prepare_crowd_activities
+from crowdgit.serialization import Envelope
+
+MESSAGES = [
+    "Initial commit",
+    "Fix the frobnicator\n\nIt was broken.\n\nSigned-off-by: Arnd Bergmann <arnd@arndb.de>",
+    "mm: fix a leak\n\nThe leak was found by fuzzing.\n\n"
+    "Reported-by: Guenter Roeck <linux@roeck-us.net>\n"
+    "Reviewed-by: Manivannan Sadhasivam <mani@kernel.org>\n"
+    "Acked-by: John Doe <john.doe@example.com>\n"
+    "Tested-by: Jane Smith <jane.smith@example.com>\n"
+    "Signed-off-by: Linus Torvalds <torvalds@linux-foundation.org>",
+    "Add feature\n\nCo-authored-by: Ada Lovelace <ada@example.com>\n"
+    "signed-off-by: Grace Hopper <grace@example.com>",
+    "Merge the docs\n\nNo trailers here, just text: with a colon.",
+    "Backport a fix\n\nLink: https://lore.kernel.org/r/123\n"
+    "Signed-off-by: Arnd Bergmann <arnd@arndb.de>\n"
+    "(cherry picked from commit 0123456789abcdef0123456789abcdef01234567)",
+]
+
+
+def make_repo(path):
+    def git(*args):
+        subprocess.run(["git", "-C", str(path), *args], check=True, capture_output=True)
+
+    git("init", "-q")
+    git("config", "user.name", "Test Author")
+    git("config", "user.email", "author@example.com")
+    for i, message in enumerate(MESSAGES):
+        (path / "file").write_text(str(i))
+        git("add", "file")
+        git("commit", "-q", "-m", message)
+
+
+def activity_key(activity):
+    return activity["sourceId"], activity["type"], activity["member"]["displayName"]
+
+
+def activity_set(activities):
+    return sorted(activity_key(a) for a in activities)
+
+
+def test_git_trailers_match_regex_extraction(tmp_path):
+    make_repo(tmp_path)
+
+    regex_commits = get_commits(str(tmp_path), "*", trailers=False)
+    git_commits = get_commits(str(tmp_path), "*", trailers=True)
+
+    assert len(git_commits) == len(MESSAGES)
+    assert all("trailers" not in commit for commit in regex_commits)
+    # The trailers line does not leak into the message
+    assert [c["message"] for c in git_commits] == [c["message"] for c in regex_commits]
+    trailers = {commit["message"][0]: commit["trailers"] for commit in git_commits}
+    assert trailers["Backport a fix"] == [
+        "Link: https://lore.kernel.org/r/123",
+        "Signed-off-by: Arnd Bergmann <arnd@arndb.de>",
+    ]
+    assert trailers["Merge the docs"] == []
+
+    remote = "https://github.com/user/repo"
+    regex_activities = prepare_crowd_activities(remote, regex_commits)
+    git_activities = prepare_crowd_activities(remote, git_commits)
+    assert activity_set(git_activities) == activity_set(regex_activities)
+    assert len(regex_activities) == 2 * len(MESSAGES) + 9
+
+
+def fast_import(path, commits):
+    """Create the repository of `commits`, (author, message, parents) with the author
+    and message as bytes and the parents as indexes of earlier commits, on branch main."""
+    subprocess.run(["git", "init", "-q", "-b", "main", str(path)], check=True)
+    stream = []
+    for mark, (author, message, parents) in enumerate(commits, 1):
+        stream += [
+            b"commit refs/heads/main\n",
+            b"mark :%d\n" % mark,
+            b"author " + author + b" %d +0000\n" % (1_600_000_000 + mark),
+            b"committer Test Committer <committer@example.com> %d +0000\n" % (1_600_000_000 + mark),
+            b"data %d\n" % len(message) + message + b"\n",
+        ]
+        if parents:
+            stream.append(b"from :%d\n" % parents[0])
+            stream += [b"merge :%d\n" % parent for parent in parents[1:]]
+        stream.append(b"M 100644 inline file%d\ndata 1\n%d\n\n" % (mark, mark % 10))
+    subprocess.run(
+        ["git", "-C", str(path), "fast-import", "--quiet"], input=b"".join(stream), check=True
+    )
+    subprocess.run(["git", "-C", str(path), "checkout", "-q", "main"], check=True)
+
+
+def test_git_trailers_match_regex_extraction_on_hard_histories(tmp_path):
+    author = b"Test Author <author@example.com>"
+    huge_body = b"".join(b"line %d of a huge body: key: value\n" % i for i in range(10_000))
+    assert len(huge_body) > 256 * 1024
+    fast_import(
+        tmp_path,
+        [
+            (author, b"Initial commit", []),
+            (b"Jos\xe9 P\xe9rez <jose@example.com>", b"Latin-1 author\n\nSigned-off-by: Jos\xe9 P\xe9rez <jose@example.com>", [1]),
+            (author, b"", [2]),
+            (author, b"Side branch\n\nReviewed-by: Ada Lovelace <ada@example.com>", [1]),
+            (author, b"Merge branch 'side'\n\nAcked-by: Grace Hopper <grace@example.com>", [3, 4]),
+            (author, b"Huge body\n\n" + huge_body + b"\nTested-by: Jane Smith <jane.smith@example.com>", [5]),
+        ],
+    )
+
+    regex_commits = get_commits(str(tmp_path), "*", trailers=False)
+    git_commits = get_commits(str(tmp_path), "*", trailers=True)
+
+    assert len(git_commits) == len(regex_commits) == 6
+    assert [c["message"] for c in git_commits] == [c["message"] for c in regex_commits]
+    assert [c["hash"] for c in git_commits] == [c["hash"] for c in regex_commits]
+
+    remote = "https://github.com/user/repo"
+    regex_activities = prepare_crowd_activities(remote, regex_commits)
+    git_activities = prepare_crowd_activities(remote, git_commits)
+    assert activity_set(git_activities) == activity_set(regex_activities)
+    assert len(regex_activities) == 2 * 6 + 4
+    # And serialized, byte for byte
+    envelope = Envelope("tenant", "segment", "integration")
+    assert [envelope.serialize(a) for a in sorted(git_activities, key=activity_key)] == [
+        envelope.serialize(a) for a in sorted(regex_activities, key=activity_key)
+    ]
+
+
+def outside_trailer_block(commit):
+    """The activities of the lines of the message of `commit`, parsed by git, that are
+    not in its final trailer block."""
+    trailers = set(commit["trailers"])
+    return extract_activities([line for line in commit["message"] if line not in trailers])
+
+
+def person_keys(activities):
+    return sorted((name, person["email"]) for activity in activities for name, person in activity.items())
+
+
+def test_regex_extraction_also_matches_lines_outside_the_trailer_block(tmp_path):
+    # The expected difference: a squashed merge lists the trailers of its commits
+    # in the body, and only the final block is trailers to git
+    fast_import(
+        tmp_path,
+        [
+            (
+                b"Test Author <author@example.com>",
+                b"Squashed merge (#12)\n\n* First commit\n\nCo-authored-by: Ada Lovelace <ada@example.com>\n\n"
+                b"* Second commit\n\nSigned-off-by: Grace Hopper <grace@example.com>",
+                [],
+            )
+        ],
+    )
+
+    [regex_commit] = get_commits(str(tmp_path), "*", trailers=False)
+    [git_commit] = get_commits(str(tmp_path), "*", trailers=True)
+
+    assert git_commit["trailers"] == ["Signed-off-by: Grace Hopper <grace@example.com>"]
+    assert person_keys(extract_activities(regex_commit["message"])) == person_keys(
+        extract_activities(git_commit["trailers"]) + outside_trailer_block(git_commit)
+    )
+    assert person_keys(outside_trailer_block(git_commit)) == [("Co-authored-by", "ada@example.com")]
+
+
+def test_git_trailers_parity_on_a_real_history():
+    # This checkout's own history, or the clone in TRAILER_PARITY_REPO
+    repo_path = os.environ.get("TRAILER_PARITY_REPO") or os.path.dirname(os.path.dirname(__file__))
+    if subprocess.run(["git", "-C", repo_path, "rev-parse", "HEAD"], capture_output=True).returncode:
+        pytest.skip(f"{repo_path} is not a git repository")
+
+    regex_commits = get_commits(repo_path, "*", trailers=False)
+    git_commits = get_commits(repo_path, "*", trailers=True)
+
+    assert regex_commits
+    assert [c["hash"] for c in git_commits] == [c["hash"] for c in regex_commits]
+    assert [c["message"] for c in git_commits] == [c["message"] for c in regex_commits]
+    for regex_commit, git_commit in zip(regex_commits, git_commits):
+        # Every trailer git finds is found by the regexes, which also find the
+        # trailer-like lines outside the final trailer block
+        assert person_keys(extract_activities(regex_commit["message"])) == person_keys(
+            extract_activities(git_commit["trailers"]) + outside_trailer_block(git_commit)
+        ), git_commit["hash"]